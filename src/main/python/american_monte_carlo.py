@@ -0,0 +1,194 @@
+import numpy as np
+from common.timeit import timeit
+
+
+def polynomial_basis(degree=2):
+    """
+    Regression basis of a constant, the powers of each asset's normalized price up to degree and the exercise value
+
+    Args:
+        degree: <int> highest power of the normalized asset prices
+
+    Returns:
+        <function> mapping (S_norm, exercise_value) of shapes (n, d) and (n,) to a (n, 2 + d * degree) basis matrix
+    """
+
+    def basis(S_norm, exercise_value):
+        powers = [S_norm ** p for p in range(1, degree + 1)]
+        return np.column_stack([np.ones(len(S_norm))] + powers + [exercise_value])
+
+    return basis
+
+
+class LongstaffSchwartzPricing:
+    """ Least-squares Monte Carlo (Longstaff-Schwartz) price of a Bermudan or American option on one or more assets """
+
+    def __init__(self, S_0, strike_price, short_rate, vol, maturity, exercise_dates, iter_num, option_type='put',
+                 basket='mean', correlation=None, dividend_yield=0, basis=polynomial_basis(2), chunk_size=50000,
+                 seed=None):
+        """
+        Paths are never stored.  The backward pass starts from the terminal Brownian values and regenerates every
+        earlier exercise date from a Brownian bridge, so only the current date's values of each path are held in memory
+        (paths x assets instead of paths x steps x assets).
+
+        Args:
+            S_0: <float> or <np.ndarray> initial price of each underlying asset
+            strike_price: <float> strike price
+            short_rate: <float> annualized risk-free interest rate
+            vol: <float> or <np.ndarray> volatility of each underlying asset
+            maturity: <float> years to maturity
+            exercise_dates: <int> number of equally spaced exercise dates, the last one at maturity.  A large number
+            approximates an American option.
+            iter_num: <int> number of simulated paths
+            option_type: <str> can be 'call' or 'put'
+            basket: <str> how multiple assets are combined into the payoff underlying, 'mean', 'max' or 'min'
+            correlation: <np.ndarray> correlation matrix of the asset returns, defaults to independent assets
+            dividend_yield: <float> or <np.ndarray> continuous dividend yield of each underlying asset
+            basis: <function> mapping (S / S_0, exercise_value) to the regression basis matrix
+            chunk_size: <int> number of paths generated per random number draw
+            seed: <int> seed of the random number generator
+        """
+        self.S_0 = np.atleast_1d(np.asarray(S_0, dtype=float))
+        self.d = len(self.S_0)  # number of underlying assets
+        self.vol = np.broadcast_to(np.asarray(vol, dtype=float), (self.d,))
+        self.dividend_yield = np.broadcast_to(np.asarray(dividend_yield, dtype=float), (self.d,))
+        self.strike_price = strike_price
+        self.short_rate = short_rate
+        self.maturity = maturity
+        self.exercise_dates = exercise_dates
+        self.iter_num = iter_num
+        self.option_type = option_type
+        self.basket = basket
+        self.basis = basis
+        self.chunk_size = chunk_size
+        self.seed = seed
+
+        if option_type not in ['call', 'put'] or basket not in ['mean', 'max', 'min']:
+            raise NotImplementedError
+
+        correlation = np.eye(self.d) if correlation is None else np.asarray(correlation, dtype=float)
+        assert correlation.shape == (self.d, self.d)
+        self.chol = np.linalg.cholesky(correlation)
+
+        self.dt = maturity / exercise_dates
+        self.discount = np.exp(-short_rate * self.dt)
+        self.coefficients = None
+
+    def exercise_value(self, S):
+        """ Payoff of immediate exercise for prices S of shape (n, d) """
+        underlying = getattr(np, self.basket)(S, axis=1)
+        if self.option_type == 'call':
+            return np.maximum(underlying - self.strike_price, 0)
+        return np.maximum(self.strike_price - underlying, 0)
+
+    def asset_prices(self, W, t):
+        """ Exact GBM prices at time t from independent Brownian values W of shape (n, d) """
+        drift = (self.short_rate - self.dividend_yield - 0.5 * self.vol ** 2) * t
+        return self.S_0 * np.exp(drift + self.vol * (W @ self.chol.T))
+
+    @timeit
+    def compute_pricing(self):
+        """
+        Run the backward induction, storing the fitted continuation value coefficients per exercise date
+
+        Returns:
+            <float> the (in-sample) Longstaff-Schwartz option price
+        """
+        rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(self.seed).spawn(
+            int(np.ceil(self.iter_num / self.chunk_size)))]
+        sizes = [min(self.chunk_size, self.iter_num - i * self.chunk_size) for i in range(len(rngs))]
+
+        # per chunk state: Brownian values at the current date and discounted cashflows of the exercise policy
+        T = self.maturity
+        W = [rng.standard_normal((n, self.d)) * np.sqrt(T) for rng, n in zip(rngs, sizes)]
+        V = [self.exercise_value(self.asset_prices(w, T)) for w in W]
+
+        self.coefficients = [None] * self.exercise_dates
+
+        for k in range(self.exercise_dates - 1, 0, -1):
+            t = k * self.dt
+
+            # Brownian bridge from t + dt back to t: W_t | W_t+dt ~ N(W_t+dt * t / (t + dt), t * dt / (t + dt))
+            for i, rng in enumerate(rngs):
+                W[i] = W[i] * (k / (k + 1)) + rng.standard_normal(W[i].shape) * np.sqrt(self.dt * k / (k + 1))
+                V[i] = V[i] * self.discount
+
+            # regression over all chunks through the accumulated normal equations, in the money paths only
+            state = []
+            XtX, XtY = 0, 0
+            for w, v in zip(W, V):
+                S = self.asset_prices(w, t)
+                h = self.exercise_value(S)
+                itm = h > 0
+                X = self.basis(S[itm] / self.S_0, h[itm])
+                XtX, XtY = XtX + X.T @ X, XtY + X.T @ v[itm]
+                state.append((itm, X, h))
+
+            if isinstance(XtX, int):
+                continue
+            beta = np.linalg.lstsq(XtX, XtY, rcond=None)[0]
+            self.coefficients[k] = beta
+
+            for v, (itm, X, h) in zip(V, state):
+                exercise = np.zeros(len(v), dtype=bool)
+                exercise[itm] = h[itm] > X @ beta
+                v[exercise] = h[exercise]
+
+        return self.discount * sum(v.sum() for v in V) / self.iter_num
+
+    def price_out_of_sample(self, iter_num, seed=None):
+        """
+        Price on fresh paths simulated forward with the exercise policy fitted by compute_pricing().  Since the policy
+        is not fitted on these paths, this is an unbiased estimate of a (sub-optimal) policy i.e. a lower bound.
+
+        Args:
+            iter_num: <int> number of simulated paths
+            seed: <int> seed of the random number generator
+
+        Returns:
+            <float> the out-of-sample option price
+        """
+        assert self.coefficients is not None, 'compute_pricing() must be run first'
+        rng = np.random.default_rng(seed)
+        total = 0
+
+        for start in range(0, iter_num, self.chunk_size):
+            n = min(self.chunk_size, iter_num - start)
+            W = np.zeros((n, self.d))
+            alive = np.ones(n, dtype=bool)
+            value = np.zeros(n)
+
+            for k in range(1, self.exercise_dates + 1):
+                W += rng.standard_normal((n, self.d)) * np.sqrt(self.dt)
+                S = self.asset_prices(W, k * self.dt)
+                h = self.exercise_value(S)
+
+                if k == self.exercise_dates:
+                    exercise = alive
+                elif self.coefficients[k] is None:
+                    continue
+                else:
+                    exercise = alive & (h > 0)
+                    exercise[exercise] = h[exercise] > self.basis(S[exercise] / self.S_0, h[exercise]) @ \
+                        self.coefficients[k]
+
+                value[exercise] = h[exercise] * self.discount ** k
+                alive &= ~exercise
+
+            total += value.sum()
+
+        return total / iter_num
+
+
+if __name__ == '__main__':
+    # American put from the Longstaff-Schwartz (2001) paper, reference value ~4.478
+    x = LongstaffSchwartzPricing(S_0=36, strike_price=40, short_rate=0.06, vol=0.2, maturity=1, exercise_dates=50,
+                                 iter_num=100000, option_type='put', seed=1)
+    print(x.compute_pricing())
+    print(x.price_out_of_sample(100000, seed=2))
+
+    # Bermudan call on the max of two correlated assets
+    y = LongstaffSchwartzPricing(S_0=[100, 100], strike_price=100, short_rate=0.05, vol=[0.2, 0.3], maturity=3,
+                                 exercise_dates=9, iter_num=200000, option_type='call', basket='max',
+                                 correlation=[[1, 0.3], [0.3, 1]], dividend_yield=0.1, seed=1)
+    print(y.compute_pricing())
@@ -3,30 +3,113 @@ import datetime as dt
 import common.constants as const
 import cvxpy as cp
 import numpy as np
+from common.returns_panel import returns_frame
 
 
 # Dealing all with daily data
 
 def calc_beta(df_stock_rets, df_benchmark):
     """
-    Calculate beta
+    Calculate beta as the covariance of the stock and benchmark returns on the dates where both are available, over
+    the variance of the benchmark's full history
 
     Args:
-        df_stock_rets: <pd.DataFrame> of the returns of the stock to evaluate
-        df_benchmark: <pd.DataFrame> of the benchmark returns
+        df_stock_rets: <pd.DataFrame> or ReturnsPanel of the returns of the stock to evaluate
+        df_benchmark: <pd.DataFrame> or ReturnsPanel of the benchmark returns
 
     Returns:
         <float> beta value
     """
-    # combine the dataframes on the date index
-    df = df_stock_rets.merge(df_benchmark, how='inner', left_index=True, right_index=True)
+    df_stock_rets, df_benchmark = returns_frame(df_stock_rets), returns_frame(df_benchmark)
 
-    cov_matrix = df.cov()
-    covar = cov_matrix.iloc[0, 1]
-    bench_var = df_benchmark.var()[0]
+    # combine the dataframes on the date index, cov() skips the dates where either return is missing
+    df = df_stock_rets.merge(df_benchmark, how='inner', left_index=True, right_index=True)
 
     # beta is covar(a,b)/ var(b); where a is the individual stock and b is the benchmark
-    return covar / bench_var
+    return df.cov().iloc[0, 1] / df_benchmark.var().iloc[0]
+
+
+def cumsum_with_zero(a):
+    """ Cumulative sums along the dates with a leading row of zeros, so the sum over rows (s, t] is C[t] - C[s] """
+    return np.concatenate([np.zeros((1,) + a.shape[1:]), np.cumsum(a, axis=0)])
+
+
+def calc_betas(df_stock_rets, df_benchmark, windows=(None,), max_chunk_elements=2000000):
+    """
+    Full sample and rolling beta, alpha and residual volatility of every stock against every benchmark, from the
+    regression r_i = alpha + beta * r_b + e, for each benchmark separately.
+
+    One pass of cumulative sums of x, y, x^2, y^2 and x * y gives the sums over any window as a difference of two
+    rows, so every window length of every stock and benchmark costs O(num_dates) with no per-stock loop.  The returns
+    are centered on their full sample means first, which leaves the statistics unchanged and keeps the differenced
+    sums accurate.  Stocks are processed in chunks to bound the memory of the cross products.
+
+    Args:
+        df_stock_rets: <pd.DataFrame> or ReturnsPanel of the returns of the stocks, one column per stock, no NaNs
+        df_benchmark: <pd.DataFrame> or ReturnsPanel of the returns of one or more benchmarks, no NaNs.  Only the
+        dates in both are used.
+        windows: <list> of window lengths in number of dates, None for the full sample
+        max_chunk_elements: <int> upper bound on dates x benchmarks x stocks of the cross products held at once
+
+    Returns:
+        <dict> of window to <dict> of beta, alpha and residual_vol (the standard deviation of the residual returns,
+        as residual_return_risk).  Each <np.ndarray> has shape (num_benchmarks, num_stocks) for the full sample and
+        (num_dates, num_benchmarks, num_stocks) for a rolling window, NaN before the first full window.  Also
+        dates, stocks and benchmarks: <pd.Index> labelling the axes.
+    """
+    df_stock_rets, df_benchmark = returns_frame(df_stock_rets), returns_frame(df_benchmark)
+    dates = df_stock_rets.index.intersection(df_benchmark.index)
+    Y = df_stock_rets.loc[dates].to_numpy(dtype=float)
+    X = df_benchmark.loc[dates].to_numpy(dtype=float)
+    assert not np.isnan(Y).any() and not np.isnan(X).any()
+
+    num_dates, num_stocks = Y.shape
+    num_benchmarks = X.shape[1]
+    x_mean, y_mean = X.mean(axis=0), Y.mean(axis=0)
+    X, Y = X - x_mean, Y - y_mean
+
+    Sx, Sxx = cumsum_with_zero(X), cumsum_with_zero(X ** 2)
+
+    res_dict = {}
+    for window in windows:
+        assert window is None or 2 < window <= num_dates
+        shape = (num_benchmarks, num_stocks) if window is None else (num_dates, num_benchmarks, num_stocks)
+        res_dict[window] = {k: np.full(shape, np.nan) for k in ['beta', 'alpha', 'residual_vol']}
+
+    chunk = max(1, max_chunk_elements // (num_dates * num_benchmarks))
+    for start in range(0, num_stocks, chunk):
+        cols = slice(start, start + chunk)
+        y = Y[:, cols]
+        Sy, Syy = cumsum_with_zero(y), cumsum_with_zero(y ** 2)
+        Sxy = cumsum_with_zero(X[:, :, None] * y[:, None, :])
+
+        for window in windows:
+            # rows of the cumulative sums at the end and before the start of each window
+            n = num_dates if window is None else window
+            ends = np.arange(n, num_dates + 1)
+            sx, sxx = Sx[ends] - Sx[ends - n], Sxx[ends] - Sxx[ends - n]
+            sy, syy = Sy[ends] - Sy[ends - n], Syy[ends] - Syy[ends - n]
+            sxy = Sxy[ends] - Sxy[ends - n]
+
+            # centered sums of squares and cross products over the window
+            ss_x = sxx - sx ** 2 / n
+            ss_xy = sxy - sx[:, :, None] * sy[:, None, :] / n
+            ss_y = syy - sy ** 2 / n
+
+            beta = ss_xy / ss_x[:, :, None]
+            alpha = (sy / n + y_mean[cols])[:, None, :] - beta * (sx / n + x_mean)[:, :, None]
+            residual_vol = np.sqrt(np.maximum(ss_y[:, None, :] - beta * ss_xy, 0) / (n - 1))
+
+            for k, v in zip(['beta', 'alpha', 'residual_vol'], [beta, alpha, residual_vol]):
+                if window is None:
+                    res_dict[window][k][:, cols] = v[0]
+                else:
+                    res_dict[window][k][n - 1:, :, cols] = v
+
+    res_dict.update({'dates': dates,
+                     'stocks': df_stock_rets.columns,
+                     'benchmarks': df_benchmark.columns})
+    return res_dict
 
 
 def calc_beta_regression(df_stock_rets, df_benchmark):
@@ -34,14 +117,14 @@ def calc_beta_regression(df_stock_rets, df_benchmark):
     Calculate beta by regressing stock returns against the benchmark returns
 
     Args:
-        df_stock_rets: <pd.DataFrame> of the returns of the stock to evaluate
-        df_benchmark: <pd.DataFrame> of the benchmark returns
+        df_stock_rets: <pd.DataFrame> or ReturnsPanel of the returns of the stock to evaluate
+        df_benchmark: <pd.DataFrame> or ReturnsPanel of the benchmark returns
 
     Returns:
         <float> beta value
     """
-    x = np.array(df_benchmark)
-    y = np.array(df_stock_rets)
+    x = np.array(returns_frame(df_benchmark))
+    y = np.array(returns_frame(df_stock_rets))
 
     beta = cp.Variable()
     intercept = cp.Variable()
@@ -63,8 +146,8 @@ def excess_return_daily(df_rets, df_market_rets, beta, rf_rate_annual=0.09 / 100
     Compute an investment's excess return over the market or another benchmark calculated under CAPM
 
     Args:
-        df_rets: <pd.DataFrame> of the returns of the stock to evaluate
-        df_market_rets: <pd.DataFrame> of the market returns or could also be another benchmark
+        df_rets: <pd.DataFrame> or ReturnsPanel of the returns of the stock to evaluate
+        df_market_rets: <pd.DataFrame> or ReturnsPanel of the market returns or could also be another benchmark
         beta: <float> the investment's beta value against df_market_rets
         rf_rate_annual: <float> annual risk free rate, default is from https://ycharts.com/indicators/1_year_treasury_rate
         for the 1 Year Treasury Rate as of Jun 18 2021
@@ -77,8 +160,9 @@ def excess_return_daily(df_rets, df_market_rets, beta, rf_rate_annual=0.09 / 100
     # yields on treasury securities are based on actual day counts (365/366 year basis)
     rf_rate_daily = daily_risk_free_rate(days=365, tres_rate=rf_rate_annual)
 
-    # set up column name for output dataframe
-    df_rets.columns, df_market_rets.columns = [const.EXCESS_RETURN], [const.EXCESS_RETURN]
+    # set up column name for output dataframe, on copies so the callers' frames are left unchanged
+    df_rets = returns_frame(df_rets).set_axis([const.EXCESS_RETURN], axis=1)
+    df_market_rets = returns_frame(df_market_rets).set_axis([const.EXCESS_RETURN], axis=1)
 
     # Excess return = RF + β(MR – RF) – TR
     return rf_rate_daily + beta * (df_market_rets - rf_rate_daily) - df_rets
@@ -100,8 +184,8 @@ def residual_return_risk(stock_excess_rets, benchmark_excess_rets, beta_stock_ov
     assert benchmark_excess_rets.columns == [const.EXCESS_RETURN] and stock_excess_rets.columns == [const.EXCESS_RETURN]
 
     # Residual return = Excess return - (Benchmark's excess return * beta).
-    df = stock_excess_rets - (benchmark_excess_rets * beta_stock_over_benchmark)
-    df.columns = [const.RESIDUAL_RETURN]
+    df = (stock_excess_rets - (benchmark_excess_rets * beta_stock_over_benchmark)).set_axis([const.RESIDUAL_RETURN],
+                                                                                             axis=1)
     return {const.RESIDUAL_RETURN: df,
             const.RESIDUAL_RISK: df.std(),
             const.EXP_RESIDUAL_RETURN: df.mean()}
@@ -129,3 +213,8 @@ if __name__ == '__main__':
 
     # residual returns of the stock over the benchmark
     print(residual_return_risk(stock_excess_rets, benchmark_excess_rets, beta_stock_over_benchmark))
+
+    # 3 month and 1 year rolling betas of the stock over both the market and the benchmark in one pass
+    df_benchmarks = df_market_rets.join(df_benchmark_rets, how='inner')
+    rolling = calc_betas(df_stock_rets, df_benchmarks, windows=[63, const.NUM_TRADE_DAYS_PER_YR])
+    print(rolling[63]['beta'][-1], rolling[const.NUM_TRADE_DAYS_PER_YR]['residual_vol'][-1])
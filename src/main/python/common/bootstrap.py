@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from concurrent.futures import ProcessPoolExecutor
+
+
+def bootstrap_indices(num_obs, num_resamples, method='iid', mean_block_length=None, seed=None):
+    """
+    Matrix of resampled observation indices, generated once and shared by every metric
+
+    Args:
+        num_obs: <int> number of observations (dates) in the sample
+        num_resamples: <int> number of bootstrap resamples
+        method: <str> 'iid' to draw dates independently, or 'stationary' for the Politis-Romano stationary block
+        bootstrap which keeps runs of consecutive dates (volatility clustering, drawdown paths) together
+        mean_block_length: <float> mean block length of the stationary bootstrap, defaults to num_obs ** (1 / 3)
+        seed: <int> seed of the random number generator
+
+    Returns:
+        <np.ndarray> of int indices with shape (num_resamples, num_obs)
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, num_obs, size=(num_resamples, num_obs), dtype=np.int32)
+
+    if method == 'iid':
+        return idx
+    if method != 'stationary':
+        raise NotImplementedError('{} bootstrap has not been implemented'.format(method))
+
+    block_length = mean_block_length if mean_block_length else num_obs ** (1 / 3)
+    new_block = rng.random((num_resamples, num_obs)) < 1 / block_length
+    new_block[:, 0] = True
+
+    # each date continues from the start of its block: start index + dates since the block started, wrapping around
+    dates = np.arange(num_obs, dtype=np.int32)
+    block_start = np.maximum.accumulate(np.where(new_block, dates, 0), axis=1)
+    return (np.take_along_axis(idx, block_start, axis=1) + dates - block_start) % num_obs
+
+
+class ResampledMoments:
+    """
+    Moments of every resample of a chunk, computed lazily and shared between metrics.
+
+    Means, variances and cross moments do not depend on the order of the dates, so they come from a resample count
+    matrix (how often each date was drawn) times the data - one matrix product per moment instead of gathering a
+    resamples x dates x assets array.  Path dependent metrics walk the resampled dates keeping running state only.
+    """
+
+    def __init__(self, idx, rets, bench):
+        """
+        Args:
+            idx: <np.ndarray> resample indices of shape (chunk_resamples, num_obs)
+            rets: <np.ndarray> of asset returns with shape (num_obs, num_assets)
+            bench: <np.ndarray> of benchmark returns with shape (num_obs, 1), or None
+        """
+        self.idx = idx
+        self.num_obs = idx.shape[1]
+        self.rets = rets
+        self.bench = bench
+        self.cache = {}
+
+        # counts[b, t] = number of times date t appears in resample b
+        rows = np.repeat(np.arange(len(idx)), self.num_obs)
+        self.counts = np.bincount(rows * self.num_obs + idx.ravel(),
+                                  minlength=len(idx) * self.num_obs).reshape(len(idx), self.num_obs).astype(float)
+
+    def raw_moment(self, name, x):
+        """ Resample means of x, cached by name """
+        if name not in self.cache:
+            self.cache[name] = self.counts @ x / self.num_obs
+        return self.cache[name]
+
+    def mean(self, x_name):
+        return self.raw_moment(x_name, getattr(self, x_name))
+
+    def covariance(self, x_name, y_name):
+        """ Sample (ddof=1) covariance between two of 'rets' and 'bench' in every resample """
+        x, y = getattr(self, x_name), getattr(self, y_name)
+        cross = self.raw_moment(x_name + '*' + y_name, x * y)
+        return (cross - self.mean(x_name) * self.mean(y_name)) * self.num_obs / (self.num_obs - 1)
+
+    def log_price_paths(self):
+        """
+        Generate the compounded log price of every resample date by date, each of shape (chunk_resamples, num_assets).
+        Path dependent metrics consume these as running state rather than materializing resamples x dates x assets.
+        """
+        log_rets = np.log1p(self.rets)
+        log_price = np.zeros((len(self.idx), self.rets.shape[1]))
+        for t in range(self.num_obs):
+            log_price += log_rets[self.idx[:, t]]
+            yield log_price
+
+
+def resampled_volatility(moments):
+    """ risk_functions.volatility for every resample """
+    return np.sqrt(moments.covariance('rets', 'rets'))
+
+
+def resampled_gaussian_VaR(moments):
+    """ risk_functions.gaussian_VaR for every resample """
+    return moments.mean('rets') + norm.ppf(0.05) * resampled_volatility(moments)
+
+
+def resampled_maximum_drawdown(moments):
+    """ risk_functions.maximum_drawdown of the price path compounded from every resample's returns """
+    peak, drawdown = None, None
+    for log_price in moments.log_price_paths():
+        peak = log_price.copy() if peak is None else np.maximum(peak, log_price, out=peak)
+        drawdown = log_price - peak if drawdown is None else np.minimum(drawdown, log_price - peak, out=drawdown)
+    return np.expm1(drawdown)
+
+
+def resampled_beta(moments):
+    """ capm.calc_beta against the benchmark for every resample """
+    return moments.covariance('rets', 'bench') / moments.covariance('bench', 'bench')
+
+
+def resampled_information_ratio(moments):
+    """
+    apm_functions.information_ratio of the residual return r - beta * r_b (as capm.residual_return_risk) for every
+    resample, with beta re-estimated in each resample
+    """
+    beta = resampled_beta(moments)
+    residual_mean = moments.mean('rets') - beta * moments.mean('bench')
+    # var(r - beta r_b) = var(r) - 2 beta cov(r, r_b) + beta^2 var(r_b) = var(r) - beta cov(r, r_b)
+    residual_var = moments.covariance('rets', 'rets') - beta * moments.covariance('rets', 'bench')
+    return residual_mean / np.sqrt(np.maximum(residual_var, 0))
+
+
+BOOTSTRAP_METRICS = {'volatility': resampled_volatility,
+                     'gaussian_VaR': resampled_gaussian_VaR,
+                     'maximum_drawdown': resampled_maximum_drawdown,
+                     'beta': resampled_beta,
+                     'information_ratio': resampled_information_ratio}
+
+_WORKER_DATA = {}
+
+
+def init_worker(rets, bench):
+    """ Process pool initializer, so the return data is sent once per worker rather than once per chunk """
+    _WORKER_DATA['rets'], _WORKER_DATA['bench'] = rets, bench
+
+
+def evaluate_resamples(idx, metrics):
+    """
+    Evaluate metrics over a chunk of resamples
+
+    Args:
+        idx: <np.ndarray> resample indices of shape (chunk_resamples, num_obs)
+        metrics: <list> of names in BOOTSTRAP_METRICS
+
+    Returns:
+        <dict> of metric name to <np.ndarray> of shape (chunk_resamples, num_assets)
+    """
+    moments = ResampledMoments(idx, _WORKER_DATA['rets'], _WORKER_DATA['bench'])
+    return {m: BOOTSTRAP_METRICS[m](moments) for m in metrics}
+
+
+def bootstrap_confidence_intervals(df_rets, metrics=('volatility', 'gaussian_VaR'), df_benchmark=None,
+                                   num_resamples=10000, method='iid', mean_block_length=None, confidence_level=0.95,
+                                   seed=None, num_workers=None, max_chunk_elements=2000000):
+    """
+    Percentile bootstrap confidence intervals of risk and performance metrics for every asset
+
+    Args:
+        df_rets: <pd.DataFrame> containing return data.  Date index with asset names as columns.
+        metrics: <list> of names in BOOTSTRAP_METRICS
+        df_benchmark: <pd.DataFrame> of the benchmark returns, required for beta and information_ratio
+        num_resamples: <int> number of bootstrap resamples
+        method: <str> 'iid' or 'stationary', see bootstrap_indices()
+        mean_block_length: <float> mean block length of the stationary bootstrap
+        confidence_level: <float> confidence level of the intervals
+        seed: <int> seed of the random number generator
+        num_workers: <int> number of processes to split the resamples across.  None or 1 runs in the current process.
+        max_chunk_elements: <int> upper bound on resamples x assets evaluated at once
+
+    Returns:
+        <dict> of metric name to <pd.DataFrame> with estimate, lower and upper rows and a column per asset
+    """
+    rets = df_rets.to_numpy(dtype=float)
+    bench = None
+    if df_benchmark is not None:
+        bench = df_benchmark.reindex(df_rets.index).to_numpy(dtype=float).reshape(-1, 1)
+    elif {'beta', 'information_ratio'} & set(metrics):
+        raise Exception('df_benchmark is required for the beta and information_ratio metrics')
+
+    num_obs, num_assets = rets.shape
+    idx = bootstrap_indices(num_obs, num_resamples, method, mean_block_length, seed)
+    chunk = max(1, max_chunk_elements // num_assets)
+    idx_chunks = [idx[i:i + chunk] for i in range(0, num_resamples, chunk)]
+
+    if num_workers is None or num_workers == 1:
+        init_worker(rets, bench)
+        chunk_results = [evaluate_resamples(x, metrics) for x in idx_chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker, initargs=(rets, bench)) as executor:
+            chunk_results = list(executor.map(evaluate_resamples, idx_chunks, [metrics] * len(idx_chunks)))
+
+    # point estimates on the original sample, the identity resample
+    init_worker(rets, bench)
+    estimates = evaluate_resamples(np.arange(num_obs)[None], metrics)
+
+    tail = (1 - confidence_level) / 2 * 100
+    res = {}
+    for m in metrics:
+        dist = np.concatenate([x[m] for x in chunk_results])
+        lower, upper = np.percentile(dist, [tail, 100 - tail], axis=0)
+        res[m] = pd.DataFrame([estimates[m][0], lower, upper], index=['estimate', 'lower', 'upper'],
+                              columns=df_rets.columns)
+
+    return res
+
+
+if __name__ == '__main__':
+    import time
+
+    df = pd.DataFrame(np.random.standard_t(4, (252, 500)) * 0.01)
+    df_bench = df.mean(axis=1).to_frame()
+
+    ts = time.time()
+    res = bootstrap_confidence_intervals(df, metrics=list(BOOTSTRAP_METRICS), df_benchmark=df_bench,
+                                         num_resamples=10000, method='stationary', num_workers=4)
+    print('{:.2f} s'.format(time.time() - ts))
+    print(res['volatility'].iloc[:, :5])
+    print(res['maximum_drawdown'].iloc[:, :5])
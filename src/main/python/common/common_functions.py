@@ -9,6 +9,7 @@ from dateutil.relativedelta import relativedelta
 import pandas as pd
 from SimpleStockDataPlot import extract_data
 import datetime as dt
+from common.returns_panel import returns_frame
 
 TOL = 1e-10
 
@@ -34,17 +35,15 @@ def portfolio_return(df_rets, w):
     Return a series of portfolio returns
 
     Args:
-        df_rets: <pd.DataFrame> of individual asset returns.  Columns are asset names, index is dates
+        df_rets: <pd.DataFrame> of individual asset returns.  Columns are asset names, index is dates.  Or a
+        ReturnsPanel.
         w: <np.ndarray> of shape len(df_rets.columns), 1
 
     Returns:
         <pd.DataFrame> of len(df_rets), 1 of portfolio returns
     """
     assert abs(sum(w) - 1) <= TOL
-    df = df_rets.dot(w)
-    df.columns = ['port_rets']
-
-    return df
+    return returns_frame(df_rets).dot(w).set_axis(['port_rets'], axis=1)
 
 
 def active_return_and_risk(df_port_rets, df_benchmark_rets):
@@ -55,22 +54,23 @@ def active_return_and_risk(df_port_rets, df_benchmark_rets):
     sigma_a = std(r_a)
 
     Args:
-        df_port_rets: <pd.DataFrame> containing portfolio returns
-        df_benchmark_rets: <pd.DataFrame> containing benchmark returns
+        df_port_rets: <pd.DataFrame> or ReturnsPanel containing portfolio returns
+        df_benchmark_rets: <pd.DataFrame> or ReturnsPanel containing benchmark returns
 
     Returns:
         <dict> containing <pd.DataFrame> and <float> of active return series and the active risk number
     """
+    df_port_rets, df_benchmark_rets = returns_frame(df_port_rets), returns_frame(df_benchmark_rets)
     assert len(df_port_rets.columns) == 1 and len(df_benchmark_rets.columns) == 1
     col = ['active_return']
-    df_port_rets.columns, df_benchmark_rets.columns = col, col
 
-    df_active_return = df_port_rets.subtract(df_benchmark_rets)
+    # relabelled copies, the callers' frames keep their column names
+    df_active_return = df_port_rets.set_axis(col, axis=1).subtract(df_benchmark_rets.set_axis(col, axis=1))
 
     # we define tracking error to be the same as active risk
 
     return {col[0]: df_active_return,
-            'active_risk_tracking_error': df_active_return.std()[0]}
+            'active_risk_tracking_error': df_active_return.std().iloc[0]}
 
 
 def get_price_data(ticker_ls, end_date, look_back_mths):
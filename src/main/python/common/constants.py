@@ -33,4 +33,7 @@ SIGNALS_DICT = {1: BUY, -1: SELL, 0: HOLD}
 RESIDUAL_RETURN = 'residual_return'
 RESIDUAL_RISK = 'residual_risk'
 EXP_RESIDUAL_RETURN = 'expected_residual_return'
-EXCESS_RETURN = 'excess_return'
\ No newline at end of file
+EXCESS_RETURN = 'excess_return'
+
+VAR = 'VaR'
+CVAR = 'CVaR'
@@ -62,6 +62,26 @@ def standard_normal_with_moment_matching(size):
     return arr
 
 
+def covariance_factor(sigma):
+    """
+    Factor L of a covariance matrix such that L @ L.T == sigma.
+
+    Uses the Cholesky decomposition, and if sigma is not positive definite (e.g. estimated from fewer dates than assets
+    or from pairwise-complete data) repairs it to the nearest PSD matrix by clipping negative eigenvalues.
+
+    Args:
+        sigma: <np.ndarray> covariance matrix
+
+    Returns:
+        <np.ndarray> of the factor L
+    """
+    try:
+        return np.linalg.cholesky(sigma)
+    except np.linalg.LinAlgError:
+        eig_vals, eig_vecs = np.linalg.eigh((sigma + sigma.T) / 2)
+        return eig_vecs * np.sqrt(np.maximum(eig_vals, 0))
+
+
 if __name__ == '__main__':
     x0 = 0.1
     kappa = 3.0
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+SIMPLE = 'simple'
+LOG = 'log'
+
+
+class ReturnsPanel:
+    """
+    Date x asset panel of prices or returns held as one contiguous array, with the derived quantities (simple and log
+    returns, moments, covariance and correlation matrices) computed on first use and cached until new data is appended.
+
+    The analytics in risk_functions, apm_functions, common_functions, capm and PortfolioOptPreprocess accept a panel
+    wherever they take a returns DataFrame, so one dataset is transformed once and shared between them.
+    """
+
+    def __init__(self, data, is_price=True, dtype=np.float64):
+        """
+        Args:
+            data: <pd.DataFrame> of prices or returns.  Date index with asset names as columns.
+            is_price: <bool> True if data holds prices, False if it holds simple returns
+            dtype: dtype of the stored array
+        """
+        self.index = data.index
+        self.columns = data.columns
+        self.values = np.ascontiguousarray(data.to_numpy(dtype=dtype))
+        self.is_price = is_price
+        self.cache = {}
+
+    @classmethod
+    def from_prices(cls, df_price_data, dtype=np.float64):
+        return cls(df_price_data, is_price=True, dtype=dtype)
+
+    @classmethod
+    def from_returns(cls, df_rets, dtype=np.float64):
+        return cls(df_rets, is_price=False, dtype=dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def cached(self, key, func):
+        """ Value of func() cached under key until the panel changes """
+        if key not in self.cache:
+            self.cache[key] = func()
+        return self.cache[key]
+
+    def append(self, data):
+        """
+        Append new dates and drop every cached quantity
+
+        Args:
+            data: <pd.DataFrame> of prices or returns (as the panel holds) with the same columns, dated after the panel
+        """
+        assert list(data.columns) == list(self.columns) and data.index[0] > self.index[-1]
+        self.values = np.ascontiguousarray(np.vstack([self.values, data.to_numpy(dtype=self.values.dtype)]))
+        self.index = self.index.append(data.index)
+        self.cache = {}
+
+    def subset(self, assets=None, start_date=None, end_date=None):
+        """
+        Panel over a subset of assets and/or dates.  A date range alone is a view of this panel's array.
+
+        Args:
+            assets: <list> of asset names, defaults to all
+            start_date: first date to include, defaults to the first date
+            end_date: last date to include, defaults to the last date
+
+        Returns:
+            <ReturnsPanel> with its own cache
+        """
+        rows = self.index.slice_indexer(start_date, end_date)
+        res = ReturnsPanel.__new__(ReturnsPanel)
+        res.index = self.index[rows]
+        res.is_price = self.is_price
+        res.cache = {}
+
+        if assets is None:
+            res.columns, res.values = self.columns, self.values[rows]
+        else:
+            cols = self.columns.get_indexer(assets)
+            assert (cols >= 0).all()
+            res.columns, res.values = self.columns[cols], np.ascontiguousarray(self.values[rows][:, cols])
+        return res
+
+    @property
+    def prices(self):
+        """ <pd.DataFrame> of prices, or of the growth of 1 unit invested for a panel of returns """
+        if self.is_price:
+            return self.cached('prices', lambda: pd.DataFrame(self.values, index=self.index, columns=self.columns))
+        return self.cached('prices', lambda: (1 + self.simple_returns).cumprod())
+
+    @property
+    def simple_returns(self):
+        """ <pd.DataFrame> of simple returns.  From prices the first date, which has no return, is dropped. """
+        def compute():
+            if not self.is_price:
+                return pd.DataFrame(self.values, index=self.index, columns=self.columns)
+            return pd.DataFrame(self.values[1:] / self.values[:-1] - 1, index=self.index[1:], columns=self.columns)
+        return self.cached(SIMPLE, compute)
+
+    @property
+    def log_returns(self):
+        """ <pd.DataFrame> of log returns """
+        return self.cached(LOG, lambda: np.log1p(self.simple_returns))
+
+    def returns(self, kind=SIMPLE):
+        """ <pd.DataFrame> of 'simple' or 'log' returns """
+        if kind not in [SIMPLE, LOG]:
+            raise NotImplementedError('{} returns have not been implemented'.format(kind))
+        return self.simple_returns if kind == SIMPLE else self.log_returns
+
+    # DataFrame-like moments of the returns, so functions written against a returns DataFrame take a panel unchanged
+
+    def mean(self, kind=SIMPLE):
+        return self.cached(('mean', kind), lambda: self.returns(kind).mean())
+
+    def var(self, kind=SIMPLE):
+        return self.cached(('var', kind), lambda: self.returns(kind).var())
+
+    def std(self, kind=SIMPLE):
+        return self.cached(('std', kind), lambda: np.sqrt(self.var(kind)))
+
+    def cov(self, kind=SIMPLE):
+        return self.cached(('cov', kind), lambda: self.returns(kind).cov())
+
+    def corr(self, kind=SIMPLE):
+        return self.cached(('corr', kind), lambda: self.returns(kind).corr())
+
+
+def returns_frame(data, kind=SIMPLE):
+    """ Returns DataFrame of a ReturnsPanel, or a DataFrame passed through unchanged """
+    return data.returns(kind) if isinstance(data, ReturnsPanel) else data
+
+
+def price_frame(data):
+    """ Price DataFrame of a ReturnsPanel, or a DataFrame passed through unchanged """
+    return data.prices if isinstance(data, ReturnsPanel) else data
+
+
+if __name__ == '__main__':
+    from common.common_functions import get_price_data
+    from common.risk_functions import volatility, gaussian_VaR, historical_VaR, maximum_drawdown
+    import datetime as dt
+
+    panel = ReturnsPanel.from_prices(get_price_data(['AAPL', 'NKE', 'GOOGL', 'AMZN'], end_date=dt.datetime.today(),
+                                                    look_back_mths=24))
+
+    # the returns and moments are computed once and shared by every function
+    print(volatility(panel))
+    print(gaussian_VaR(panel))
+    print(historical_VaR(panel))
+    print(maximum_drawdown(panel))
+    print(panel.subset(assets=['AAPL', 'NKE']).cov(kind=LOG))
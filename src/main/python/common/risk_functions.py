@@ -2,6 +2,10 @@ from common.common_functions import get_price_data
 import datetime as dt
 from scipy.stats import norm
 import common.constants as const
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from common.returns_panel import returns_frame, price_frame
 
 
 def volatility(ret_df):
@@ -9,7 +13,7 @@ def volatility(ret_df):
     Standard Deviation
 
     Args:
-        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
 
     Returns:
         <pd.Series> containing standard deviation per asset
@@ -22,12 +26,13 @@ def semi_deviation(ret_df, target=0):
     Standard deviation of the values that fall below a target return
 
     Args:
-        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
         target: <float> defaults to 0
 
     Returns:
         <pd.Series> containing semi-deviation per asset
     """
+    ret_df = returns_frame(ret_df)
     return ret_df[ret_df < target].std()
 
 
@@ -36,7 +41,7 @@ def gaussian_VaR(ret_df):
     Calculate the value at risk for the 95th percentile - i.e. the worst possible outcome in 95% of the cases
 
     Args:
-        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
 
     Returns:
         <pd.Series> containing the value at risk per asset
@@ -51,12 +56,218 @@ def gaussian_VaR(ret_df):
     return ret_df.mean() + z_score * ret_df.std()
 
 
+def returns_matrix(ret_df, weights=None):
+    """
+    Return data as a numpy array, optionally combined into weighted portfolios
+
+    Args:
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
+        weights: <pd.DataFrame> of portfolio weights with asset names as index and portfolio names as columns, or
+        <np.ndarray> of shape (num_assets, num_portfolios).  If None, the assets themselves are evaluated.
+
+    Returns:
+        <np.ndarray> of returns of shape (num_dates, num_columns), <pd.Index> of the column names
+    """
+    ret_df = returns_frame(ret_df)
+    if weights is None:
+        return ret_df.to_numpy(dtype=float), ret_df.columns
+
+    if isinstance(weights, pd.DataFrame):
+        return ret_df[weights.index].to_numpy(dtype=float) @ weights.to_numpy(), weights.columns
+
+    weights = np.asarray(weights, dtype=float).reshape(len(ret_df.columns), -1)
+    return ret_df.to_numpy(dtype=float) @ weights, pd.RangeIndex(weights.shape[1])
+
+
+def tail_statistics(rets, confidence_levels, axis=0):
+    """
+    Historical value at risk and expected shortfall for several confidence levels from a single partial sort
+
+    The VaR is the ceil(alpha * T)-th smallest return (alpha = 1 - confidence level) and the expected shortfall is the
+    mean of the returns up to and including it.  np.partition is called once with every required order statistic, which
+    also leaves the smallest returns in front of each of them, so no full sort or repeated quantile is needed.
+
+    Args:
+        rets: <np.ndarray> of returns
+        confidence_levels: <list> of confidence levels e.g. [0.95, 0.99]
+        axis: <int> axis holding the observations
+
+    Returns:
+        <np.ndarray> VaR and <np.ndarray> expected shortfall, each with axis replaced by one entry per confidence level
+    """
+    rets = np.moveaxis(rets, axis, 0)
+    num_obs = rets.shape[0]
+    alphas = 1 - np.asarray(confidence_levels, dtype=float)
+    # rounded first so that e.g. (1 - 0.95) * 500 does not ceil to 26
+    kth = np.maximum(np.ceil(np.round(alphas * num_obs, 8)).astype(int) - 1, 0)
+
+    partitioned = np.partition(rets, np.unique(kth), axis=0)
+    tail_sums = np.cumsum(partitioned[:kth.max() + 1], axis=0)
+
+    var = partitioned[kth]
+    expected_shortfall = tail_sums[kth] / (kth + 1).reshape((-1,) + (1,) * (rets.ndim - 1))
+
+    return np.moveaxis(var, 0, axis), np.moveaxis(expected_shortfall, 0, axis)
+
+
+def historical_VaR(ret_df, confidence_levels=(0.95, 0.99), weights=None):
+    """
+    Historical simulation value at risk and expected shortfall (CVaR) per asset or weighted portfolio
+
+    Same sign convention as gaussian_VaR - both are returns, so a loss is negative.
+
+    Args:
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
+        confidence_levels: <list> of confidence levels
+        weights: <pd.DataFrame> or <np.ndarray> of portfolio weights, see returns_matrix().  Defaults to the assets.
+
+    Returns:
+        <dict> of <pd.DataFrame> VaR and CVaR with confidence levels as index and assets/portfolios as columns
+    """
+    rets, cols = returns_matrix(ret_df, weights)
+    var, cvar = tail_statistics(rets, confidence_levels)
+
+    return {const.VAR: pd.DataFrame(var, index=list(confidence_levels), columns=cols),
+            const.CVAR: pd.DataFrame(cvar, index=list(confidence_levels), columns=cols)}
+
+
+def parametric_VaR(ret_df, confidence_levels=(0.95, 0.99), weights=None):
+    """
+    Gaussian value at risk and expected shortfall (CVaR) per asset or weighted portfolio, for several confidence levels
+
+    Portfolio moments come from the asset mean vector and covariance matrix, estimated once.
+
+    Args:
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
+        confidence_levels: <list> of confidence levels
+        weights: <pd.DataFrame> or <np.ndarray> of portfolio weights, see returns_matrix().  Defaults to the assets.
+
+    Returns:
+        <dict> of <pd.DataFrame> VaR and CVaR with confidence levels as index and assets/portfolios as columns
+    """
+    if weights is None:
+        mean, std, cols = ret_df.mean().to_numpy(), ret_df.std().to_numpy(), ret_df.columns
+    else:
+        if isinstance(weights, pd.DataFrame):
+            assets, cols, w = weights.index, weights.columns, weights.to_numpy()
+        else:
+            w = np.asarray(weights, dtype=float).reshape(len(ret_df.columns), -1)
+            assets, cols = ret_df.columns, pd.RangeIndex(w.shape[1])
+        mean = ret_df.mean()[assets].to_numpy() @ w
+        std = np.sqrt(np.einsum('ij,ij->j', w, ret_df.cov().loc[assets, assets].to_numpy() @ w))
+
+    alphas = 1 - np.asarray(confidence_levels, dtype=float)[:, None]
+    z_score = norm.ppf(alphas)
+
+    return {const.VAR: pd.DataFrame(mean + z_score * std, index=list(confidence_levels), columns=cols),
+            const.CVAR: pd.DataFrame(mean - std * norm.pdf(z_score) / alphas, index=list(confidence_levels),
+                                     columns=cols)}
+
+
+def monte_carlo_VaR(ret_df, confidence_levels=(0.95, 0.99), weights=None, num_scenarios=100000, seed=None):
+    """
+    Monte carlo value at risk and expected shortfall (CVaR) from multivariate normal scenarios of the asset returns
+
+    Args:
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
+        confidence_levels: <list> of confidence levels
+        weights: <pd.DataFrame> or <np.ndarray> of portfolio weights, see returns_matrix().  Defaults to the assets.
+        num_scenarios: <int> number of simulated return scenarios
+        seed: <int> seed of the random number generator
+
+    Returns:
+        <dict> of <pd.DataFrame> VaR and CVaR with confidence levels as index and assets/portfolios as columns
+    """
+    assets = weights.index if isinstance(weights, pd.DataFrame) else ret_df.columns
+
+    rng = np.random.default_rng(seed)
+    sims = rng.multivariate_normal(ret_df.mean()[assets].to_numpy(), ret_df.cov().loc[assets, assets].to_numpy(),
+                                   size=num_scenarios, method='eigh')
+
+    return historical_VaR(pd.DataFrame(sims, columns=assets), confidence_levels, weights)
+
+
+def rolling_historical_VaR(ret_df, window_days=const.NUM_TRADE_DAYS_PER_YR, confidence_levels=(0.95, 0.99),
+                           weights=None, max_chunk_elements=10000000):
+    """
+    Rolling historical value at risk and expected shortfall (CVaR)
+
+    Windows are strided views of the return array, partitioned a block of windows at a time so memory stays bounded by
+    max_chunk_elements however long the history or however many portfolios.
+
+    Args:
+        ret_df: <pd.DataFrame> containing return data.  Date index with asset names as columns.  Or a ReturnsPanel.
+        window_days: <int> number of days per window
+        confidence_levels: <list> of confidence levels
+        weights: <pd.DataFrame> or <np.ndarray> of portfolio weights, see returns_matrix().  Defaults to the assets.
+        max_chunk_elements: <int> upper bound on the number of returns partitioned at once
+
+    Returns:
+        <dict> of <pd.DataFrame> VaR and CVaR, date index and (confidence level, asset/portfolio) columns.  The first
+        window_days - 1 rows are NaN.
+    """
+    ret_df = returns_frame(ret_df)
+    rets, cols = returns_matrix(ret_df, weights)
+    num_dates, num_cols = rets.shape
+    var = np.full((num_dates, len(confidence_levels), num_cols), np.nan)
+    cvar = np.full((num_dates, len(confidence_levels), num_cols), np.nan)
+
+    # shape (num_windows, num_cols, window_days)
+    windows = sliding_window_view(rets, window_days, axis=0)
+    chunk = max(1, max_chunk_elements // (window_days * num_cols))
+
+    for start in range(0, len(windows), chunk):
+        end = min(start + chunk, len(windows))
+        chunk_var, chunk_cvar = tail_statistics(windows[start:end], confidence_levels, axis=-1)
+        var[start + window_days - 1:end + window_days - 1] = chunk_var.swapaxes(1, 2)
+        cvar[start + window_days - 1:end + window_days - 1] = chunk_cvar.swapaxes(1, 2)
+
+    columns = pd.MultiIndex.from_product([list(confidence_levels), cols])
+    return {const.VAR: pd.DataFrame(var.reshape(num_dates, -1), index=ret_df.index, columns=columns),
+            const.CVAR: pd.DataFrame(cvar.reshape(num_dates, -1), index=ret_df.index, columns=columns)}
+
+
+def rolling_extrema(arr, window_days, func=np.fmax):
+    """
+    Rolling maximum (or minimum) over every column of a date x asset array in O(n), whatever the window length
+
+    van Herk/Gil-Werman algorithm: the series is cut into blocks of window_days, and a running max forward and backward
+    within each block is enough to answer every window with one more elementwise max, since each window spans the end of
+    one block and the start of the next.  All passes are vectorized across the columns.
+
+    Windows are expanding until window_days observations are available (like pandas min_periods=1) and NaNs are
+    skipped.
+
+    Args:
+        arr: <np.ndarray> of shape (num_dates, num_columns)
+        window_days: <int> number of observations per window
+        func: <np.ufunc> np.fmax for a rolling maximum or np.fmin for a rolling minimum
+
+    Returns:
+        <np.ndarray> of the rolling extrema, same shape as arr
+    """
+    arr = np.asarray(arr, dtype=float)
+    num_dates = arr.shape[0]
+    num_blocks = -(-(num_dates + window_days - 1) // window_days)
+
+    # NaN is the identity of fmax/fmin, so padding with it gives the expanding start and whole blocks
+    padded = np.full((num_blocks * window_days,) + arr.shape[1:], np.nan)
+    padded[window_days - 1:window_days - 1 + num_dates] = arr
+    blocks = padded.reshape((num_blocks, window_days) + arr.shape[1:])
+
+    prefix = func.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+
+    return func(suffix[:num_dates], prefix[window_days - 1:window_days - 1 + num_dates])
+
+
 def rolling_maximum_drawdowns(df_price_data, window_days=const.NUM_TRADE_DAYS_PER_YR):
     """
     Compute rolling maximum drawdowns from daily price data
 
     Args:
-        df_price_data: <pd.DataFrame> for an individual stock's price history
+        df_price_data: <pd.DataFrame> for an individual stock's price history, or a panel with one column per stock.
+        Or a ReturnsPanel.
         window_days: <int> number of days for rolling calculation, defaults to number of annual trading days
 
     Returns:
@@ -64,17 +275,98 @@ def rolling_maximum_drawdowns(df_price_data, window_days=const.NUM_TRADE_DAYS_PE
         value
 
     """
+    df_price_data = price_frame(df_price_data)
+
+    max_drawdowns = df_price_data.copy()
+    max_drawdowns[:] = rolling_drawdown_values(df_price_data.to_numpy(dtype=float), window_days)
+
+    return max_drawdowns, max_drawdowns.min()
+
+
+def rolling_drawdown_values(prices, window_days):
+    """
+    Rolling maximum drawdowns of a date x stock price array, see rolling_maximum_drawdowns()
+
+    Returns:
+        <np.ndarray> of rolling max drawdowns, same shape as prices
+    """
     # maximum prior peaks in the last window_days number of days per day
     # allow first 252 days to have an expanding window
-    max_peaks = df_price_data.rolling(window_days, min_periods=1).max()
+    max_peaks = rolling_extrema(prices, window_days, np.fmax)
 
     # will be negative if current date price is lower than the prev window peak i.e. this is a trough
-    daily_drawdowns = (df_price_data - max_peaks) / max_peaks
+    daily_drawdowns = (prices - max_peaks) / max_peaks
 
     # of these daily values, get the rolling minimum which is the maximum drawdown in the previous window_dats
-    max_drawdowns = daily_drawdowns.rolling(window_days, min_periods=1).min()
+    return rolling_extrema(daily_drawdowns, window_days, np.fmin)
 
-    return max_drawdowns, max_drawdowns.min()
+
+def multi_window_maximum_drawdowns(df_price_data, windows_days):
+    """
+    Rolling maximum drawdowns for several window lengths.  The prices are converted to an array once and every
+    window takes its own O(num_dates) rolling extrema passes over it.
+
+    Args:
+        df_price_data: <pd.DataFrame> of price history with one column per stock, or a ReturnsPanel
+        windows_days: <list> of window lengths in number of days
+
+    Returns:
+        <dict> of window length to the rolling_maximum_drawdowns() output for that window
+    """
+    df_price_data = price_frame(df_price_data)
+    prices = df_price_data.to_numpy(dtype=float)
+
+    res_dict = {}
+    for window in windows_days:
+        max_drawdowns = df_price_data.copy()
+        max_drawdowns[:] = rolling_drawdown_values(prices, window)
+        res_dict[window] = (max_drawdowns, max_drawdowns.min())
+    return res_dict
+
+
+def drawdown_analytics(df_price_data):
+    """
+    Maximum drawdown depth, timing and duration for every column in one vectorized pass
+
+    Durations are in number of observations (trading days for daily data).  Columns that have not recovered to their
+    previous peak by the last date, or that never fell below a previous peak, have no recovery date or recovery
+    duration.  Columns without any price are all NaN / None.
+
+    Args:
+        df_price_data: <pd.DataFrame> of price history with one column per stock, or a ReturnsPanel
+
+    Returns:
+        <pd.DataFrame> with a row per metric (max_drawdown, peak_date, trough_date, recovery_date, drawdown_duration,
+        recovery_duration) and a column per stock
+    """
+    df_price_data = price_frame(df_price_data)
+    prices = df_price_data.to_numpy(dtype=float)
+    num_dates, num_cols = prices.shape
+    dates, cols = np.arange(num_dates)[:, None], np.arange(num_cols)
+
+    running_peak = np.fmax.accumulate(prices, axis=0)
+    daily_drawdowns = prices / running_peak - 1
+    has_prices = ~np.isnan(prices).all(axis=0)
+    # argmin skipping NaNs, which also works for columns without any price
+    trough = np.argmin(np.where(np.isnan(daily_drawdowns), np.inf, daily_drawdowns), axis=0)
+    max_drawdown = np.where(has_prices, daily_drawdowns[trough, cols], np.nan)
+
+    # index of the latest running peak on each date, read off at the trough
+    peak = np.maximum.accumulate(np.where(prices >= running_peak, dates, 0), axis=0)[trough, cols]
+
+    # first date after the trough back at or above the peak price, if the price ever fell below a peak
+    recovered_mask = (dates > trough) & (prices >= prices[peak, cols])
+    recovered = recovered_mask.any(axis=0) & (max_drawdown < 0)
+    recovery = np.where(recovered, recovered_mask.argmax(axis=0), -1)
+
+    index = df_price_data.index
+    return pd.DataFrame({'max_drawdown': max_drawdown,
+                         'peak_date': [index[i] if ok else None for i, ok in zip(peak, has_prices)],
+                         'trough_date': [index[i] if ok else None for i, ok in zip(trough, has_prices)],
+                         'recovery_date': [index[i] if ok else None for i, ok in zip(recovery, recovered)],
+                         'drawdown_duration': np.where(has_prices, trough - peak, np.nan),
+                         'recovery_duration': np.where(recovered, recovery - trough, np.nan)},
+                        index=df_price_data.columns).T
 
 
 def maximum_drawdown(df_price_data):
@@ -82,11 +374,12 @@ def maximum_drawdown(df_price_data):
     Get the maximum drawdown from all given price data
 
     Args:
-        df_price_data: <pd.DataFrame> for an individual stock's price history
+        df_price_data: <pd.DataFrame> for an individual stock's price history, or a ReturnsPanel
 
     Returns:
         <pd.Series> containing the maximum drawdown experienced during the given price data history
     """
+    df_price_data = price_frame(df_price_data)
     max_peaks = df_price_data.cummax()
     daily_drawdowns = (df_price_data - max_peaks) / max_peaks
     max_drawdown = daily_drawdowns.cummin()
@@ -102,7 +395,11 @@ if __name__ == '__main__':
     print(volatility(df))
     print(semi_deviation(df))
     print(gaussian_VaR(df))
+    print(historical_VaR(df))
+    print(parametric_VaR(df, weights=np.full((len(ls_assets), 1), 1 / len(ls_assets))))
+    print(rolling_historical_VaR(df, window_days=const.NUM_TRADE_DAYS_PER_MONTH)[const.CVAR].tail())
 
     df_price_data = get_price_data(['AAPL'], end_date=dt.datetime.today(), look_back_mths=48)
     print(rolling_maximum_drawdowns(df_price_data=df_price_data))
     print(maximum_drawdown(df_price_data=df_price_data))
+    print(drawdown_analytics(df_price_data=df_price_data))
@@ -0,0 +1,149 @@
+import numpy as np
+import common.constants as const
+
+
+def triu_to_matrix(triu_values, num_assets):
+    """
+    Unpack one row of upper triangle values (np.triu_indices order) into the full symmetric matrix
+
+    Args:
+        triu_values: <np.ndarray> of length num_assets * (num_assets + 1) / 2
+        num_assets: <int> matrix dimension
+
+    Returns:
+        <np.ndarray> of shape (num_assets, num_assets)
+    """
+    res = np.empty((num_assets, num_assets), dtype=triu_values.dtype)
+    rows, cols = np.triu_indices(num_assets)
+    res[rows, cols] = triu_values
+    res[cols, rows] = triu_values
+    return res
+
+
+class RollingCovarianceEngine:
+    """ Rolling N x N covariance or correlation matrices of a returns panel, computed in one pass """
+
+    def __init__(self, window_days=const.NUM_TRADE_DAYS_PER_YR, correlation=False, dtype=np.float64,
+                 max_chunk_elements=10000000, recompute_every=None):
+        """
+        Only the upper triangle of each matrix is kept (num_assets * (num_assets + 1) / 2 values per date).  The window
+        sums and cross products are updated by adding the entering and removing the leaving observation, a block of
+        dates at a time with a cumulative sum, so each date costs O(num_assets^2) however long the window.
+
+        Args:
+            window_days: <int> window size in number of days
+            correlation: <bool> if True return correlations (Pearson's) instead of covariances
+            dtype: output dtype, e.g. np.float32 to halve the output size.  Accumulation is always in float64.
+            max_chunk_elements: <int> upper bound on dates x pairs held in memory at once
+            recompute_every: <int> number of dates after which the window cross products are recomputed from scratch
+            to stop floating point drift of the running sums.  Defaults to 10 windows.
+        """
+        self.window = window_days
+        self.correlation = correlation
+        self.dtype = dtype
+        self.max_chunk_elements = max_chunk_elements
+        self.recompute_every = recompute_every if recompute_every else 10 * window_days
+
+    def iter_blocks(self, rets):
+        """
+        Generate the rolling results block by block
+
+        Args:
+            rets: <np.ndarray> of returns with shape (num_dates, num_assets), no NaNs
+
+        Yields:
+            <int> row index of the first date in the block, <np.ndarray> of upper triangle values with shape
+            (block_dates, num_pairs)
+        """
+        num_dates, num_assets = rets.shape
+        w = self.window
+        assert num_dates >= w and not np.isnan(rets).any()
+
+        rows, cols = np.triu_indices(num_assets)
+        diag = np.flatnonzero(rows == cols)
+        block_size = max(1, self.max_chunk_elements // len(rows))
+
+        # shift by the first window's mean, covariances are unchanged but the running sums lose less precision
+        y = rets - rets[:w].mean(axis=0)
+
+        def advance(sums, cross, lo, hi):
+            """ Window sums and cross products for the windows ending on dates lo to hi - 1 """
+            enter, leave = y[lo:hi], y[lo - w:hi - w]
+            return (sums + np.cumsum(enter - leave, axis=0),
+                    cross + np.cumsum(enter[:, rows] * enter[:, cols] - leave[:, rows] * leave[:, cols], axis=0))
+
+        last_recompute = -np.inf
+        for start in range(w - 1, num_dates, block_size):
+            end = min(start + block_size, num_dates)
+
+            if start - last_recompute >= self.recompute_every:
+                window_rets = y[start - w + 1:start + 1]
+                sums, cross = window_rets.sum(axis=0), (window_rets.T @ window_rets)[rows, cols]
+                last_recompute = start
+                block_sums, block_cross = advance(sums, cross, start + 1, end)
+                block_sums, block_cross = np.vstack([sums, block_sums]), np.vstack([cross, block_cross])
+            else:
+                block_sums, block_cross = advance(sums, cross, start, end)
+
+            sums, cross = block_sums[-1], block_cross[-1]
+
+            cov = (block_cross - block_sums[:, rows] * block_sums[:, cols] / w) / (w - 1)
+            if self.correlation:
+                std = np.sqrt(cov[:, diag])
+                cov = cov / (std[:, rows] * std[:, cols])
+
+            yield start, cov.astype(self.dtype)
+
+    def __call__(self, df_rets, callback=None, output_path=None):
+        """
+        Run the rolling calculation over a returns panel.
+
+        By default the results are returned in memory.  For large universes pass a callback to consume each block
+        as it is computed, or an output path to stream the results to a .npy file on disk.
+
+        Args:
+            df_rets: <pd.DataFrame> of returns.  Date index with asset names as columns.
+            callback: <function> called with (<pd.DatetimeIndex> block dates, <np.ndarray> block upper triangles)
+            output_path: <str> path to a .npy file to write the (num_windows, num_pairs) results to
+
+        Returns:
+            <pd.Index> of the window end dates and <np.ndarray> (or memory mapped array if output_path is given) of
+            upper triangle values with shape (num_windows, num_pairs), None when a callback is given
+        """
+        rets = df_rets.to_numpy(dtype=float)
+        num_assets = rets.shape[1]
+        num_windows = len(rets) - self.window + 1
+        dates = df_rets.index[self.window - 1:]
+
+        if callback is not None:
+            for start, block in self.iter_blocks(rets):
+                callback(df_rets.index[start:start + len(block)], block)
+            return None
+
+        shape = (num_windows, num_assets * (num_assets + 1) // 2)
+        if output_path:
+            assert output_path.endswith('.npy')
+            res = np.lib.format.open_memmap(output_path, mode='w+', dtype=self.dtype, shape=shape)
+        else:
+            res = np.empty(shape, dtype=self.dtype)
+
+        for start, block in self.iter_blocks(rets):
+            res[start - self.window + 1:start - self.window + 1 + len(block)] = block
+
+        if output_path:
+            res.flush()
+
+        return dates, res
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    df = pd.DataFrame(np.random.standard_normal((5000, 100)) * 0.01,
+                      index=pd.bdate_range('2000-01-01', periods=5000))
+
+    engine = RollingCovarianceEngine(window_days=252, correlation=True, dtype=np.float32)
+    dates, res = engine(df)
+    print(res.shape)
+    print(triu_to_matrix(res[-1], df.shape[1])[:3, :3])
+    print(df.iloc[-252:].corr().iloc[:3, :3])
@@ -0,0 +1,324 @@
+import numpy as np
+
+
+class RunningMoments:
+    """
+    Streaming mean, volatility and semi-deviation per asset (Welford's algorithm).
+
+    Each new return vector is folded in with O(1) work per asset, accumulators over separate partitions of the data can
+    be merged (Chan et al. parallel update), and the state is a plain dict of arrays for checkpointing e.g. with
+    common_functions.write_to_disk().  Results match risk_functions.volatility() and semi_deviation() on the same data.
+    """
+
+    def __init__(self, num_assets=1, target=0):
+        """
+        Args:
+            num_assets: <int> number of return series tracked side by side
+            target: <float> semi-deviation target return, defaults to 0
+        """
+        self.target = target
+        self.count = np.zeros(num_assets)
+        self.mean = np.zeros(num_assets)
+        self.m2 = np.zeros(num_assets)  # sum of squared deviations from the mean
+
+        # same accumulators over the returns below target only
+        self.down_count = np.zeros(num_assets)
+        self.down_mean = np.zeros(num_assets)
+        self.down_m2 = np.zeros(num_assets)
+
+    @staticmethod
+    def welford_update(count, mean, m2, x, mask):
+        """ In place Welford update of the accumulators where mask is True """
+        count += mask
+        delta = np.where(mask, x - mean, 0)
+        mean += delta / np.maximum(count, 1)
+        m2 += delta * np.where(mask, x - mean, 0)
+
+    @staticmethod
+    def chan_merge(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+        """ Combine the accumulators of two disjoint samples """
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        frac_b = np.divide(count_b, count, out=np.zeros_like(count), where=count > 0)
+        return count, mean_a + delta * frac_b, m2_a + m2_b + delta ** 2 * count_a * frac_b
+
+    def update(self, x):
+        """
+        Fold in one new observation per asset, NaNs are skipped
+
+        Args:
+            x: <np.ndarray> or <float> of the latest return per asset
+        """
+        x = np.asarray(x, dtype=float)
+        valid = ~np.isnan(x)
+        self.welford_update(self.count, self.mean, self.m2, x, valid)
+        self.welford_update(self.down_count, self.down_mean, self.down_m2, x, valid & (x < self.target))
+
+    def update_batch(self, ret_arr):
+        """
+        Fold in a block of observations at once, e.g. to seed the accumulators from history
+
+        Args:
+            ret_arr: <np.ndarray> or <pd.DataFrame> of returns with shape (num_dates, num_assets)
+        """
+        batch = RunningMoments.from_array(ret_arr, self.target)
+        self.merge(batch)
+
+    @classmethod
+    def from_array(cls, ret_arr, target=0):
+        """ Accumulators over a (num_dates, num_assets) block of returns, computed with vectorized reductions """
+        ret_arr = np.asarray(ret_arr, dtype=float).reshape(len(ret_arr), -1)
+        res = cls(ret_arr.shape[1], target)
+
+        for mask, attrs in [(~np.isnan(ret_arr), ('count', 'mean', 'm2')),
+                            (ret_arr < target, ('down_count', 'down_mean', 'down_m2'))]:
+            count = mask.sum(axis=0).astype(float)
+            mean = np.where(mask, ret_arr, 0).sum(axis=0) / np.maximum(count, 1)
+            m2 = (np.where(mask, ret_arr - mean, 0) ** 2).sum(axis=0)
+            for attr, val in zip(attrs, [count, mean, m2]):
+                setattr(res, attr, val)
+
+        return res
+
+    def merge(self, other):
+        """
+        Merge the accumulators of another partition of the data into this one
+
+        Args:
+            other: <RunningMoments> over different observations of the same assets
+        """
+        assert self.target == other.target
+        self.count, self.mean, self.m2 = self.chan_merge(self.count, self.mean, self.m2,
+                                                         other.count, other.mean, other.m2)
+        self.down_count, self.down_mean, self.down_m2 = self.chan_merge(self.down_count, self.down_mean, self.down_m2,
+                                                                        other.down_count, other.down_mean,
+                                                                        other.down_m2)
+        return self
+
+    @property
+    def variance(self):
+        """ Sample variance (ddof=1) per asset """
+        return self.m2 / (self.count - 1)
+
+    @property
+    def volatility(self):
+        """ Sample standard deviation per asset """
+        return np.sqrt(self.variance)
+
+    @property
+    def semi_deviation(self):
+        """ Sample standard deviation of the returns below target per asset """
+        return np.sqrt(self.down_m2 / (self.down_count - 1))
+
+    def get_state(self):
+        """ <dict> checkpoint of the accumulators """
+        return {k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in self.__dict__.items()}
+
+    @classmethod
+    def from_state(cls, state):
+        """ Restore accumulators from a get_state() checkpoint """
+        res = cls.__new__(cls)
+        res.__dict__.update({k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in state.items()})
+        return res
+
+
+class RunningCovariance:
+    """
+    Streaming covariance matrix of several return series, O(num_assets^2) per observation and mergeable.
+
+    NaNs are skipped pairwise: each pair of assets keeps its own count and means over the observations where both are
+    available, so the covariances match pd.DataFrame.cov() on the same data.
+    """
+
+    def __init__(self, num_assets):
+        """
+        Args:
+            num_assets: <int> number of return series
+        """
+        self.count = np.zeros((num_assets, num_assets))  # observations where both assets are available
+        self.pair_mean = np.zeros((num_assets, num_assets))  # mean of asset i over the observations of pair (i, j)
+        self.comoment = np.zeros((num_assets, num_assets))  # sum of cross products of deviations from the mean
+
+    def update(self, x):
+        """
+        Fold in one new observation, NaNs are skipped
+
+        Args:
+            x: <np.ndarray> of the latest return per asset
+        """
+        x = np.asarray(x, dtype=float)
+        valid = ~np.isnan(x)
+        mask = np.outer(valid, valid)
+        self.count += mask
+        delta = np.where(mask, x[:, None] - self.pair_mean, 0)
+        self.pair_mean += delta / np.maximum(self.count, 1)
+        self.comoment += delta * np.where(mask, x[None, :] - self.pair_mean.T, 0)
+
+    @classmethod
+    def from_array(cls, ret_arr):
+        """ Accumulators over a (num_dates, num_assets) block of returns """
+        ret_arr = np.asarray(ret_arr, dtype=float)
+        res = cls(ret_arr.shape[1])
+        valid = (~np.isnan(ret_arr)).astype(float)
+
+        # centered on each asset's mean first, which leaves the comoments unchanged and keeps them accurate
+        shift = np.nanmean(ret_arr, axis=0) if valid.any() else np.zeros(ret_arr.shape[1])
+        centered = np.where(valid > 0, ret_arr - shift, 0)
+        res.count = valid.T @ valid
+        pair_mean = np.divide(centered.T @ valid, res.count, out=np.zeros_like(res.count), where=res.count > 0)
+        res.comoment = centered.T @ centered - res.count * pair_mean * pair_mean.T
+        res.pair_mean = np.where(res.count > 0, pair_mean + shift[:, None], 0)
+        return res
+
+    def merge(self, other):
+        """
+        Merge the accumulators of another partition of the data into this one
+
+        Args:
+            other: <RunningCovariance> over different observations of the same assets
+        """
+        count = self.count + other.count
+        delta = other.pair_mean - self.pair_mean
+        frac_other = np.divide(other.count, count, out=np.zeros_like(count), where=count > 0)
+        self.comoment = self.comoment + other.comoment + delta * delta.T * self.count * frac_other
+        self.pair_mean = self.pair_mean + delta * frac_other
+        self.count = count
+        return self
+
+    @property
+    def mean(self):
+        """ Mean per asset over all its observations """
+        return np.diag(self.pair_mean)
+
+    @property
+    def covariance(self):
+        """ Sample covariance matrix (ddof=1), each pair over the observations where both are available """
+        return self.comoment / (self.count - 1)
+
+    @property
+    def correlation(self):
+        """ Correlation matrix, scaled by each asset's volatility over all its observations """
+        std = np.sqrt(np.diag(self.covariance))
+        return self.covariance / np.outer(std, std)
+
+    def get_state(self):
+        """ <dict> checkpoint of the accumulators """
+        return {'count': self.count.copy(), 'pair_mean': self.pair_mean.copy(), 'comoment': self.comoment.copy()}
+
+    @classmethod
+    def from_state(cls, state):
+        """ Restore accumulators from a get_state() checkpoint """
+        res = cls(len(state['pair_mean']))
+        res.count, res.pair_mean, res.comoment = [state[k].copy() for k in ['count', 'pair_mean', 'comoment']]
+        return res
+
+
+class EWMAMoments:
+    """
+    Streaming exponentially weighted mean, volatility and downside RMS per asset.
+
+    The accumulators are exponentially weighted sums of x, x^2 and the squared shortfall below target, plus the sum of
+    weights per asset for the bias correction.  Because of that, a partition covering later observations can be merged
+    onto an earlier one by decaying the earlier sums by the number of later observations.  A NaN adds no weight but
+    the older observations still decay, as pd.DataFrame.ewm() with ignore_na=False.
+    """
+
+    def __init__(self, num_assets=1, half_life=20, target=0):
+        """
+        Args:
+            num_assets: <int> number of return series tracked side by side
+            half_life: <float> number of observations for a weight to halve
+            target: <float> downside RMS target return, defaults to 0
+        """
+        self.decay = 0.5 ** (1 / half_life)
+        self.target = target
+        self.count = 0
+        self.weight_sum = np.zeros(num_assets)
+        self.sum = np.zeros(num_assets)
+        self.sum_sq = np.zeros(num_assets)
+        self.sum_down_sq = np.zeros(num_assets)
+
+    def update(self, x):
+        """
+        Fold in one new observation per asset, NaNs are skipped
+
+        Args:
+            x: <np.ndarray> or <float> of the latest return per asset
+        """
+        x = np.asarray(x, dtype=float)
+        valid = ~np.isnan(x)
+        x = np.where(valid, x, 0)
+        self.count += 1
+        self.weight_sum = self.decay * self.weight_sum + valid
+        self.sum = self.decay * self.sum + x
+        self.sum_sq = self.decay * self.sum_sq + x ** 2
+        self.sum_down_sq = self.decay * self.sum_down_sq + np.minimum(x - self.target, 0) ** 2 * valid
+
+    def merge(self, later):
+        """
+        Append the accumulators of a partition of later observations
+
+        Args:
+            later: <EWMAMoments> with the same decay, over the observations following this one's
+        """
+        assert np.isclose(self.decay, later.decay) and self.target == later.target
+        scale = self.decay ** later.count
+        self.weight_sum = scale * self.weight_sum + later.weight_sum
+        self.sum = scale * self.sum + later.sum
+        self.sum_sq = scale * self.sum_sq + later.sum_sq
+        self.sum_down_sq = scale * self.sum_down_sq + later.sum_down_sq
+        self.count += later.count
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.weight_sum
+
+    @property
+    def variance(self):
+        return np.maximum(self.sum_sq / self.weight_sum - self.mean ** 2, 0)
+
+    @property
+    def volatility(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def downside_rms(self):
+        """
+        Root of the weighted mean squared shortfall below target over all the observations, the ones above target
+        counting as 0.  Unlike RunningMoments.semi_deviation, which is the deviation of the returns below target only.
+        """
+        return np.sqrt(self.sum_down_sq / self.weight_sum)
+
+    def get_state(self):
+        """ <dict> checkpoint of the accumulators """
+        return {k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in self.__dict__.items()}
+
+    @classmethod
+    def from_state(cls, state):
+        """ Restore accumulators from a get_state() checkpoint """
+        res = cls.__new__(cls)
+        res.__dict__.update({k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in state.items()})
+        return res
+
+
+if __name__ == '__main__':
+    import time
+
+    rets = np.random.standard_normal((10000, 4)) * 0.01
+
+    acc = RunningMoments(num_assets=4)
+    ts = time.time()
+    for row in rets:
+        acc.update(row)
+    print('{:.2f} us per update'.format((time.time() - ts) / len(rets) * 1e6))
+    print(acc.volatility, rets.std(axis=0, ddof=1))
+
+    # two partitions aggregated separately then merged
+    merged = RunningMoments.from_array(rets[:6000]).merge(RunningMoments.from_array(rets[6000:]))
+    print(merged.semi_deviation, acc.semi_deviation)
+
+    ewma = EWMAMoments(num_assets=4, half_life=60)
+    for row in rets:
+        ewma.update(row)
+    print(ewma.volatility)
@@ -0,0 +1,178 @@
+import numpy as np
+from common.math_functions import covariance_factor
+import scipy.sparse as sp
+from portfolio_optimization.portfolio_opt_preprocess import PortfolioOptPreprocess
+
+
+def basket_payoff(weights, strike_price, option_type='call'):
+    """ Option on a weighted basket of the terminal asset prices """
+    sign = 1 if option_type == 'call' else -1
+    return lambda terminal, average: np.maximum(sign * (terminal @ weights - strike_price), 0)
+
+
+def spread_payoff(long_idx, short_idx, strike_price):
+    """ Call on the spread between two of the assets' terminal prices """
+    return lambda terminal, average: np.maximum(terminal[:, long_idx] - terminal[:, short_idx] - strike_price, 0)
+
+
+def rainbow_payoff(strike_price, kind='best_of', option_type='call'):
+    """ Option on the best ('best_of') or worst ('worst_of') terminal asset price """
+    sign = 1 if option_type == 'call' else -1
+    reduce = np.max if kind == 'best_of' else np.min
+    return lambda terminal, average: np.maximum(sign * (reduce(terminal, axis=1) - strike_price), 0)
+
+
+def asian_basket_payoff(weights, strike_price, option_type='call'):
+    """ Option on a weighted basket of the arithmetic average asset prices over the simulated steps """
+    sign = 1 if option_type == 'call' else -1
+    return lambda terminal, average: np.maximum(sign * (average @ weights - strike_price), 0)
+
+
+class CorrelatedGBMSimulator:
+    """ Correlated geometric brownian motion simulator for many assets, generated in chunks of scenarios """
+
+    def __init__(self, S_0, mu, sigma, horizon=1, chunk_size=10000, seed=None, factor_covariance=False, **kwargs):
+        """
+        The covariance is factored once on construction.  Scenarios are then generated chunk by chunk, and for path
+        simulations only the running terminal and average price per chunk are kept, so memory is bounded by
+        chunk_size x num_assets regardless of the number of scenarios or steps.
+
+        Args:
+            S_0: <np.ndarray> initial asset prices
+            mu: <np.ndarray> expected log return per period e.g. PortfolioOptPreprocess expected_returns
+            sigma: <np.ndarray> covariance matrix of log returns per period, or the factor covariance matrix if
+            factor_covariance is True
+            horizon: <float> number of periods to simulate over
+            chunk_size: <int> number of scenarios generated at once
+            seed: <int> seed of the random number generator
+            factor_covariance: <bool> if True, sigma is given in factor form.  Additional params required.
+
+            For factor_covariance == True:
+                D: <scipy matrix> or <np.ndarray> diagonal matrix (or its diagonal) for idiosyncratic variance
+                F: <np.ndarray> of factor loadings of shape: num_assets x num_factors
+        """
+        self.S_0 = np.asarray(S_0, dtype=float).ravel()
+        self.n = len(self.S_0)
+        self.mu = np.asarray(mu, dtype=float).ravel()
+        self.horizon = horizon
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+        self.factor_covar_model_bool = factor_covariance
+
+        assert len(self.mu) == self.n
+
+        if self.factor_covar_model_bool:
+            D = kwargs.get('D', None)
+            F = kwargs.get('F', None)
+            if D is None or F is None:
+                raise Exception('Factor Covariance Model selected, but required input parameters are missing')
+
+            # asset covariance = F sigma F.T + D, so the factor loads the factor shocks and D scales independent shocks
+            self.idio_std = np.sqrt(D.diagonal() if sp.issparse(D) or np.ndim(D) == 2 else np.asarray(D, dtype=float))
+            self.factor = np.asarray(F) @ covariance_factor(sigma)
+            self.asset_variances = (self.factor ** 2).sum(axis=1) + self.idio_std ** 2
+        else:
+            assert sigma.shape == (self.n, self.n)
+            self.idio_std = None
+            self.factor = covariance_factor(sigma)
+            self.asset_variances = np.diag(sigma).copy()
+
+    def set_risk_neutral_drift(self, short_rate):
+        """
+        Replace the drift with the risk-neutral log drift, for pricing
+
+        Args:
+            short_rate: <float> risk-free rate per period
+        """
+        self.mu = short_rate - 0.5 * self.asset_variances
+        return self
+
+    def log_return_shocks(self, num_scenarios, dt):
+        """ Correlated normal log return shocks over a dt long period, of shape (num_scenarios, num_assets) """
+        shocks = self.rng.standard_normal((num_scenarios, self.factor.shape[1])) @ self.factor.T
+        if self.idio_std is not None:
+            shocks += self.rng.standard_normal((num_scenarios, self.n)) * self.idio_std
+        return shocks * np.sqrt(dt)
+
+    def simulate_chunks(self, num_scenarios, steps=1):
+        """
+        Generate scenarios chunk by chunk
+
+        Args:
+            num_scenarios: <int> total number of scenarios
+            steps: <int> number of time steps per path.  Only needed for path dependent payoffs, a single step gives the
+            exact terminal distribution.
+
+        Yields:
+            <tuple> of <np.ndarray> terminal asset prices and the average asset prices over the steps, both of shape
+            (chunk_size, num_assets)
+        """
+        dt = self.horizon / steps
+        for start in range(0, num_scenarios, self.chunk_size):
+            n = min(self.chunk_size, num_scenarios - start)
+            log_S = np.tile(np.log(self.S_0), (n, 1))
+            running_sum = np.zeros((n, self.n))
+
+            for _ in range(steps):
+                log_S += self.mu * dt + self.log_return_shocks(n, dt)
+                running_sum += np.exp(log_S)
+
+            yield np.exp(log_S), running_sum / steps
+
+    def price(self, payoff, num_scenarios, steps=1, discount_factor=1):
+        """
+        Monte carlo price of a (multi-asset) payoff
+
+        Args:
+            payoff: <function> of (terminal, average) price arrays returning the payoff per scenario, e.g. from
+            basket_payoff, spread_payoff, rainbow_payoff or asian_basket_payoff
+            num_scenarios: <int> number of scenarios
+            steps: <int> number of time steps per path
+            discount_factor: <float> discount factor over the horizon
+
+        Returns:
+            <dict> of the discounted price and its monte carlo standard error
+        """
+        total, total_sq = 0, 0
+        for terminal, average in self.simulate_chunks(num_scenarios, steps):
+            values = payoff(terminal, average)
+            total, total_sq = total + values.sum(), total_sq + (values ** 2).sum()
+
+        mean = total / num_scenarios
+        std = np.sqrt(max(total_sq / num_scenarios - mean ** 2, 0))
+        return {'price': discount_factor * mean,
+                'std_error': discount_factor * std / np.sqrt(num_scenarios)}
+
+    def portfolio_value_distribution(self, holdings, num_scenarios):
+        """
+        Distribution of a portfolio's value at the horizon
+
+        Args:
+            holdings: <np.ndarray> number of units held per asset
+            num_scenarios: <int> number of scenarios
+
+        Returns:
+            <np.ndarray> of portfolio values per scenario
+        """
+        holdings = np.asarray(holdings, dtype=float).ravel()
+        return np.concatenate([terminal @ holdings for terminal, _ in self.simulate_chunks(num_scenarios)])
+
+
+if __name__ == '__main__':
+    ls_assets = ['AAPL', 'NKE', 'GOOGL', 'AMZN']
+
+    preprocess = PortfolioOptPreprocess(ls_assets, rets_hist_length_yrs=3)
+    preprocess_res = preprocess()
+    S_0 = preprocess.df_price_data.iloc[-1].to_numpy()
+
+    # one year of daily log returns
+    x = CorrelatedGBMSimulator(S_0, preprocess_res['expected_returns'], preprocess_res['covariance_matrix'],
+                               horizon=252, seed=1)
+    values = x.portfolio_value_distribution(np.ones(len(ls_assets)), 100000)
+    print(np.percentile(values, [5, 50, 95]))
+
+    x.set_risk_neutral_drift(0.02 / 252)
+    # equally weighted basket normalized to start at 1, at the money
+    weights = 1 / (len(S_0) * S_0)
+    print(x.price(basket_payoff(weights, 1, 'call'), 100000, discount_factor=np.exp(-0.02)))
+    print(x.price(spread_payoff(0, 1, 0), 100000, discount_factor=np.exp(-0.02)))
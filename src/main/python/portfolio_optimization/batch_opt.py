@@ -0,0 +1,197 @@
+import numpy as np
+import cvxpy as cp
+from concurrent.futures import ProcessPoolExecutor
+from common.timeit import timeit
+from common.math_functions import covariance_factor
+from portfolio_optimization.portfolio_opt import ParametrizedMarkowitzPortfolio
+
+# name of the per solve time limit option (in seconds) of each solver
+TIME_LIMIT_OPTIONS = {cp.OSQP: 'time_limit',
+                      cp.CLARABEL: 'time_limit',
+                      cp.SCS: 'time_limit_secs'}
+
+_WORKER_DATA = {}
+
+
+def init_worker(mu, sigma, factor_covariance, solver, timeout, factor_kwargs):
+    """
+    Process pool initializer: the shared inputs are sent and the covariance factorized once per worker.  The optimizers
+    are compiled lazily, once per problem structure, and kept for the life of the worker.
+    """
+    _WORKER_DATA['mu'] = mu
+    _WORKER_DATA['sigma'] = sigma
+    _WORKER_DATA['sigma_factor'] = covariance_factor(np.asarray(sigma, dtype=float))
+    _WORKER_DATA['factor_covariance'] = factor_covariance
+    _WORKER_DATA['solver'] = solver
+    _WORKER_DATA['factor_kwargs'] = factor_kwargs
+    _WORKER_DATA['optimizers'] = {}
+
+    if timeout is None:
+        _WORKER_DATA['solver_opts'] = {}
+    elif solver in TIME_LIMIT_OPTIONS:
+        _WORKER_DATA['solver_opts'] = {TIME_LIMIT_OPTIONS[solver]: timeout}
+    else:
+        raise NotImplementedError('{} solver time limit has not been implemented'.format(solver))
+
+
+def get_optimizer(structure):
+    """ <ParametrizedMarkowitzPortfolio> of the worker for a problem structure, compiled on first use """
+    optimizers = _WORKER_DATA['optimizers']
+    if structure not in optimizers:
+        optimizers[structure] = ParametrizedMarkowitzPortfolio(
+            len(_WORKER_DATA['mu']), list(structure), factor_covariance=_WORKER_DATA['factor_covariance'],
+            num_factors=_WORKER_DATA['factor_kwargs'].get('num_factors'), solver=_WORKER_DATA['solver'],
+            solver_opts=_WORKER_DATA['solver_opts'])
+    return optimizers[structure]
+
+
+def error_result(status):
+    """ <dict> of results of a problem that could not be solved """
+    return {'w': None, 'portfolio_ret': None, 'portfolio_variance': None, 'status': status, 'solve_time': None}
+
+
+def solve_block(structure, specs):
+    """
+    Solve a block of problems sharing one structure, each warm started from the previous one.  A spec with invalid
+    inputs (unknown or incompatible constraints, negative gamma, leverage limit below 1) gets the 'invalid_spec' status
+    and the rest of the block is still solved.
+
+    Args:
+        structure: <tuple> of constraint names
+        specs: <list> of (index, spec) tuples
+
+    Returns:
+        <list> of (index, result dict) tuples
+    """
+    try:
+        optimizer = get_optimizer(structure)
+    except (AssertionError, NotImplementedError):
+        return [(idx, error_result('invalid_spec')) for idx, _ in specs]
+
+    factor_kwargs = _WORKER_DATA['factor_kwargs']
+    results = []
+    for idx, spec in specs:
+        try:
+            res = optimizer(_WORKER_DATA['mu'], _WORKER_DATA['sigma'], spec.get('gamma', 0), spec.get('lev_limit', 1),
+                            sigma_factor=_WORKER_DATA['sigma_factor'], D=factor_kwargs.get('D'),
+                            F=factor_kwargs.get('F'))
+        except AssertionError:
+            res = error_result('invalid_spec')
+        except cp.SolverError:
+            res = error_result('solver_error')
+        results.append((idx, res))
+    return results
+
+
+def structure_key(spec):
+    """ Problems with the same set of constraints share a compiled problem, whatever the gamma and leverage limit """
+    return tuple(sorted(spec['constraints']))
+
+
+class BatchMarkowitzOptimizer:
+    def __init__(self, mu, sigma, factor_covariance=False, num_workers=None, solver=cp.OSQP, timeout=None, **kwargs):
+        """
+        Solve many markowitz problems sharing mu and sigma, e.g. one per client account.
+
+        The problem specs are grouped by structure (their set of constraints).  Each worker compiles a
+        ParametrizedMarkowitzPortfolio once per structure it meets and re-solves it for the gamma and leverage limit of
+        every spec, so the cost of canonicalization is paid num_structures * num_workers times instead of once per
+        account, and the covariance is factorized once per worker.  The groups are split into blocks across a
+        process pool, so throughput scales with the number of cores.
+
+        Args:
+            mu: vector containing the mean returns of the assets
+            sigma: covariance matrix, or the factor covariance matrix for the factor covariance model
+            factor_covariance: <bool> if True, run as factor covariance model.  Pass D, F and num_factors as
+            MarkowitzOptimizePortfolio.
+            num_workers: <int> number of processes.  None or 1 solves in the current process.
+            solver: cvxpy solver name
+            timeout: <float> solver time limit per problem in seconds.  A problem that hits it reports the
+            'user_limit' status.
+        """
+        self.mu = np.asarray(mu, dtype=float).ravel()
+        self.sigma = sigma
+        self.factor_covariance = factor_covariance
+        self.num_workers = num_workers
+        self.solver = solver
+        self.timeout = timeout
+        self.factor_kwargs = {k: kwargs[k] for k in ['D', 'F', 'num_factors'] if k in kwargs}
+
+        if self.factor_covariance and len(self.factor_kwargs) < 3:
+            raise Exception('Factor Covariance Model selected, but required input parameters are missing')
+
+    def blocks(self, specs):
+        """ <list> of (structure, [(index, spec), ...]) blocks, each structure split in up to num_workers blocks """
+        groups = {}
+        for idx, spec in enumerate(specs):
+            groups.setdefault(structure_key(spec), []).append((idx, spec))
+
+        num_splits = self.num_workers if self.num_workers else 1
+        return [(structure, [group[i] for i in block]) for structure, group in groups.items()
+                for block in np.array_split(np.arange(len(group)), min(num_splits, len(group)))]
+
+    @timeit
+    def __call__(self, specs):
+        """
+        Solve every problem
+
+        Args:
+            specs: <list> of <dict> with keys:
+                constraints: <list> of constraint names, as MarkowitzOptimizePortfolio
+                gamma: risk adversion parameter, default 0
+                lev_limit: <int> or <float> max leverage allowed, default 1
+
+        Returns:
+            <dict> of, in the order of specs:
+                w: <np.ndarray> of weights with shape (num_specs, num_assets), NaN rows where no solution was found
+                portfolio_ret, portfolio_variance: <np.ndarray> of shape (num_specs,), NaN where no solution was found
+                status: <list> of solver statuses, 'invalid_spec' or 'solver_error' where the problem could not be
+                solved
+                solve_time: <np.ndarray> of solver times in seconds
+                num_structures: <int> number of distinct problem structures
+        """
+        blocks = self.blocks(specs)
+        init_args = (self.mu, self.sigma, self.factor_covariance, self.solver, self.timeout, self.factor_kwargs)
+
+        if self.num_workers is None or self.num_workers == 1:
+            init_worker(*init_args)
+            results = [solve_block(*block) for block in blocks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.num_workers, initializer=init_worker,
+                                     initargs=init_args) as executor:
+                results = list(executor.map(solve_block, *zip(*blocks)))
+
+        num_specs = len(specs)
+        res_dict = {'w': np.full((num_specs, len(self.mu)), np.nan),
+                    'portfolio_ret': np.full(num_specs, np.nan),
+                    'portfolio_variance': np.full(num_specs, np.nan),
+                    'status': [None] * num_specs,
+                    'solve_time': np.full(num_specs, np.nan),
+                    'num_structures': len(set(structure for structure, _ in blocks))}
+
+        for idx, res in (x for block_results in results for x in block_results):
+            res_dict['status'][idx] = res['status']
+            if res['solve_time'] is not None:
+                res_dict['solve_time'][idx] = res['solve_time']
+            if res['w'] is not None and res['status'] in [cp.OPTIMAL, cp.OPTIMAL_INACCURATE]:
+                res_dict['w'][idx] = res['w']
+                res_dict['portfolio_ret'][idx] = res['portfolio_ret']
+                res_dict['portfolio_variance'][idx] = res['portfolio_variance']
+
+        return res_dict
+
+
+if __name__ == '__main__':
+    np.random.seed(1)
+    num_assets, num_accounts = 100, 400
+    loadings = np.random.randn(num_assets, 5)
+    sigma = loadings @ loadings.T * 1e-4 + np.diag(np.random.uniform(1e-4, 4e-4, num_assets))
+    mu = np.random.uniform(0, 1e-3, num_assets)
+
+    structures = [['sum_to_one', 'long_only'], ['sum_to_one', 'leverage_limit'], ['leverage_limit']]
+    specs = [{'constraints': structures[i % 3], 'gamma': np.random.uniform(1, 20),
+              'lev_limit': np.random.uniform(1, 3)} for i in range(num_accounts)]
+
+    res = BatchMarkowitzOptimizer(mu, sigma, num_workers=4, timeout=1)(specs)
+    print('{} problems, {} structures, {} optimal, total solve time {:.2f} s'.format(
+        num_accounts, res['num_structures'], res['status'].count(cp.OPTIMAL), np.nansum(res['solve_time'])))
@@ -1,6 +1,34 @@
 from common.common_functions import get_price_data
 import datetime as dt
 import numpy as np
+from functools import lru_cache
+from scipy.linalg import cho_factor, cho_solve
+from portfolio_optimization.portfolio_opt import MarkowitzOptimizePortfolio
+
+
+@lru_cache(maxsize=None)
+def _cached_benchmark_annual_returns(benchmark_ticker, lookback_period_months, end_date):
+    """ Shared by every caller, so must not be modified - see benchmark_annual_returns() """
+    df_price_data = get_price_data([benchmark_ticker], dt.datetime.combine(end_date, dt.time()),
+                                   look_back_mths=lookback_period_months)
+
+    # resample to annual data
+    return df_price_data.resample('Y').last().pct_change().apply(lambda x: np.log(1 + x))
+
+
+def benchmark_annual_returns(benchmark_ticker, lookback_period_months, end_date):
+    """
+    Annual log returns of the benchmark, fetched once per ticker, lookback and end date
+
+    Args:
+        benchmark_ticker: <str> ticker of the benchmark market asset
+        lookback_period_months: <int> number of months before the end date
+        end_date: <dt.date> last date of the history
+
+    Returns:
+        <pd.DataFrame> of annual log returns, a copy of the cached data that the caller may modify
+    """
+    return _cached_benchmark_annual_returns(benchmark_ticker, lookback_period_months, end_date).copy()
 
 
 def risk_adversion_coefficient(benchmark_ticker, risk_free_rate=0.02, lookback_period_months=48):
@@ -16,17 +44,102 @@ def risk_adversion_coefficient(benchmark_ticker, risk_free_rate=0.02, lookback_p
         <float> risk adversion coefficient
 
     """
-    end_date = dt.datetime.today()
-    df_price_data = get_price_data([benchmark_ticker], end_date, look_back_mths=lookback_period_months)
-
-    # resample to annual data
-    rets = df_price_data.resample('Y').last().pct_change().apply(lambda x: np.log(1 + x))
+    rets = benchmark_annual_returns(benchmark_ticker, lookback_period_months, dt.date.today())
 
     exp_ret = rets.mean()
     var = rets.var()
-    return ((exp_ret - risk_free_rate) / var)[0]
+    return ((exp_ret - risk_free_rate) / var).iloc[0]
+
+
+class BlackLittermanModel:
+    def __init__(self, sigma, market_weights, risk_adversion, tau=0.05):
+        """
+        Black-Litterman model: the market implied equilibrium returns as the prior, updated with investor views.
+
+        The prior (equilibrium returns and tau * sigma) is computed once.  Each set of views then only needs a
+        num_views x num_views Cholesky factorization - no num_assets x num_assets inverse - and many view sets can be
+        evaluated against the same prior.
+
+        Args:
+            sigma: <np.ndarray> covariance matrix of the asset (excess) returns
+            market_weights: <np.ndarray> market capitalization weights of the assets
+            risk_adversion: <float> risk adversion coefficient delta, e.g. from risk_adversion_coefficient()
+            tau: <float> scaling of the uncertainty of the prior mean relative to sigma
+        """
+        self.sigma = np.asarray(sigma, dtype=float)
+        self.n = len(self.sigma)
+        self.market_weights = np.asarray(market_weights, dtype=float).reshape(self.n, 1)
+        self.risk_adversion = risk_adversion
+        self.tau = tau
+
+        # reverse optimization: the returns for which the market portfolio is the optimal markowitz portfolio
+        self.equilibrium_returns = risk_adversion * self.sigma @ self.market_weights
+        self.tau_sigma = tau * self.sigma
+
+    def default_omega(self, P):
+        """ View uncertainty proportional to the prior variance of each view portfolio (He & Litterman) """
+        return np.diag(np.einsum('ij,ij->i', P, P @ self.tau_sigma))
+
+    def posterior(self, P, Q, omega=None):
+        """
+        Posterior mean and covariance of the returns given views P mu = Q + e, e ~ N(0, omega)
+
+        mu_bl = pi + tau S P.T (P tau S P.T + omega)^-1 (Q - P pi)
+        sigma_bl = S + tau S - tau S P.T (P tau S P.T + omega)^-1 P tau S
+
+        Args:
+            P: <np.ndarray> view matrix of shape (num_views, num_assets), a row per view portfolio
+            Q: <np.ndarray> expected returns of the view portfolios, shape (num_views,), or (num_views, num_view_sets)
+            to evaluate several sets of view returns with the same P and omega in one solve
+            omega: <np.ndarray> covariance of the view errors, defaults to default_omega(P)
+
+        Returns:
+            <dict> in the form of PortfolioOptPreprocess output: expected_returns of shape (num_assets, 1), or
+            (num_assets, num_view_sets), and the covariance_matrix
+        """
+        P = np.atleast_2d(np.asarray(P, dtype=float))
+        Q = np.asarray(Q, dtype=float).reshape(len(P), -1)
+        omega = self.default_omega(P) if omega is None else np.atleast_2d(np.asarray(omega, dtype=float))
+
+        tau_sigma_pt = self.tau_sigma @ P.T
+        view_cov = cho_factor(P @ tau_sigma_pt + omega)
+
+        mu_bl = self.equilibrium_returns + tau_sigma_pt @ cho_solve(view_cov, Q - P @ self.equilibrium_returns)
+        sigma_bl = self.sigma + self.tau_sigma - tau_sigma_pt @ cho_solve(view_cov, tau_sigma_pt.T)
+
+        return {'expected_returns': mu_bl,
+                'covariance_matrix': (sigma_bl + sigma_bl.T) / 2}
+
+    def batch_posterior(self, view_sets):
+        """
+        Posteriors for many view sets against the same prior
+
+        Args:
+            view_sets: <list> of (P, Q) or (P, Q, omega) tuples
+
+        Returns:
+            <list> of posterior() outputs
+        """
+        return [self.posterior(*views) for views in view_sets]
 
 
 if __name__ == '__main__':
+    from portfolio_optimization.portfolio_opt_preprocess import PortfolioOptPreprocess
+
     gamma = risk_adversion_coefficient('^GSPC')
     print(gamma)
+
+    ls_assets = ['AAPL', 'NKE', 'GOOGL', 'AMZN']
+    preprocess = PortfolioOptPreprocess(ls_assets, rets_hist_length_yrs=3)
+    preprocess_res = preprocess()
+
+    model = BlackLittermanModel(preprocess_res['covariance_matrix'], market_weights=[0.45, 0.05, 0.25, 0.25],
+                                risk_adversion=2.5)
+
+    # AAPL outperforms NKE by 0.02% a day, and GOOGL returns 0.05% a day
+    P = np.array([[1, -1, 0, 0], [0, 0, 1, 0]])
+    for res in model.batch_posterior([(P, [0.0002, 0.0005]), (P, [0.0, 0.0003])]):
+        x = MarkowitzOptimizePortfolio(num_assets=preprocess.n, mu=res['expected_returns'],
+                                       sigma=res['covariance_matrix'], gamma=2.5,
+                                       constraints=['sum_to_one', 'long_only'])
+        print(x()['w'])
@@ -0,0 +1,232 @@
+import numpy as np
+from portfolio_optimization.portfolio_opt_preprocess import PortfolioOptPreprocess
+from portfolio_optimization.simplex_qp import SimplexMarkowitzSolver
+
+
+class CriticalLineAlgorithm:
+    """
+    Markowitz's critical line algorithm for the sum_to_one + long_only mean-variance frontier.
+
+    MarkowitzOptimizePortfolio maximizes mu.T w - gamma * w.T sigma w, i.e. minimizes 1/2 w.T sigma w - lambda mu.T w
+    with lambda = 1 / (2 gamma).  For a fixed set of free (non-zero) assets the optimal weights are linear in lambda, so
+    the whole frontier is traced exactly by following lambda down from infinity (all in the highest return asset, or the
+    minimum variance mix of the assets tied for it) to 0 (the minimum variance portfolio), stopping at the turning
+    points where an asset enters or leaves the free set.
+    """
+
+    def __init__(self, mu, sigma, tolerance=1e-10):
+        """
+        Args:
+            mu: vector containing the mean returns of the assets
+            sigma: covariance matrix, positive definite
+            tolerance: <float> numerical tolerance on weights and lambdas
+        """
+        self.mu = np.asarray(mu, dtype=float).ravel()
+        self.sigma = np.asarray(sigma, dtype=float)
+        self.n = len(self.mu)
+        self.tolerance = tolerance
+
+        assert self.sigma.shape == (self.n, self.n)
+
+        self.lambdas = None  # decreasing, starting with np.inf
+        self.weights = None  # shape (num_turning_points, num_assets)
+
+    def free_set_solution(self, free):
+        """
+        Weights w = alpha + lambda * beta and sum_to_one multiplier eta = eta_0 + lambda * eta_1 for a free set, with
+        the bounded (zero weight) assets excluded
+
+        Args:
+            free: <np.ndarray> of bool, True for the free assets
+
+        Returns:
+            <np.ndarray> alpha, <np.ndarray> beta, <float> eta_0, <float> eta_1
+        """
+        a, b = np.linalg.solve(self.sigma[np.ix_(free, free)], np.column_stack([np.ones(free.sum()), self.mu[free]])).T
+        alpha, beta = np.zeros(self.n), np.zeros(self.n)
+        alpha[free] = a / a.sum()
+        beta[free] = b - a * b.sum() / a.sum()
+        return alpha, beta, 1 / a.sum(), -b.sum() / a.sum()
+
+    def highest_return_portfolio(self):
+        """
+        Optimal weights as lambda goes to infinity: the minimum variance long only portfolio of the assets tied for the
+        highest return, all in one asset if there is no tie
+
+        Returns:
+            <np.ndarray> of weights
+        """
+        top = self.mu >= self.mu.max() - self.tolerance
+        w = np.zeros(self.n)
+        if top.sum() == 1:
+            w[top] = 1
+        else:
+            # the returns are equal within the tied set, only the variance matters
+            w[top] = SimplexMarkowitzSolver(self.sigma[np.ix_(top, top)], tolerance=self.tolerance)(
+                np.zeros(top.sum()), gamma=1)['w']
+        return w
+
+    def __call__(self):
+        """
+        Compute all the turning points of the frontier
+
+        Returns:
+            <dict> of turning points ordered from the highest return to the minimum variance portfolio:
+                gamma: <np.ndarray> risk adversion at each turning point, starting at 0
+                w: <np.ndarray> of weights with shape (num_turning_points, num_assets)
+                portfolio_ret: <np.ndarray> of portfolio returns
+                portfolio_variance: <np.ndarray> of portfolio variances
+        """
+        start = self.highest_return_portfolio()
+        free = start > 0
+
+        lambdas, weights = [np.inf], [start]
+        current_lambda, last_changed = np.inf, None
+
+        while True:
+            alpha, beta, eta_0, eta_1 = self.free_set_solution(free)
+
+            # lambda at which a free weight falls to 0 - it is decreasing as lambda decreases when beta > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                leave = np.where(free & (beta > self.tolerance), -alpha / beta, -np.inf)
+
+                # lambda at which a bounded asset's multiplier sigma w - lambda mu - eta falls to 0
+                c = self.sigma @ alpha - eta_0
+                d = self.sigma @ beta - self.mu - eta_1
+                enter = np.where(~free & (d > self.tolerance), -c / d, -np.inf)
+
+            if last_changed is not None:
+                # an asset that just changed state cannot change back at the same lambda
+                leave[last_changed] = enter[last_changed] = -np.inf
+
+            candidates = np.where(np.concatenate([leave, enter]) < current_lambda - self.tolerance,
+                                  np.concatenate([leave, enter]), -np.inf)
+            next_idx = np.argmax(candidates)
+            next_lambda = candidates[next_idx]
+
+            if next_lambda <= self.tolerance:
+                # no further turning points, the last segment ends at the minimum variance portfolio
+                lambdas.append(0.)
+                weights.append(np.maximum(alpha, 0))
+                break
+
+            lambdas.append(next_lambda)
+            weights.append(np.maximum(alpha + next_lambda * beta, 0))
+
+            asset = next_idx % self.n
+            free[asset] = next_idx >= self.n
+            current_lambda, last_changed = next_lambda, asset
+
+        self.lambdas = np.array(lambdas)
+        self.weights = np.array(weights)
+
+        with np.errstate(divide='ignore'):
+            gamma = 1 / (2 * self.lambdas)
+
+        return {'gamma': gamma,
+                'w': self.weights,
+                'portfolio_ret': self.weights @ self.mu,
+                'portfolio_variance': np.einsum('ij,jk,ik->i', self.weights, self.sigma, self.weights)}
+
+    def check_computed(self):
+        if self.weights is None:
+            self()
+
+    def interpolate(self, segment, t):
+        """ Weights a fraction t of the way from the turning point after segment (t = 0) to the one before (t = 1) """
+        return self.weights[segment + 1] + t[:, None] * (self.weights[segment] - self.weights[segment + 1])
+
+    def weights_at_gamma(self, gamma):
+        """
+        Optimal weights for risk adversion levels, identical to MarkowitzOptimizePortfolio with sum_to_one and long_only
+
+        Args:
+            gamma: <float> or <np.ndarray> of gamma values
+
+        Returns:
+            <np.ndarray> of weights with shape (num_gammas, num_assets)
+        """
+        self.check_computed()
+        with np.errstate(divide='ignore'):
+            lam = 1 / (2 * np.atleast_1d(np.asarray(gamma, dtype=float)))
+
+        # weights are constant above the first finite turning point
+        lam = np.minimum(lam, self.lambdas[1])
+        segment = np.clip(np.searchsorted(-self.lambdas, -lam, side='right') - 1, 1, len(self.lambdas) - 2)
+        t = (lam - self.lambdas[segment + 1]) / (self.lambdas[segment] - self.lambdas[segment + 1])
+        return self.interpolate(segment, t)
+
+    def weights_at_return(self, target_ret):
+        """
+        Minimum variance weights for target returns, which are linear in lambda along each segment of the frontier
+
+        Args:
+            target_ret: <float> or <np.ndarray> of target returns between the minimum variance and maximum return
+
+        Returns:
+            <np.ndarray> of weights with shape (num_targets, num_assets)
+        """
+        self.check_computed()
+        rets = self.weights @ self.mu  # decreasing
+        target_ret = np.atleast_1d(np.asarray(target_ret, dtype=float))
+        assert np.all((target_ret >= rets[-1] - self.tolerance) & (target_ret <= rets[0] + self.tolerance))
+
+        segment = np.clip(np.searchsorted(-rets, -target_ret, side='right') - 1, 0, len(rets) - 2)
+        span = rets[segment] - rets[segment + 1]
+        t = np.divide(target_ret - rets[segment + 1], span, out=np.ones_like(span), where=span > self.tolerance)
+        return self.interpolate(segment, np.clip(t, 0, 1))
+
+    def weights_at_volatility(self, target_vol):
+        """
+        Maximum return weights for target volatilities.  Variance is quadratic along each segment, so this is exact.
+
+        Args:
+            target_vol: <float> or <np.ndarray> of target volatilities between the minimum and maximum on the frontier
+
+        Returns:
+            <np.ndarray> of weights with shape (num_targets, num_assets)
+        """
+        self.check_computed()
+        variances = np.einsum('ij,jk,ik->i', self.weights, self.sigma, self.weights)  # decreasing
+        target_var = np.atleast_1d(np.asarray(target_vol, dtype=float)) ** 2
+        assert np.all((target_var >= variances[-1] - self.tolerance) & (target_var <= variances[0] + self.tolerance))
+
+        segment = np.clip(np.searchsorted(-variances, -target_var, side='right') - 1, 0, len(variances) - 2)
+
+        # variance(t) = w1' S w1 + 2 t w1' S dw + t^2 dw' S dw, with dw = w0 - w1
+        w1 = self.weights[segment + 1]
+        dw = self.weights[segment] - w1
+        qa = np.einsum('ij,jk,ik->i', dw, self.sigma, dw)
+        qb = 2 * np.einsum('ij,jk,ik->i', w1, self.sigma, dw)
+        qc = variances[segment + 1] - target_var
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            disc = np.sqrt(np.maximum(qb ** 2 - 4 * qa * qc, 0))
+            t = np.where(qa > self.tolerance, (-qb + disc) / (2 * qa), -qc / qb)
+        return self.interpolate(segment, np.clip(np.nan_to_num(t, nan=1.), 0, 1))
+
+    def frontier(self, gamma):
+        """
+        Portfolio returns and variances on the frontier for a grid of gamma values
+
+        Args:
+            gamma: <np.ndarray> of gamma values
+
+        Returns:
+            <np.ndarray> of portfolio returns, <np.ndarray> of portfolio variances
+        """
+        w = self.weights_at_gamma(gamma)
+        return w @ self.mu, np.einsum('ij,jk,ik->i', w, self.sigma, w)
+
+
+if __name__ == '__main__':
+    ls_assets = ['AAPL', 'NKE', 'GOOGL', 'AMZN']
+
+    preprocess = PortfolioOptPreprocess(ls_assets, rets_hist_length_yrs=3)
+    preprocess_res = preprocess()
+
+    cla = CriticalLineAlgorithm(preprocess_res['expected_returns'], preprocess_res['covariance_matrix'])
+    turning_points = cla()
+    print(turning_points)
+    print(cla.weights_at_gamma([1, 10, 100]))
+    print(cla.weights_at_volatility(np.sqrt(turning_points['portfolio_variance'].mean())))
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from portfolio_optimization.portfolio_opt import MarkowitzOptimizePortfolio
+from portfolio_optimization.portfolio_opt_preprocess import PortfolioOptPreprocess
+
+
+class EWMACovariance:
+    """ Exponentially weighted (RiskMetrics-style) covariance matrices for one or more half-lives at once """
+
+    def __init__(self, half_lives=(60,), demean=False):
+        """
+        Sigma_t = decay * Sigma_t-1 + (1 - decay) * r_t r_t.T, with decay = 0.5 ** (1 / half_life).
+
+        fit() runs over a history in one weighted matrix product per half-life, after which update() rolls every
+        estimate forward by one day in O(num_assets^2) from the previous day's matrices.
+
+        Args:
+            half_lives: <list> of half-lives in number of observations, e.g. [21, 63, 252]
+            demean: <bool> if False (RiskMetrics) returns are assumed to have zero mean, if True they are centered on an
+            exponentially weighted mean with the same half-life
+        """
+        self.half_lives = list(half_lives)
+        self.decay = 0.5 ** (1 / np.array(self.half_lives, dtype=float))
+        self.demean = demean
+        self.cov = None  # shape (num_half_lives, num_assets, num_assets)
+        self.mean = None  # shape (num_half_lives, num_assets)
+        self.columns = None
+
+    def fit(self, df_rets):
+        """
+        Estimate the covariances over a return history
+
+        Args:
+            df_rets: <pd.DataFrame> of returns.  Date index with asset names as columns, no NaNs.
+
+        Returns:
+            self
+        """
+        rets = np.asarray(df_rets, dtype=float)
+        self.columns = df_rets.columns if isinstance(df_rets, pd.DataFrame) else None
+        num_dates, num_assets = rets.shape
+
+        self.cov = np.empty((len(self.decay), num_assets, num_assets))
+        self.mean = np.zeros((len(self.decay), num_assets))
+
+        for i, decay in enumerate(self.decay):
+            # normalized weights of the recursion seeded with the first observation, newest last
+            weights = decay ** np.arange(num_dates - 1, -1, -1)
+            weights[1:] *= (1 - decay)
+
+            if self.demean:
+                self.mean[i] = weights @ rets
+            centered = rets - self.mean[i]
+            self.cov[i] = (centered * weights[:, None]).T @ centered
+
+        return self
+
+    def update(self, rets):
+        """
+        Roll every estimate forward with one new day of returns
+
+        Args:
+            rets: <np.ndarray> or <pd.Series> of the latest return per asset
+        """
+        rets = np.asarray(rets, dtype=float)
+        decay = self.decay[:, None]
+
+        if self.demean:
+            # West's exponentially weighted update of the mean and covariance
+            deviation = rets - self.mean
+            self.mean = self.mean + (1 - decay) * deviation
+            self.cov = decay[:, :, None] * (self.cov + (1 - decay[:, :, None]) *
+                                            deviation[:, :, None] * deviation[:, None, :])
+        else:
+            self.cov = decay[:, :, None] * self.cov + (1 - decay[:, :, None]) * np.outer(rets, rets)
+
+    def covariance(self, half_life=None):
+        """
+        Covariance matrix for one half-life, in the form MarkowitzOptimizePortfolio takes as sigma
+
+        Args:
+            half_life: <float> one of self.half_lives, defaults to the first
+
+        Returns:
+            <np.ndarray> of shape (num_assets, num_assets)
+        """
+        idx = 0 if half_life is None else self.half_lives.index(half_life)
+        return self.cov[idx]
+
+
+if __name__ == '__main__':
+    ls_assets = ['AAPL', 'NKE', 'GOOGL', 'AMZN']
+
+    preprocess = PortfolioOptPreprocess(ls_assets, rets_hist_length_yrs=10)
+    preprocess_res = preprocess()
+    df_rets = preprocess.log_rets.dropna()
+
+    ewma = EWMACovariance(half_lives=[21, 63, 252]).fit(df_rets.iloc[:-1])
+    ewma.update(df_rets.iloc[-1])
+
+    for half_life in ewma.half_lives:
+        x = MarkowitzOptimizePortfolio(num_assets=preprocess.n, mu=preprocess_res['expected_returns'],
+                                       sigma=ewma.covariance(half_life), gamma=5,
+                                       constraints=['sum_to_one', 'long_only'])
+        print(half_life, x()['w'])
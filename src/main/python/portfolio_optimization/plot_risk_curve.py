@@ -1,9 +1,11 @@
 from portfolio_optimization.portfolio_opt import MarkowitzOptimizePortfolio
+from portfolio_optimization.critical_line import CriticalLineAlgorithm
 import pprint
 import numpy as np
 import cvxpy as cp
 import matplotlib.pyplot as plt
 import math
+from concurrent.futures import ProcessPoolExecutor
 from portfolio_optimization.portfolio_opt_preprocess import PortfolioOptPreprocess
 
 VAR_DATA = 'variance_data'
@@ -12,24 +14,150 @@ OPT_STATUS_DATA = 'opt_status_data'
 GAMMA_DATA = 'gamma_data'
 
 
+_WORKER_DATA = {}
+
+
+def init_worker(curve_kwargs):
+    """ Process pool initializer, each worker compiles the parametrized problem once and re-solves it per gamma """
+    curve = RiskCurve(**curve_kwargs)
+    _WORKER_DATA['curve'] = curve
+    _WORKER_DATA['problem'] = curve.setup_problem()
+
+
+def solve_gammas_in_worker(gammas):
+    return _WORKER_DATA['curve'].solve_gammas(*_WORKER_DATA['problem'], gammas)
+
+
 # todo accomodate other constraints.  Right now it is for long only
 
 class RiskCurve(MarkowitzOptimizePortfolio):
 
-    def __init__(self, num_samples=10000, *args, **kwargs):
+    def __init__(self, num_samples=10000, *args, adaptive=False, tolerance=1e-3, max_segment=0.05, num_workers=None,
+                 warm_start=True, solver=cp.OSQP, critical_line=False, **kwargs):
         """
         Args:
-            num_samples: <int> number of times to run the optimization problem with varying gamma values
+            num_samples: <int> number of times to run the optimization problem with varying gamma values.  With adaptive
+            sampling this is the maximum number of solves.
+            adaptive: <bool> if True, start from a coarse gamma grid and keep bisecting (in log gamma) the intervals
+            where the frontier bends, instead of a uniform grid of num_samples gammas
+            tolerance: <float> adaptive sampling stops refining an interval once the estimated gap between the frontier
+            and its straight line approximation is below this, in units of the plotted variance and return ranges
+            max_segment: <float> adaptive sampling also refines intervals longer than this, in the same units
+            num_workers: <int> number of processes to spread the solves across.  None or 1 solves in this process.
+            warm_start: <bool> if True each solve starts from the solution at the neighbouring gamma
+            solver: cvxpy solver name, warm starts need a solver that supports them such as OSQP
+            critical_line: <bool> if True, trace the sum_to_one + long_only frontier exactly with the critical line
+            algorithm and evaluate it on the gamma grid, without any solver calls
         """
         super().__init__(*args, **kwargs)
 
         # overwrite gamma
         self.gamma = cp.Parameter(nonneg=True)
         self.num_samples = num_samples
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.max_segment = max_segment
+        self.num_workers = num_workers
+        self.warm_start = warm_start
+        self.solver = solver
+        self.critical_line = critical_line
+        self.log_gamma_bounds = (-2, 2)
+
+    def setup_problem(self):
+        """
+        Set up the problem once with gamma as a cvxpy Parameter, so re-solving only updates the parameter value
+
+        Returns:
+            <cvxpy Problem>, <cvxpy Expression> of the portfolio return and of the portfolio variance
+        """
+        # long only portfolio
+        w = cp.Variable(self.n)  # weight vector to solve for
+        portfolio_ret = self.mu.T @ w
+        portfolio_variance = cp.quad_form(w, self.sigma)  # cp.quad form is the same as w.T @ self.sigma @ w
+
+        obj_func = self.get_objective_function(portfolio_ret, portfolio_variance)
+        constraints = self.get_contraints(w, self.constrs_ls, lev_lim=self.lev_limit)
+
+        return cp.Problem(obj_func, constraints), portfolio_ret, portfolio_variance
+
+    def solve_gammas(self, problem, portfolio_ret, portfolio_variance, gammas):
+        """
+        Re-solve the problem for each gamma in turn.  Pass the gammas sorted so every warm start is from a neighbour.
+
+        Returns:
+            <np.ndarray> of variances, <np.ndarray> of returns, <list> of cvxpy optimization statuses
+        """
+        variance_data = np.full(len(gammas), np.nan)
+        return_data = np.full(len(gammas), np.nan)
+        opt_status_ls = [None] * len(gammas)
+
+        for i, gamma in enumerate(gammas):
+            # Update the gamma value and then re-solve
+            self.gamma.value = gamma
+            problem.solve(solver=self.solver, warm_start=self.warm_start)
+            opt_status_ls[i] = problem.status
+            if portfolio_variance.value is not None:
+                variance_data[i] = portfolio_variance.value
+                return_data[i] = np.ravel(portfolio_ret.value)[0]
+
+        return variance_data, return_data, opt_status_ls
+
+    def solve(self, gammas, problem, executor=None):
+        """
+        Solve for a batch of gammas, split into one contiguous sorted chunk per worker if an executor is given
+
+        Args:
+            gammas: <np.ndarray> of sorted gamma values
+            problem: <tuple> from setup_problem(), used when solving in this process
+            executor: <ProcessPoolExecutor> with workers set up by init_worker()
+        """
+        if executor is None:
+            return self.solve_gammas(*problem, gammas)
+
+        chunks = [x for x in np.array_split(gammas, self.num_workers) if len(x)]
+        results = list(executor.map(solve_gammas_in_worker, chunks))
+        return (np.concatenate([x[0] for x in results]), np.concatenate([x[1] for x in results]),
+                [status for x in results for status in x[2]])
+
+    def refine_log_gammas(self, log_gamma, variance_data, return_data, budget):
+        """
+        Midpoints (in log gamma) of the intervals where a straight line is a poor approximation of the frontier.
+
+        The gap between the frontier and the chord of an interval is estimated as chord length x turning angle at its
+        ends / 4, on variance and return scaled to [0, 1].
+
+        Args:
+            log_gamma: <np.ndarray> sorted log10 gamma values solved so far
+            variance_data: <np.ndarray> portfolio variance per gamma
+            return_data: <np.ndarray> portfolio return per gamma
+            budget: <int> maximum number of new gammas
+
+        Returns:
+            <np.ndarray> sorted new log10 gamma values
+        """
+        points = np.column_stack([variance_data, return_data])
+        points = (points - np.nanmin(points, axis=0)) / np.maximum(np.nanmax(points, axis=0) -
+                                                                   np.nanmin(points, axis=0), 1e-12)
+        segments = np.diff(points, axis=0)
+        chord = np.nan_to_num(np.hypot(segments[:, 0], segments[:, 1]), nan=np.inf)
+
+        heading = np.arctan2(segments[:, 1], segments[:, 0])
+        turn = np.abs((np.diff(heading) + np.pi) % (2 * np.pi) - np.pi)
+        turn[(chord[:-1] < 1e-12) | (chord[1:] < 1e-12)] = 0
+        bend = np.zeros(len(chord))
+        bend[1:] += turn
+        bend[:-1] += turn
+
+        gap = np.nan_to_num(chord * bend / 4, nan=np.inf)
+        score = np.where(chord > self.max_segment, np.inf, gap)
+        refine = np.flatnonzero((score > self.tolerance) & (np.diff(log_gamma) > 1e-6))
+        refine = refine[np.argsort(-score[refine], kind='stable')][:budget]
+
+        return np.sort((log_gamma[refine] + log_gamma[refine + 1]) / 2)
 
     def compute_risk_curve_values(self, problem, portfolio_ret, portfolio_variance):
         """
-        Loop through varying gamma values to produce optimization results
+        Solve over varying gamma values to produce optimization results
 
         Args:
             problem: <cvxpy Problem> with objective and constraints already set up
@@ -37,34 +165,75 @@ class RiskCurve(MarkowitzOptimizePortfolio):
             portfolio_variance: <cvxpy Expression> computing portfolio variance
 
         Returns:
-            <dict> of portfolio optimization results:
+            <dict> of portfolio optimization results, sorted by gamma:
                 <list> calculated variances
                 <list> calculated returns
                 <list> cvxpy optimization statuses per run
-                <list> of gamma values (produced using base 10 logspace (base**start, base**stop) between
-                start: -2 and stop: 2
+                <list> of gamma values (base 10 logspace (base**start, base**stop) between start: -2 and stop: 2,
+                uniform or adaptively refined)
         """
+        lo, hi = self.log_gamma_bounds
+        if self.critical_line:
+            return self.compute_critical_line_values(10 ** np.linspace(lo, hi, num=self.num_samples))
 
-        # initialize the sizes of result arrays
-        variance_data_ls = np.zeros(self.num_samples)
-        return_data_ls = np.zeros(self.num_samples)
-        opt_status_ls = [False] * self.num_samples
-        gamma = np.logspace(-2, 2, base=10, num=self.num_samples)
+        # coarse first pass when adaptive, the refinement rounds then fill in where the frontier bends
+        log_gamma = np.linspace(lo, hi, num=min(self.num_samples, 25) if self.adaptive else self.num_samples)
 
-        for i in range(self.num_samples):
-            # Update the gamma value and then re-solve
-            self.gamma.value = gamma[i]
-            problem.solve()
-            variance_data_ls[i] = portfolio_variance.value
-            return_data_ls[i] = portfolio_ret.value[0]
-            opt_status_ls[i] = problem.status
+        executor = None
+        if self.num_workers is not None and self.num_workers > 1:
+            curve_kwargs = {'num_assets': self.n, 'mu': self.mu, 'sigma': self.sigma, 'constraints': self.constrs_ls,
+                            'lev_limit': self.lev_limit, 'warm_start': self.warm_start, 'solver': self.solver}
+            executor = ProcessPoolExecutor(max_workers=self.num_workers, initializer=init_worker,
+                                           initargs=(curve_kwargs,))
+
+        try:
+            variance_data, return_data, opt_status_ls = self.solve(10 ** log_gamma,
+                                                                   (problem, portfolio_ret, portfolio_variance),
+                                                                   executor)
+
+            while self.adaptive and len(log_gamma) < self.num_samples:
+                new_log_gamma = self.refine_log_gammas(log_gamma, variance_data, return_data,
+                                                       self.num_samples - len(log_gamma))
+                if not len(new_log_gamma):
+                    break
 
-        if all(x for x in opt_status_ls if x == cp.OPTIMAL):
+                new_variance, new_return, new_status = self.solve(10 ** new_log_gamma,
+                                                                  (problem, portfolio_ret, portfolio_variance),
+                                                                  executor)
+                order = np.argsort(np.concatenate([log_gamma, new_log_gamma]), kind='stable')
+                log_gamma = np.concatenate([log_gamma, new_log_gamma])[order]
+                variance_data = np.concatenate([variance_data, new_variance])[order]
+                return_data = np.concatenate([return_data, new_return])[order]
+                opt_status_ls = [(opt_status_ls + new_status)[i] for i in order]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if all(x == cp.OPTIMAL for x in opt_status_ls):
             print('All problems solved as {}'.format(cp.OPTIMAL))
 
-        return {VAR_DATA: variance_data_ls,
-                RET_DATA: return_data_ls,
+        return {VAR_DATA: variance_data,
+                RET_DATA: return_data,
                 OPT_STATUS_DATA: opt_status_ls,
+                GAMMA_DATA: 10 ** log_gamma}
+
+    def compute_critical_line_values(self, gamma):
+        """
+        Evaluate the exact frontier from the critical line algorithm at the given gamma values
+
+        Args:
+            gamma: <np.ndarray> of sorted gamma values
+
+        Returns:
+            <dict> of results in the same form as compute_risk_curve_values()
+        """
+        if set(self.constrs_ls) != {'sum_to_one', 'long_only'}:
+            raise NotImplementedError('The critical line algorithm is implemented for sum_to_one and long_only only')
+
+        return_data, variance_data = CriticalLineAlgorithm(self.mu, self.sigma).frontier(gamma)
+        return {VAR_DATA: variance_data,
+                RET_DATA: return_data,
+                OPT_STATUS_DATA: [cp.OPTIMAL] * len(gamma),
                 GAMMA_DATA: gamma}
 
     def plot_risk_curve(self, optimization_results):
@@ -79,8 +248,9 @@ class RiskCurve(MarkowitzOptimizePortfolio):
         plt.plot(optimization_results[VAR_DATA], optimization_results[RET_DATA])
 
         # show a couple gamma values
-        marker_pos = math.floor(self.num_samples / 3)
-        marker_pos_ls = [marker_pos, self.num_samples - marker_pos]
+        num_results = len(optimization_results[GAMMA_DATA])
+        marker_pos = math.floor(num_results / 3)
+        marker_pos_ls = [marker_pos, num_results - marker_pos]
         for marker_position in marker_pos_ls:
             plt.plot(optimization_results[VAR_DATA][marker_position], optimization_results[RET_DATA][marker_position],
                      'bs')
@@ -92,17 +262,7 @@ class RiskCurve(MarkowitzOptimizePortfolio):
         plt.show()
 
     def __call__(self, *args, **kwargs):
-        # set up the optimization variables
-        # long only portfolio
-        w = cp.Variable(self.n)  # weight vector to solve for
-        portfolio_ret = self.mu.T @ w
-        portfolio_variance = cp.quad_form(w, self.sigma)  # cp.quad form is the same as w.T @ self.sigma @ w
-
-        # set up and solve the optimization problem
-        obj_func = self.get_objective_function(portfolio_ret, portfolio_variance)
-        constraints = self.get_contraints(w, self.constrs_ls)
-
-        problem = cp.Problem(obj_func, constraints)
+        problem, portfolio_ret, portfolio_variance = self.setup_problem()
         res_dict = self.compute_risk_curve_values(problem, portfolio_ret, portfolio_variance)
 
         self.plot_risk_curve(res_dict)
@@ -114,7 +274,8 @@ if __name__ == '__main__':
 
     preprocess = PortfolioOptPreprocess(ls_assets, rets_hist_length_yrs=3)
     preprocess_res = preprocess()
-    x = RiskCurve(num_assets=preprocess.n, mu=preprocess_res['expected_returns'],
+    x = RiskCurve(num_samples=300, adaptive=True, num_workers=4, num_assets=preprocess.n,
+                  mu=preprocess_res['expected_returns'],
                   sigma=preprocess_res['covariance_matrix'],
                   constraints=['sum_to_one', 'long_only'])
     results_dict = x()
@@ -1,8 +1,10 @@
 import numpy as np
 import cvxpy as cp
 import pprint
+import time
 import scipy.sparse as sp
 from portfolio_optimization.portfolio_opt_preprocess import PortfolioOptPreprocess
+from common.math_functions import covariance_factor
 
 
 # Atomic functions documentation: https://www.cvxpy.org/tutorial/functions/index.html
@@ -138,6 +140,154 @@ class MarkowitzOptimizePortfolio:
         return res_dict
 
 
+class ParametrizedMarkowitzPortfolio:
+    def __init__(self, num_assets, constraints: list, factor_covariance=False, num_factors=None, solver=cp.OSQP,
+                 warm_start=True, solver_opts=None):
+        """
+        Markowitz portfolio optimization set up once and re-solved for new inputs, e.g. in a rebalancing loop.
+
+        mu, the leverage limit and the risk term are cvxpy Parameters.  gamma * w.T sigma w is written as
+        ||G w||^2 with G = sqrt(gamma) * L.T and sigma = L L.T, so gamma and the covariance form a single parameter and
+        the problem is DPP: cvxpy canonicalizes it on the first solve only, later solves just update the parameter
+        values and warm start from the previous solution.
+
+        Args:
+            num_assets: number of assets involved in the optimization
+            constraints: <list> of string elements for constraints to apply, as MarkowitzOptimizePortfolio
+            factor_covariance: <bool> if True, run as factor covariance model, sigma F sigma_f F.T + D
+            num_factors: <int> number of factors, required for the factor covariance model
+            solver: cvxpy solver name, warm starts need a solver that supports them such as OSQP
+            warm_start: <bool> if True each solve starts from the previous solution
+            solver_opts: <dict> of solver specific options passed to every solve, e.g. {'time_limit': 1} for OSQP
+        """
+        self.n = num_assets
+        self.constrs_ls = constraints
+        self.factor_covar_model_bool = factor_covariance
+        self.m = num_factors
+        self.solver = solver
+        self.warm_start = warm_start
+        self.solver_opts = solver_opts if solver_opts else {}
+
+        if self.factor_covar_model_bool and not self.m:
+            raise Exception('Factor Covariance Model selected, but required input parameters are missing')
+
+        self.mu = cp.Parameter(self.n)
+        self.lev_limit = cp.Parameter(nonneg=True)
+        self.w = cp.Variable(self.n)  # weight vector to solve for
+
+        if self.factor_covar_model_bool:
+            self.f = cp.Variable(self.m)  # factor exposures
+            self.F = cp.Parameter((self.n, self.m))
+            self.risk_factor = cp.Parameter((self.m, self.m))  # sqrt(gamma) * cholesky factor of sigma_f, transposed
+            self.idio_vol = cp.Parameter(self.n, nonneg=True)  # sqrt(gamma * diag(D))
+            risk_term = cp.sum_squares(self.risk_factor @ self.f) + cp.sum_squares(cp.multiply(self.idio_vol, self.w))
+        else:
+            self.risk_factor = cp.Parameter((self.n, self.n))  # sqrt(gamma) * cholesky factor of sigma, transposed
+            risk_term = cp.sum_squares(self.risk_factor @ self.w)
+
+        self.portfolio_ret = self.mu @ self.w
+        self.problem = cp.Problem(cp.Maximize(self.portfolio_ret - risk_term), self.get_contraints())
+        assert self.problem.is_dpp()
+
+        self.num_solves = 0
+        self.compile_time = None
+
+    def get_contraints(self):
+        """ <list> of contraints, with the leverage limit as a parameter """
+        assert not set(['long_only', 'leverage_limit']).issubset(
+            self.constrs_ls)  # cannot have both long only and leverage constraint
+
+        dict_constraints = {'sum_to_one': cp.sum(self.w) == 1,
+                            'long_only': self.w >= 0,
+                            'leverage_limit': cp.norm(self.w, 1) <= self.lev_limit}
+
+        if not set(self.constrs_ls).issubset(dict_constraints.keys()):
+            missing_items = set(self.constrs_ls) - set(dict_constraints.keys())
+            raise NotImplementedError('{} constraints have not been implemented'.format(missing_items))
+
+        model_constraints = [c for k, c in dict_constraints.items() if k in self.constrs_ls]
+
+        if self.factor_covar_model_bool:
+            model_constraints = model_constraints + [self.f == self.F.T @ self.w]
+
+        return model_constraints
+
+    def set_parameters(self, mu, sigma, gamma, lev_limit=1, sigma_factor=None, **kwargs):
+        """
+        Update the parameter values for the next solve
+
+        Args:
+            mu: vector containing the mean returns of the assets
+            sigma: covariance matrix, or the factor covariance matrix for the factor covariance model
+            gamma: risk adversion parameter - higher the number, the more risk adverse
+            lev_limit: <int> or <float> to represent how much to allow to leverage
+            sigma_factor: <np.ndarray> covariance_factor(sigma) if already computed, saves the factorization when
+            only gamma or the leverage limit change between solves
+
+            For factor_covariance == True:
+                D: <scipy matrix> diagonal matrix for idiosyncratic risk
+                F: <np.ndarray> of factor loadings of shape: num_assets x num_factors
+        """
+        assert gamma >= 0 and lev_limit >= 1
+
+        if sigma_factor is None:
+            sigma_factor = covariance_factor(np.asarray(sigma, dtype=float))
+
+        self.mu.value = np.asarray(mu, dtype=float).ravel()
+        self.lev_limit.value = lev_limit
+        self.risk_factor.value = np.sqrt(gamma) * sigma_factor.T
+
+        if self.factor_covar_model_bool:
+            D, F = kwargs.get('D', None), kwargs.get('F', None)
+            if D is None or F is None:
+                raise Exception('Factor Covariance Model selected, but required input parameters are missing')
+            idio_var = D.diagonal() if sp.issparse(D) or np.ndim(D) == 2 else np.asarray(D)
+            self.F.value = np.asarray(F, dtype=float)
+            self.idio_vol.value = np.sqrt(gamma * idio_var)
+
+    def __call__(self, mu, sigma, gamma, lev_limit=1, sigma_factor=None, **kwargs):
+        """
+        Solve for new inputs, see set_parameters() for the arguments
+
+        Returns:
+            <dict> of results as MarkowitzOptimizePortfolio, plus timings in seconds: compile_time, the
+            canonicalization time of the first solve, and for this solve parameter_time, the time to update the
+            parameters (including the covariance factorization and cvxpy's re-canonicalization), and solve_time, the
+            solver time
+        """
+        ts = time.perf_counter()
+        self.set_parameters(mu, sigma, gamma, lev_limit, sigma_factor, **kwargs)
+        parameter_time = time.perf_counter() - ts
+
+        self.problem.solve(solver=self.solver, warm_start=self.warm_start, **self.solver_opts)
+        self.num_solves += 1
+
+        if self.compile_time is None:
+            self.compile_time = self.problem.compilation_time
+        else:
+            parameter_time += self.problem.compilation_time
+
+        w = self.w.value
+        res_dict = {'w': w,
+                    'portfolio_ret': self.portfolio_ret.value,
+                    'portfolio_variance': None if w is None else self.portfolio_variance(w, sigma, **kwargs),
+                    'status': self.problem.status,
+                    'compile_time': self.compile_time,
+                    'parameter_time': parameter_time,
+                    'solve_time': self.problem.solver_stats.solve_time}
+
+        if self.factor_covar_model_bool:
+            res_dict.update({'factor_exposures': self.f.value})
+
+        return res_dict
+
+    def portfolio_variance(self, w, sigma, **kwargs):
+        if not self.factor_covar_model_bool:
+            return w @ sigma @ w
+        exposures = kwargs['F'].T @ w
+        return exposures @ sigma @ exposures + w @ (kwargs['D'] @ w)
+
+
 class MinRiskOptimizePortfolio:
     def __init__(self, num_assets: int, sigma, mu, min_ret=0.1):
         self.n = num_assets
@@ -161,20 +311,135 @@ class MinRiskOptimizePortfolio:
         return w.value
 
 
+class ParametrizedMinRiskPortfolio:
+    def __init__(self, num_assets: int, lev_limit=2, solver=cp.OSQP, warm_start=True):
+        """
+        MinRiskOptimizePortfolio set up once with mu, the minimum return and the covariance factor as cvxpy
+        Parameters, re-solved with warm starts for new inputs (see ParametrizedMarkowitzPortfolio)
+
+        Args:
+            num_assets: number of assets involved in the optimization
+            lev_limit: <int> or <float> max sum of absolute weights
+            solver: cvxpy solver name, warm starts need a solver that supports them such as OSQP
+            warm_start: <bool> if True each solve starts from the previous solution
+        """
+        self.n = num_assets
+        self.solver = solver
+        self.warm_start = warm_start
+
+        self.mu = cp.Parameter(self.n)
+        self.min_ret = cp.Parameter()
+        self.risk_factor = cp.Parameter((self.n, self.n))  # cholesky factor of sigma, transposed
+        self.w = cp.Variable(self.n)
+
+        self.portfolio_ret = self.mu @ self.w
+        constraints_ls = [cp.sum(self.w) == 1, self.portfolio_ret >= self.min_ret, cp.norm(self.w, 1) <= lev_limit]
+        self.problem = cp.Problem(cp.Minimize(cp.sum_squares(self.risk_factor @ self.w)), constraints_ls)
+        assert self.problem.is_dpp()
+
+        self.compile_time = None
+
+    def __call__(self, mu, sigma, min_ret=0.1):
+        """
+        Args:
+            mu: vector containing the mean returns of the assets
+            sigma: covariance matrix
+            min_ret: <float> required minimum portfolio return
+
+        Returns:
+            <dict> of results as ParametrizedMarkowitzPortfolio
+        """
+        ts = time.perf_counter()
+        self.mu.value = np.asarray(mu, dtype=float).ravel()
+        self.min_ret.value = min_ret
+        self.risk_factor.value = covariance_factor(np.asarray(sigma, dtype=float)).T
+        parameter_time = time.perf_counter() - ts
+
+        self.problem.solve(solver=self.solver, warm_start=self.warm_start)
+        if self.compile_time is None:
+            self.compile_time = self.problem.compilation_time
+        else:
+            parameter_time += self.problem.compilation_time
+
+        w = self.w.value
+        return {'w': w,
+                'portfolio_ret': self.portfolio_ret.value,
+                'portfolio_variance': None if w is None else w @ sigma @ w,
+                'status': self.problem.status,
+                'compile_time': self.compile_time,
+                'parameter_time': parameter_time,
+                'solve_time': self.problem.solver_stats.solve_time}
+
+
+def worst_case_risk_box(W, sigma, delta_limit=0.2, tolerance=1e-10):
+    """
+    Worst case risk under elementwise (box) uncertainty of the covariances, for many weight vectors at once
+
+    Over symmetric deltas with a zero diagonal and |delta_ij| <= delta_limit, w.T delta w is maximized by
+    delta_ij = delta_limit * sign(w_i w_j), which adds delta_limit * ((sum |w_i|)^2 - sum w_i^2) to the variance.
+    This is the optimum of the WorstCaseRiskPortfolio SDP whenever sigma + delta is still PSD - always the case if the
+    smallest eigenvalue of sigma is at least delta_limit - and otherwise an upper bound on it.
+
+    Args:
+        W: <np.ndarray> of weights with shape (num_assets,) or (num_assets, num_portfolios)
+        sigma: <np.ndarray> covariance matrix
+        delta_limit: <float> max absolute change of each covariance
+        tolerance: <float> eigenvalue tolerance of the PSD check
+
+    Returns:
+        <dict> of actual and worst case standard deviations, and whether the bound is exact, per portfolio
+    """
+    W = np.asarray(W, dtype=float).reshape(len(W), -1)
+    variance = np.einsum('ij,ij->j', W, sigma @ W)
+    worst_variance = variance + delta_limit * (np.abs(W).sum(axis=0) ** 2 - (W ** 2).sum(axis=0))
+
+    exact = np.full(W.shape[1], np.linalg.eigvalsh(sigma)[0] >= delta_limit - tolerance)
+    if not exact.all():
+        # the worst case delta only depends on the sign pattern of w, e.g. one check covers every long only portfolio
+        sign_patterns, pattern_idx = np.unique(np.sign(W).T, axis=0, return_inverse=True)
+        for k, signs in enumerate(sign_patterns):
+            delta = delta_limit * np.outer(signs, signs)
+            np.fill_diagonal(delta, 0)
+            exact[pattern_idx.ravel() == k] = np.linalg.eigvalsh(sigma + delta)[0] >= -tolerance
+
+    return {'actual_std': np.sqrt(variance),
+            'worst_case_std': np.sqrt(worst_variance),
+            'exact': exact}
+
+
 class WorstCaseRiskPortfolio:
-    def __init__(self, num_assets: int, sigma, w):
+    def __init__(self, num_assets: int, sigma, w, delta_limit=0.2, method='sdp'):
+        """
+        Args:
+            num_assets: number of assets
+            sigma: covariance matrix
+            w: weight vector, or with method 'box' a (num_assets, num_portfolios) matrix of weight vectors
+            delta_limit: <float> max absolute change of each covariance
+            method: <str> 'sdp' to solve the semidefinite program (exact, O(n^2) variables), or 'box' for the
+            closed form of worst_case_risk_box() which scales to hundreds of assets and many portfolios
+        """
         self.n = num_assets
         self.sigma = sigma
         self.w = w
+        self.delta_limit = delta_limit
+        self.method = method
 
     def run_opt(self):
         """ Run optimization for the worst case risk over possible covariance matrices """
+        if self.method == 'box':
+            res = worst_case_risk_box(self.w, self.sigma, self.delta_limit)
+            if np.ndim(self.w) == 1:
+                res = {k: v[0] for k, v in res.items()}
+            return res
+        if self.method != 'sdp':
+            raise NotImplementedError('{} method has not been implemented'.format(self.method))
+
         sigma_opt = cp.Variable((self.n, self.n), PSD=True)  # positive semi-definite
         delta = cp.Variable((self.n, self.n), symmetric=True)  # difference between the input covar and the testing ones
         risk = cp.quad_form(self.w, sigma_opt)
 
         # elementwise delta constrained and must be zero on diagonals
-        constraints_ls = [sigma_opt == self.sigma + delta, cp.diag(delta) == 0, cp.abs(delta) <= 0.2]
+        constraints_ls = [sigma_opt == self.sigma + delta, cp.diag(delta) == 0, cp.abs(delta) <= self.delta_limit]
 
         prob = cp.Problem(cp.Maximize(risk), constraints_ls)
         prob.solve()
@@ -202,3 +467,7 @@ if __name__ == '__main__':
 
     z = WorstCaseRiskPortfolio(num_assets=preprocess.n, sigma=preprocess_res['covariance_matrix'], w=w)
     print(z.run_opt())
+
+    z_box = WorstCaseRiskPortfolio(num_assets=preprocess.n, sigma=preprocess_res['covariance_matrix'], w=w,
+                                   method='box')
+    print(z_box.run_opt())
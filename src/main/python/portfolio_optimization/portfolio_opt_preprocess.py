@@ -2,27 +2,61 @@ from common.common_functions import get_price_data
 import datetime as dt
 from common.timeit import timeit
 import numpy as np
+import pandas as pd
 import pprint
+from portfolio_optimization.shrinkage_estimators import SHRINKAGE_ESTIMATORS
+from common.returns_panel import ReturnsPanel, LOG
 
 
 class PortfolioOptPreprocess:
     """ Class to get the returns and covariance matrix needed for the portfolio optimization """
 
     def __init__(self, asset_name_ls, rets_hist_length_yrs=10,
-                 end_date=dt.datetime.today()):
+                 end_date=dt.datetime.today(), covariance_method='sample', returns_panel=None):
+        """
+        Args:
+            asset_name_ls: <list> of asset tickers
+            rets_hist_length_yrs: <int> number of years of return history
+            end_date: <dt.datetime> last date of the history
+            covariance_method: <str> 'sample', or one of the shrinkage_estimators.SHRINKAGE_ESTIMATORS: 'ledoit_wolf',
+            'oas' or 'constant_correlation'.  Shrinkage gives better conditioned matrices when the number of assets
+            is close to the number of dates.
+            returns_panel: <ReturnsPanel> of the assets' prices to use instead of downloading them
+        """
+        if covariance_method != 'sample' and covariance_method not in SHRINKAGE_ESTIMATORS:
+            raise NotImplementedError('{} covariance has not been implemented'.format(covariance_method))
+
         self.n = len(asset_name_ls)  # number of assets
-        self.df_price_data = get_price_data(asset_name_ls, end_date, look_back_mths=rets_hist_length_yrs * 12)
+        self.covariance_method = covariance_method
+        self.shrinkage = None
+        if returns_panel is None:
+            returns_panel = ReturnsPanel.from_prices(
+                get_price_data(asset_name_ls, end_date, look_back_mths=rets_hist_length_yrs * 12))
+        self.panel = returns_panel.subset(assets=asset_name_ls)
+
+    @property
+    def df_price_data(self):
+        return self.panel.prices
+
+    @property
+    def log_rets(self):
+        """ Daily log returns, computed once from the price data """
+        return self.panel.log_returns
 
     def expected_returns(self):
-        return self.df_price_data.pct_change().apply(lambda x: np.log(1 + x)).mean()
+        return self.panel.mean(LOG)
 
     def covar_matrix(self):
         # just want to see the volatility
-        pprint.pprint({'annual_std':
-            self.df_price_data.pct_change().apply(lambda x: np.log(1 + x)).std().apply(
-                lambda x: x * np.sqrt(250))})
+        pprint.pprint({'annual_std': self.panel.std(LOG) * np.sqrt(250)})
 
-        return self.df_price_data.pct_change().apply(lambda x: np.log(1 + x)).cov()
+        if self.covariance_method == 'sample':
+            return self.panel.cov(LOG)
+
+        # the shrinkage estimators need complete rows
+        df_rets = self.log_rets.dropna()
+        cov, self.shrinkage = SHRINKAGE_ESTIMATORS[self.covariance_method](df_rets.to_numpy())
+        return pd.DataFrame(cov, index=df_rets.columns, columns=df_rets.columns)
 
     @timeit
     def __call__(self, *args, **kwargs):
@@ -42,3 +76,7 @@ if __name__ == '__main__':
     res = x()
 
     pprint.pprint(res)
+
+    y = PortfolioOptPreprocess(ls_assets, rets_hist_length_yrs=3, covariance_method='ledoit_wolf')
+    pprint.pprint(y())
+    print('shrinkage: {:.3f}'.format(y.shrinkage))
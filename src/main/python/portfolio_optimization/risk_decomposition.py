@@ -0,0 +1,109 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.stats import norm
+from portfolio_optimization.portfolio_opt import MarkowitzOptimizePortfolio
+from portfolio_optimization.portfolio_opt_preprocess import PortfolioOptPreprocess
+
+
+def covariance_weights_product(W, sigma, factor_covariance=False, **kwargs):
+    """
+    Sigma @ W for a matrix of weight vectors, the only O(n^2) (or O(n * m) in factor form) step of the decomposition
+
+    Args:
+        W: <np.ndarray> of weights with shape (num_assets, num_portfolios)
+        sigma: <np.ndarray> asset covariance matrix, or the factor covariance matrix if factor_covariance is True
+        factor_covariance: <bool> if True, the covariance is F sigma F.T + D.  Additionally params required.
+
+        For factor_covariance == True:
+            D: <scipy matrix> diagonal matrix for idiosyncratic risk
+            F: <np.ndarray> of factor loadings of shape: num_assets x num_factors
+
+    Returns:
+        <np.ndarray> of shape (num_assets, num_portfolios)
+    """
+    if not factor_covariance:
+        return sigma @ W
+
+    D, F = kwargs.get('D', None), kwargs.get('F', None)
+    if D is None or F is None:
+        raise Exception('Factor Covariance Model selected, but required input parameters are missing')
+
+    idio_var = D.diagonal() if sp.issparse(D) or np.ndim(D) == 2 else np.asarray(D)
+    return F @ (sigma @ (F.T @ W)) + idio_var[:, None] * W
+
+
+def risk_contributions(W, sigma, factor_covariance=False, **kwargs):
+    """
+    Marginal, component and percentage contributions to portfolio volatility for many weight vectors at once
+
+    marginal_i = (Sigma w)_i / sigma_p, component_i = w_i * marginal_i, and the components sum to sigma_p (Euler).
+
+    Args:
+        W: <np.ndarray> of weights with shape (num_assets,) or (num_assets, num_portfolios)
+        sigma: <np.ndarray> asset covariance matrix, or the factor covariance matrix if factor_covariance is True
+        factor_covariance: <bool> if True, pass D and F as for covariance_weights_product()
+
+    Returns:
+        <dict> of portfolio volatility (num_portfolios,) and marginal, component and percent contributions
+        (num_assets, num_portfolios)
+    """
+    W = np.asarray(W, dtype=float).reshape(len(W), -1)
+    sigma_w = covariance_weights_product(W, sigma, factor_covariance, **kwargs)
+
+    vol = np.sqrt(np.einsum('ij,ij->j', W, sigma_w))
+    marginal = sigma_w / vol
+    component = W * marginal
+
+    return {'volatility': vol,
+            'marginal': marginal,
+            'component': component,
+            'percent': component / vol}
+
+
+def VaR_contributions(W, mu, sigma, confidence_level=0.95, factor_covariance=False, **kwargs):
+    """
+    Marginal, component and percentage contributions to the gaussian value at risk for many weight vectors at once.
+
+    Same sign convention as risk_functions.gaussian_VaR: VaR = w.T mu + z * sigma_p with z the (1 - confidence level)
+    quantile, so a loss is negative.
+
+    Args:
+        W: <np.ndarray> of weights with shape (num_assets,) or (num_assets, num_portfolios)
+        mu: <np.ndarray> vector containing the mean returns of the assets
+        sigma: <np.ndarray> asset covariance matrix, or the factor covariance matrix if factor_covariance is True
+        confidence_level: <float> VaR confidence level
+        factor_covariance: <bool> if True, pass D and F as for covariance_weights_product()
+
+    Returns:
+        <dict> of portfolio VaR (num_portfolios,) and marginal, component and percent contributions
+        (num_assets, num_portfolios)
+    """
+    W = np.asarray(W, dtype=float).reshape(len(W), -1)
+    mu = np.asarray(mu, dtype=float).reshape(-1, 1)
+    z_score = norm.ppf(1 - confidence_level)
+
+    vol_res = risk_contributions(W, sigma, factor_covariance, **kwargs)
+    marginal = mu + z_score * vol_res['marginal']
+    component = W * marginal
+    var = component.sum(axis=0)
+
+    return {'VaR': var,
+            'marginal': marginal,
+            'component': component,
+            'percent': component / var}
+
+
+if __name__ == '__main__':
+    ls_assets = ['AAPL', 'NKE', 'GOOGL', 'AMZN']
+
+    preprocess = PortfolioOptPreprocess(ls_assets, rets_hist_length_yrs=3)
+    preprocess_res = preprocess()
+
+    # decompose the optimal portfolio across a few risk adversion levels together
+    W = np.column_stack([MarkowitzOptimizePortfolio(num_assets=preprocess.n, mu=preprocess_res['expected_returns'],
+                                                    sigma=preprocess_res['covariance_matrix'], gamma=gamma,
+                                                    constraints=['sum_to_one', 'long_only'])()['w']
+                         for gamma in [1, 10, 100]])
+
+    print(risk_contributions(W, preprocess_res['covariance_matrix'])['percent'])
+    print(VaR_contributions(W, preprocess_res['expected_returns'], preprocess_res['covariance_matrix']))
@@ -0,0 +1,154 @@
+import numpy as np
+from scipy.cluster.hierarchy import linkage, leaves_list
+from scipy.linalg import cho_factor, cho_solve
+from scipy.spatial.distance import squareform
+
+
+# Allocators solved directly in numpy / scipy, no cvxpy problem is built.  Both run in milliseconds for 1000+ assets.
+
+def correlation_distance(sigma):
+    """
+    Args:
+        sigma: <np.ndarray> covariance matrix
+
+    Returns:
+        <np.ndarray> distance matrix sqrt((1 - rho_ij) / 2), 0 for perfectly correlated and 1 for opposite assets
+    """
+    std = np.sqrt(np.diag(sigma))
+    corr = np.clip(sigma / np.outer(std, std), -1, 1)
+    dist = np.sqrt((1 - corr) / 2)
+    np.fill_diagonal(dist, 0)
+    return dist
+
+
+def inverse_variance_weights(sigma):
+    """ <np.ndarray> weights proportional to 1 / variance """
+    ivp = 1 / np.diag(sigma)
+    return ivp / ivp.sum()
+
+
+def hierarchical_risk_parity(sigma, linkage_method='single'):
+    """
+    Hierarchical risk parity (Lopez de Prado, 2016)
+
+    1. Tree clustering: hierarchical clustering of the assets on the correlation distance.
+    2. Quasi-diagonalization: the assets are ordered as the leaves of the tree, so similar assets are adjacent.
+    3. Recursive bisection: every cluster is split in two halves of the order, which share the cluster weight in
+    inverse proportion to their variance under inverse variance weights.  All the clusters of a level are split
+    together, so the bisection costs O(num_assets^2) per level.
+
+    Args:
+        sigma: <np.ndarray> covariance matrix
+        linkage_method: <str> scipy.cluster.hierarchy.linkage method, e.g. 'single', 'average', 'ward'
+
+    Returns:
+        <dict> of w: <np.ndarray> long only weights summing to 1, order: <np.ndarray> quasi-diagonal asset order and
+        linkage: <np.ndarray> the scipy linkage matrix
+    """
+    sigma = np.asarray(sigma, dtype=float)
+    link = linkage(squareform(correlation_distance(sigma), checks=False), method=linkage_method)
+    order = leaves_list(link)
+
+    w = np.ones(len(sigma))
+    clusters = [order]
+    while clusters:
+        next_clusters = []
+        for items in clusters:
+            if len(items) < 2:
+                continue
+            half = len(items) // 2
+            left, right = items[:half], items[half:]
+
+            left_var = cluster_variance(sigma, left)
+            right_var = cluster_variance(sigma, right)
+            alpha = 1 - left_var / (left_var + right_var)
+
+            w[left] *= alpha
+            w[right] *= 1 - alpha
+            next_clusters += [left, right]
+        clusters = next_clusters
+
+    return {'w': w,
+            'order': order,
+            'linkage': link}
+
+
+def cluster_variance(sigma, items):
+    """ Variance of the inverse variance portfolio of a cluster of assets """
+    sub_sigma = sigma[np.ix_(items, items)]
+    w = inverse_variance_weights(sub_sigma)
+    return w @ sub_sigma @ w
+
+
+def equal_risk_contribution(sigma, risk_budget=None, tolerance=1e-10, max_iter=100):
+    """
+    Long only portfolio whose assets contribute risk in proportion to risk_budget (equal risk contribution by default).
+
+    Newton's method on the convex formulation of Spinu (2013): x = argmin 0.5 x.T sigma x - b.T log(x), whose
+    optimality condition x_i (sigma x)_i = b_i is exactly the risk budgeting condition, then w = x / sum(x).  Each
+    step is cut back to stay inside x > 0 and then backtracked until the objective decreases enough (Armijo), so
+    unequal and very small budgets converge too, in a few tens of iterations, each one Cholesky factorization.
+
+    Args:
+        sigma: <np.ndarray> covariance matrix, positive definite
+        risk_budget: <np.ndarray> positive risk budgets, normalized to sum to 1.  Defaults to equal budgets.
+        tolerance: <float> stop when the Newton decrement lambda^2 / 2 falls below it
+        max_iter: <int> maximum number of Newton iterations
+
+    Returns:
+        <dict> of w: <np.ndarray> weights summing to 1, status: <str> 'optimal', 'max_iter_reached' or 'infeasible'
+        if a weight is not positive, and iterations: <int>
+    """
+    sigma = np.asarray(sigma, dtype=float)
+    n = len(sigma)
+    b = np.full(n, 1 / n) if risk_budget is None else np.asarray(risk_budget, dtype=float) / np.sum(risk_budget)
+    assert (b > 0).all()
+
+    def objective(x):
+        return 0.5 * x @ sigma @ x - b @ np.log(x)
+
+    # the solution of the uncorrelated case is a good start
+    x = np.sqrt(b / np.diag(sigma))
+    status = 'max_iter_reached'
+    for iteration in range(1, max_iter + 1):
+        grad = sigma @ x - b / x
+        hessian = sigma + np.diag(b / x ** 2)
+        step = cho_solve(cho_factor(hessian), grad)
+        decrement = np.sqrt(grad @ step)
+
+        # largest step length that keeps x positive, with a margin, then backtrack to a sufficient decrease
+        shrinking = step > 0
+        t = min(1., 0.99 * np.min(x[shrinking] / step[shrinking])) if shrinking.any() else 1.
+        f = objective(x)
+        while t > 1e-10 and objective(x - t * step) > f - 0.25 * t * decrement ** 2:
+            t /= 2
+        x = x - t * step
+
+        if decrement ** 2 / 2 < tolerance:
+            # the last full newton step squares the remaining error
+            status = 'optimal' if (x > 0).all() else 'infeasible'
+            break
+
+    return {'w': x / x.sum(),
+            'status': status,
+            'iterations': iteration}
+
+
+if __name__ == '__main__':
+    import time
+    from portfolio_optimization.risk_decomposition import risk_contributions
+
+    np.random.seed(1)
+    num_assets = 1000
+    loadings = np.random.randn(num_assets, 10)
+    sigma = loadings @ loadings.T * 1e-5 + np.diag(np.random.uniform(1e-4, 4e-4, num_assets))
+
+    ts = time.time()
+    hrp = hierarchical_risk_parity(sigma)
+    print('hrp {:.3f} s'.format(time.time() - ts))
+
+    ts = time.time()
+    erc = equal_risk_contribution(sigma)
+    print('erc {:.3f} s, {} iterations, {}'.format(time.time() - ts, erc['iterations'], erc['status']))
+    print('max deviation from equal risk {:.2e}'.format(
+        np.abs(risk_contributions(erc['w'], sigma)['percent'] - 1 / num_assets).max()))
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+from common.returns_panel import returns_frame
+
+
+class RollingFactorExposures:
+    def __init__(self, window=None, halflife=None, min_periods=None, add_intercept=True):
+        """
+        Time varying factor exposures of every asset at once: on each date, the OLS (or exponentially weighted least
+        squares) regression of the asset returns on the factor returns over a trailing window.
+
+        All the regressions share the factor returns X, so each date only needs X'X (num_factors x num_factors) and
+        X'Y (num_factors x num_assets).  With equal weights they are cumulative sums differenced over the window, with
+        exponential weights they are updated recursively, S_t = lambda S_t-1 + x_t x_t.T (minus the observation
+        leaving the window).  The normal equations of all the dates are then solved in one batched call, in
+        O(num_dates * num_factors * num_assets) overall.
+
+        Args:
+            window: <int> number of dates per regression.  None for an expanding window, whose last date is the full
+            sample regression.
+            halflife: <float> halflife in number of dates of exponentially decaying observation weights, None for
+            equal weights
+            min_periods: <int> minimum number of observations for an estimate, defaults to window, or to the halflife
+            for an expanding window
+            add_intercept: <bool> if True, regress with an intercept, returned as alpha
+        """
+        assert window is None or window > 1
+        assert halflife is None or halflife > 0
+
+        self.window = window
+        self.halflife = halflife
+        self.add_intercept = add_intercept
+
+        if min_periods is None:
+            min_periods = window if window else int(np.ceil(halflife)) if halflife else 2
+        self.min_periods = min_periods
+
+    def regressors(self, factors):
+        if not self.add_intercept:
+            return factors
+        return np.column_stack([np.ones(len(factors)), factors])
+
+    def cross_products(self, X, Y):
+        """
+        Args:
+            X: <np.ndarray> of regressors with shape (num_dates, num_regressors)
+            Y: <np.ndarray> of returns with shape (num_dates, num_assets)
+
+        Returns:
+            <np.ndarray> X'X per date (num_dates, num_regressors, num_regressors), <np.ndarray> X'Y per date
+            (num_dates, num_regressors, num_assets)
+        """
+        if self.halflife is None:
+            XX = np.cumsum(X[:, :, None] * X[:, None, :], axis=0)
+            XY = np.cumsum(X[:, :, None] * Y[:, None, :], axis=0)
+            if self.window:
+                XX[self.window:] = XX[self.window:] - XX[:-self.window]
+                XY[self.window:] = XY[self.window:] - XY[:-self.window]
+            return XX, XY
+
+        decay = 0.5 ** (1 / self.halflife)
+        num_dates, num_regressors = X.shape
+        XX = np.empty((num_dates, num_regressors, num_regressors))
+        XY = np.empty((num_dates, num_regressors, Y.shape[1]))
+        xx, xy = np.zeros(XX.shape[1:]), np.zeros(XY.shape[1:])
+        leave_weight = decay ** self.window if self.window else 0
+
+        for t in range(num_dates):
+            xx = decay * xx + np.outer(X[t], X[t])
+            xy = decay * xy + np.outer(X[t], Y[t])
+            if self.window and t >= self.window:
+                xx -= leave_weight * np.outer(X[t - self.window], X[t - self.window])
+                xy -= leave_weight * np.outer(X[t - self.window], Y[t - self.window])
+            XX[t], XY[t] = xx, xy
+
+        return XX, XY
+
+    def __call__(self, df_rets, df_factors):
+        """
+        Estimate the exposures on every date
+
+        Args:
+            df_rets: <pd.DataFrame> of asset (excess) returns or a ReturnsPanel.  Date index with asset names as
+            columns, no NaNs.
+            df_factors: <pd.DataFrame> of factor returns, e.g. the fama french factors.  Only the dates in both are
+            used.
+
+        Returns:
+            <dict> of:
+                exposures: <np.ndarray> of shape (num_dates, num_assets, num_factors), NaN before min_periods and on
+                dates where the factor returns of the window are collinear
+                alpha: <np.ndarray> of intercepts of shape (num_dates, num_assets), if add_intercept
+                dates: <pd.Index>, assets: <pd.Index>, factors: <pd.Index>
+        """
+        df_rets = returns_frame(df_rets)
+        dates = df_rets.index.intersection(df_factors.index)
+        Y = df_rets.loc[dates].to_numpy(dtype=float)
+        factors = df_factors.loc[dates].to_numpy(dtype=float)
+        assert not np.isnan(Y).any() and not np.isnan(factors).any()
+
+        X = self.regressors(factors)
+        XX, XY = self.cross_products(X, Y)
+
+        num_dates, num_assets = Y.shape
+        coefs = np.full((num_dates, X.shape[1], num_assets), np.nan)
+        valid = np.arange(num_dates) >= self.min_periods - 1
+        # the regression is not identified with fewer observations than regressors, or collinear factors
+        valid[valid] = np.linalg.matrix_rank(XX[valid], hermitian=True) == X.shape[1]
+        coefs[valid] = np.linalg.solve(XX[valid], XY[valid])
+
+        res_dict = {'exposures': coefs[:, int(self.add_intercept):].transpose(0, 2, 1),
+                    'dates': dates,
+                    'assets': df_rets.columns,
+                    'factors': df_factors.columns}
+
+        if self.add_intercept:
+            res_dict.update({'alpha': coefs[:, 0]})
+
+        return res_dict
+
+
+if __name__ == '__main__':
+    import time
+
+    np.random.seed(1)
+    num_dates, num_assets = 252 * 10, 500
+    dates = pd.bdate_range('2012-01-01', periods=num_dates)
+    df_factors = pd.DataFrame(np.random.randn(num_dates, 3) * 0.01, index=dates, columns=['Mkt-RF', 'SMB', 'HML'])
+    # exposures drifting slowly through time
+    true_exposures = 1 + np.cumsum(np.random.randn(num_dates, num_assets, 3) * 0.01, axis=0)
+    df_rets = pd.DataFrame(np.einsum('tij,tj->ti', true_exposures, df_factors.to_numpy()) +
+                           np.random.randn(num_dates, num_assets) * 0.01, index=dates)
+
+    for kwargs in [{'window': 252}, {'halflife': 63}]:
+        ts = time.time()
+        res = RollingFactorExposures(**kwargs)(df_rets, df_factors)
+        error = np.nanmean(np.abs(res['exposures'] - true_exposures))
+        print('{}: {:.2f} s, mean absolute error {:.3f}'.format(kwargs, time.time() - ts, error))
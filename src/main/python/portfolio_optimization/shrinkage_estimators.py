@@ -0,0 +1,113 @@
+import numpy as np
+
+
+# All estimators shrink the maximum likelihood covariance (normalized by the number of dates T, as scikit-learn) and
+# return it with the shrinkage intensity in [0, 1].
+
+def empirical_covariance(rets):
+    """
+    Args:
+        rets: <np.ndarray> of returns with shape (num_dates, num_assets), no NaNs
+
+    Returns:
+        <np.ndarray> demeaned returns, <np.ndarray> covariance matrix normalized by num_dates
+    """
+    X = rets - rets.mean(axis=0)
+    return X, X.T @ X / len(X)
+
+
+def ledoit_wolf(rets):
+    """
+    Ledoit-Wolf (2004) shrinkage towards a scaled identity, mu * I with mu the average variance
+
+    Args:
+        rets: <np.ndarray> of returns with shape (num_dates, num_assets), no NaNs
+
+    Returns:
+        <np.ndarray> covariance matrix, <float> shrinkage intensity
+    """
+    X, sample = empirical_covariance(rets)
+    num_dates, num_assets = X.shape
+    mu = np.trace(sample) / num_assets
+
+    X2 = X ** 2
+    # squared distance of the sample from the target, and the estimation error of the sample covariance
+    delta = ((sample - mu * np.eye(num_assets)) ** 2).sum() / num_assets
+    beta = ((X2.T @ X2).sum() / num_dates - (sample ** 2).sum()) / (num_assets * num_dates)
+    beta = min(beta, delta)
+
+    shrinkage = 0. if beta == 0 else beta / delta
+    return (1 - shrinkage) * sample + shrinkage * mu * np.eye(num_assets), shrinkage
+
+
+def oracle_approximating(rets):
+    """
+    Oracle approximating shrinkage (Chen, Wiesel, Eldar & Hero, 2010) towards a scaled identity
+
+    Args:
+        rets: <np.ndarray> of returns with shape (num_dates, num_assets), no NaNs
+
+    Returns:
+        <np.ndarray> covariance matrix, <float> shrinkage intensity
+    """
+    _, sample = empirical_covariance(rets)
+    num_dates, num_assets = rets.shape
+
+    alpha = np.mean(sample ** 2)
+    mu = np.trace(sample) / num_assets
+    num = alpha + mu ** 2
+    den = (num_dates + 1) * (alpha - mu ** 2 / num_assets)
+
+    shrinkage = 1. if den == 0 else min(num / den, 1.)
+    return (1 - shrinkage) * sample + shrinkage * mu * np.eye(num_assets), shrinkage
+
+
+def constant_correlation(rets):
+    """
+    Ledoit-Wolf (2004) shrinkage towards the constant correlation model: sample variances with every correlation set to
+    the average sample correlation
+
+    Args:
+        rets: <np.ndarray> of returns with shape (num_dates, num_assets), no NaNs
+
+    Returns:
+        <np.ndarray> covariance matrix, <float> shrinkage intensity
+    """
+    X, sample = empirical_covariance(rets)
+    num_dates, num_assets = X.shape
+    var = np.diag(sample)
+    std = np.sqrt(var)
+
+    avg_corr = ((sample / np.outer(std, std)).sum() - num_assets) / (num_assets * (num_assets - 1))
+    target = avg_corr * np.outer(std, std)
+    np.fill_diagonal(target, var)
+
+    # pi: asymptotic variances of the sample covariances
+    pi_mat = (X ** 2).T @ (X ** 2) / num_dates - sample ** 2
+
+    # rho: asymptotic covariances of the target with the sample
+    theta = (X ** 3).T @ X / num_dates - var[:, None] * sample
+    np.fill_diagonal(theta, 0)
+    rho = np.trace(pi_mat) + avg_corr * ((std[None, :] / std[:, None]) * theta).sum()
+
+    # gamma: misspecification of the target
+    gamma = ((sample - target) ** 2).sum()
+
+    kappa = (pi_mat.sum() - rho) / gamma
+    shrinkage = max(0., min(1., kappa / num_dates))
+    return shrinkage * target + (1 - shrinkage) * sample, shrinkage
+
+
+SHRINKAGE_ESTIMATORS = {'ledoit_wolf': ledoit_wolf,
+                        'oas': oracle_approximating,
+                        'constant_correlation': constant_correlation}
+
+
+if __name__ == '__main__':
+    num_dates, num_assets = 260, 250
+    rets = np.random.randn(num_dates, num_assets) * 0.01 + np.random.randn(num_dates, 1) * 0.005
+
+    print('sample condition number {:.0f}'.format(np.linalg.cond(empirical_covariance(rets)[1])))
+    for name, estimator in SHRINKAGE_ESTIMATORS.items():
+        cov, shrinkage = estimator(rets)
+        print('{} shrinkage {:.3f}, condition number {:.0f}'.format(name, shrinkage, np.linalg.cond(cov)))
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from portfolio_optimization.portfolio_opt import MarkowitzOptimizePortfolio
+
+
+def randomized_svd(X, num_components, oversamples=10, power_iterations=2, seed=None):
+    """
+    Truncated SVD by random projection (Halko, Martinsson & Tropp), O(num_rows * num_cols * num_components)
+
+    Args:
+        X: <np.ndarray> matrix to decompose
+        num_components: <int> number of singular values and vectors to keep
+        oversamples: <int> extra random directions sampled for accuracy
+        power_iterations: <int> subspace iterations, sharpen the decay of the spectrum for noisy matrices
+        seed: <int> seed of the random number generator
+
+    Returns:
+        <np.ndarray> U (num_rows, num_components), <np.ndarray> singular values (num_components,) and
+        <np.ndarray> Vt (num_components, num_cols)
+    """
+    rng = np.random.default_rng(seed)
+    sketch_size = min(num_components + oversamples, min(X.shape))
+
+    Q, _ = np.linalg.qr(X @ rng.standard_normal((X.shape[1], sketch_size)))
+    for _ in range(power_iterations):
+        # re-orthonormalize between products to keep the small singular directions from being lost to rounding
+        Q, _ = np.linalg.qr(X.T @ Q)
+        Q, _ = np.linalg.qr(X @ Q)
+
+    U_small, s, Vt = np.linalg.svd(Q.T @ X, full_matrices=False)
+    return (Q @ U_small)[:, :num_components], s[:num_components], Vt[:num_components]
+
+
+class StatisticalFactorModel:
+    """ Principal component factor model of a returns panel: sigma ~ F sigma_f F.T + D """
+
+    def __init__(self, num_factors=10, method='randomized', oversamples=10, power_iterations=2, seed=None):
+        """
+        The loadings F are the leading principal directions of the demeaned returns, so the factors are uncorrelated
+        with a diagonal covariance.  D holds the variance each asset has left over after the factors, as a sparse
+        diagonal matrix.  Storing F, sigma_f and D takes O(num_assets * num_factors) instead of O(num_assets^2).
+
+        Args:
+            num_factors: <int> number of statistical factors
+            method: <str> 'randomized' for the randomized truncated SVD, or 'exact' for the full SVD
+            oversamples: <int> randomized SVD oversampling
+            power_iterations: <int> randomized SVD power iterations
+            seed: <int> seed of the randomized SVD
+        """
+        self.m = num_factors
+        self.method = method
+        self.oversamples = oversamples
+        self.power_iterations = power_iterations
+        self.seed = seed
+
+        self.F = None  # factor loadings, shape (num_assets, num_factors)
+        self.factor_covariance = None  # shape (num_factors, num_factors)
+        self.D = None  # sparse diagonal idiosyncratic variances
+        self.explained_variance_ratio = None
+        self.columns = None
+
+    def fit(self, df_rets):
+        """
+        Estimate the factor model
+
+        Args:
+            df_rets: <pd.DataFrame> of returns.  Date index with asset names as columns, no NaNs.
+
+        Returns:
+            self
+        """
+        rets = np.asarray(df_rets, dtype=float)
+        self.columns = df_rets.columns if isinstance(df_rets, pd.DataFrame) else None
+        num_dates, num_assets = rets.shape
+        assert not np.isnan(rets).any()
+        assert self.m < min(num_dates, num_assets)
+
+        X = rets - rets.mean(axis=0)
+
+        if self.method == 'randomized':
+            _, s, Vt = randomized_svd(X, self.m, self.oversamples, self.power_iterations, self.seed)
+        elif self.method == 'exact':
+            _, s, Vt = np.linalg.svd(X, full_matrices=False)
+            s, Vt = s[:self.m], Vt[:self.m]
+        else:
+            raise NotImplementedError('{} SVD method has not been implemented'.format(self.method))
+
+        factor_var = s ** 2 / (num_dates - 1)
+        total_var = (X ** 2).sum(axis=0) / (num_dates - 1)
+
+        self.F = Vt.T
+        self.factor_covariance = np.diag(factor_var)
+        # residual variance, floored so the model stays positive definite
+        idio_var = np.maximum(total_var - (self.F ** 2) @ factor_var, total_var.mean() * 1e-6)
+        self.D = sp.diags(idio_var)
+        self.explained_variance_ratio = factor_var / total_var.sum()
+
+        return self
+
+    def covariance(self):
+        """ Dense num_assets x num_assets covariance matrix implied by the model, for small universes and checks """
+        return self.F @ self.factor_covariance @ self.F.T + self.D.toarray()
+
+    def markowitz_kwargs(self):
+        """
+        <dict> of the risk model arguments of MarkowitzOptimizePortfolio in factor covariance mode, i.e.
+        MarkowitzOptimizePortfolio(num_assets, mu, constraints=..., **model.markowitz_kwargs())
+        """
+        return {'sigma': self.factor_covariance,
+                'factor_covariance': True,
+                'F': self.F,
+                'D': self.D,
+                'num_factors': self.m}
+
+
+if __name__ == '__main__':
+    import time
+
+    np.random.seed(1)
+    num_dates, num_assets, num_factors = 750, 2000, 20
+    true_loadings = np.random.randn(num_assets, num_factors)
+    df_rets = pd.DataFrame(np.random.randn(num_dates, num_factors) @ true_loadings.T * 0.002 +
+                           np.random.randn(num_dates, num_assets) * 0.01)
+
+    ts = time.time()
+    model = StatisticalFactorModel(num_factors=num_factors, seed=1).fit(df_rets)
+    print('fit {:.2f} s, explained variance {:.2%}'.format(time.time() - ts, model.explained_variance_ratio.sum()))
+
+    ts = time.time()
+    x = MarkowitzOptimizePortfolio(num_assets=num_assets, mu=df_rets.mean().to_numpy(), gamma=1,
+                                   constraints=['sum_to_one', 'long_only'], **model.markowitz_kwargs())
+    res = x()
+    print('optimization {:.2f} s, status {}'.format(time.time() - ts, res['status']))
@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+import cvxpy as cp
+from concurrent.futures import ProcessPoolExecutor
+import common.constants as const
+from common.returns_panel import ReturnsPanel
+from common.timeit import timeit
+from portfolio_optimization.portfolio_opt import ParametrizedMarkowitzPortfolio, ParametrizedMinRiskPortfolio
+
+MARKOWITZ = 'markowitz'
+MIN_RISK = 'min_risk'
+
+_WORKER_DATA = {}
+
+
+def init_worker(log_rets, window_days, optimizer, optimizer_kwargs):
+    """ Process pool initializer: the returns are sent and the optimization problem is compiled once per worker """
+    _WORKER_DATA['log_rets'] = log_rets
+    _WORKER_DATA['window_days'] = window_days
+    _WORKER_DATA['optimizer_kwargs'] = optimizer_kwargs
+
+    num_assets = log_rets.shape[1]
+    if optimizer == MARKOWITZ:
+        _WORKER_DATA['optimizer'] = ParametrizedMarkowitzPortfolio(
+            num_assets, optimizer_kwargs.pop('constraints', ['sum_to_one', 'long_only']))
+    elif optimizer == MIN_RISK:
+        _WORKER_DATA['optimizer'] = ParametrizedMinRiskPortfolio(num_assets, optimizer_kwargs.pop('lev_limit', 2))
+    else:
+        raise NotImplementedError('{} optimizer has not been implemented'.format(optimizer))
+
+
+def window_moments(rebalance_idx, recompute_every):
+    """
+    Generate the mean vector and covariance matrix of the log returns in the window ending on each rebalance date.
+
+    The window sums and cross products are carried from one rebalance date to the next by adding the returns that
+    entered and removing those that left, O(days between rebalances * num_assets^2) instead of a full window.
+
+    Args:
+        rebalance_idx: <list> of increasing row indices of the rebalance dates
+        recompute_every: <int> number of dates after which the sums are recomputed from scratch to stop drift
+    """
+    rets, w = _WORKER_DATA['log_rets'], _WORKER_DATA['window_days']
+    shift, sums, cross, prev, last_recompute = None, None, None, None, None
+
+    for t in rebalance_idx:
+        if prev is None or t - prev >= w or t - last_recompute >= recompute_every:
+            # shift by the window mean, covariances are unchanged but the running sums lose less precision
+            window_rets = rets[t - w + 1:t + 1]
+            shift = window_rets.mean(axis=0)
+            window_rets = window_rets - shift
+            sums, cross = window_rets.sum(axis=0), window_rets.T @ window_rets
+            last_recompute = t
+        else:
+            enter, leave = rets[prev + 1:t + 1] - shift, rets[prev - w + 1:t - w + 1] - shift
+            sums = sums + enter.sum(axis=0) - leave.sum(axis=0)
+            cross = cross + enter.T @ enter - leave.T @ leave
+        prev = t
+
+        yield sums / w + shift, (cross - np.outer(sums, sums) / w) / (w - 1)
+
+
+def optimize_block(rebalance_idx, recompute_every):
+    """
+    Optimal weights on a block of consecutive rebalance dates, each solve warm started from the previous one
+
+    Returns:
+        <np.ndarray> of weights with shape (num_rebalances, num_assets), <list> of statuses, <float> solve time
+    """
+    optimizer, optimizer_kwargs = _WORKER_DATA['optimizer'], _WORKER_DATA['optimizer_kwargs']
+    weights = np.full((len(rebalance_idx), _WORKER_DATA['log_rets'].shape[1]), np.nan)
+    status_ls, solve_time = [], 0.
+
+    for i, (mu, sigma) in enumerate(window_moments(rebalance_idx, recompute_every)):
+        res = optimizer(mu, sigma, **optimizer_kwargs)
+        status_ls.append(res['status'])
+        solve_time += res['solve_time'] or 0.
+        if res['status'] in [cp.OPTIMAL, cp.OPTIMAL_INACCURATE]:
+            weights[i] = res['w']
+
+    return weights, status_ls, solve_time
+
+
+class WalkForwardBacktest:
+    def __init__(self, window_days=const.NUM_TRADE_DAYS_PER_YR, rebalance_days=const.NUM_TRADE_DAYS_PER_MONTH,
+                 optimizer=MARKOWITZ, optimizer_kwargs=None, transaction_cost=0.001, num_workers=None,
+                 recompute_every=None):
+        """
+        Walk-forward backtest of a portfolio re-optimized on a rolling estimation window.
+
+        On every rebalance date the mean and covariance of the daily log returns over the trailing window are updated
+        incrementally and the parametrized optimizer (compiled once) is re-solved with a warm start.  The weights are
+        set at that day's close, drift with the asset returns until the next rebalance, and each rebalance pays
+        transaction_cost per unit of turnover.  The optimizations only depend on the data, so consecutive blocks of
+        rebalance dates are solved in parallel processes.
+
+        Args:
+            window_days: <int> estimation window in number of days
+            rebalance_days: <int> number of days between rebalances
+            optimizer: <str> 'markowitz' (ParametrizedMarkowitzPortfolio) or 'min_risk' (ParametrizedMinRiskPortfolio)
+            optimizer_kwargs: <dict> of the optimizer arguments, e.g. {'gamma': 1, 'lev_limit': 1,
+            'constraints': ['sum_to_one', 'long_only']} for markowitz or {'min_ret': 0.0005, 'lev_limit': 2} for
+            min_risk, with returns and the covariance in daily units
+            transaction_cost: <float> cost as a fraction of the traded value, charged on sum(|w_new - w_drifted|)
+            num_workers: <int> number of processes.  None or 1 runs in the current process.
+            recompute_every: <int> number of dates after which the window sums are recomputed from scratch.  Defaults
+            to 10 windows.
+        """
+        self.window = window_days
+        self.rebalance_days = rebalance_days
+        self.optimizer = optimizer
+        self.optimizer_kwargs = optimizer_kwargs if optimizer_kwargs else {'gamma': 1}
+        self.transaction_cost = transaction_cost
+        self.num_workers = num_workers
+        self.recompute_every = recompute_every if recompute_every else 10 * window_days
+
+    def optimal_weights(self, log_rets, rebalance_idx):
+        """ Weights, statuses and total solve time on every rebalance date, in blocks across the workers """
+        init_args = (log_rets, self.window, self.optimizer, dict(self.optimizer_kwargs))
+
+        if self.num_workers is None or self.num_workers == 1:
+            init_worker(*init_args)
+            return optimize_block(rebalance_idx, self.recompute_every)
+
+        blocks = [x for x in np.array_split(rebalance_idx, self.num_workers) if len(x)]
+        with ProcessPoolExecutor(max_workers=self.num_workers, initializer=init_worker,
+                                 initargs=init_args) as executor:
+            results = list(executor.map(optimize_block, blocks, [self.recompute_every] * len(blocks)))
+
+        return (np.vstack([x[0] for x in results]), [status for x in results for status in x[1]],
+                sum(x[2] for x in results))
+
+    def portfolio_returns(self, rets, rebalance_idx, weights):
+        """
+        Daily returns of the rebalanced portfolio net of transaction costs
+
+        Args:
+            rets: <np.ndarray> of simple returns with shape (num_dates, num_assets)
+            rebalance_idx: <list> of row indices of the rebalance dates
+            weights: <np.ndarray> target weights per rebalance date.  A failed optimization (NaN row) keeps the
+            drifted weights.
+
+        Returns:
+            <np.ndarray> of gross returns, <np.ndarray> of net returns and <np.ndarray> of turnover per rebalance date
+        """
+        num_dates, num_assets = rets.shape
+        gross, net = np.zeros(num_dates), np.zeros(num_dates)
+        turnover = np.zeros(len(rebalance_idx))
+
+        # daily returns of the buy and hold portfolio between consecutive rebalance dates, one block at a time
+        current = np.zeros(num_assets)
+        bounds = list(rebalance_idx) + [num_dates - 1]
+        for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if not np.isnan(weights[i]).any():
+                turnover[i] = np.abs(weights[i] - current).sum()
+                current = weights[i]
+
+            # value of each position relative to the rebalance date, so the drifted weights need no daily loop
+            growth = np.cumprod(1 + rets[start + 1:end + 1], axis=0)
+            values = growth @ current
+            prev_values = np.concatenate([[current.sum()], values[:-1]])
+            gross[start + 1:end + 1] = np.divide(values - prev_values, prev_values,
+                                                 out=np.zeros_like(values), where=prev_values != 0)
+
+            net[start + 1:end + 1] = gross[start + 1:end + 1]
+            net[start + 1] -= self.transaction_cost * turnover[i]
+
+            if end > start:
+                # weights drifted to the next rebalance date
+                current = current * growth[-1] / (values[-1] / current.sum() if current.sum() != 0 else 1)
+
+        return gross, net, turnover
+
+    @timeit
+    def __call__(self, df_price_data):
+        """
+        Run the backtest
+
+        Args:
+            df_price_data: <pd.DataFrame> of prices or a ReturnsPanel.  Date index with asset names as columns, no
+            missing values.
+
+        Returns:
+            <dict> of:
+                weights: <pd.DataFrame> of target weights per rebalance date
+                gross_returns, portfolio_returns: <pd.Series> of daily portfolio returns before and after costs
+                turnover: <pd.Series> of turnover per rebalance date
+                status: <list> of optimization statuses
+                solve_time: <float> total solver time in seconds
+        """
+        panel = df_price_data if isinstance(df_price_data, ReturnsPanel) else ReturnsPanel.from_prices(df_price_data)
+        df_rets = panel.simple_returns
+        rets = df_rets.to_numpy()
+        log_rets = panel.log_returns.to_numpy()
+        assert not np.isnan(rets).any()
+
+        rebalance_idx = list(range(self.window - 1, len(rets) - 1, self.rebalance_days))
+        if not rebalance_idx:
+            raise Exception('{} dates of returns leave no date to hold a portfolio after the {} day estimation '
+                            'window'.format(len(rets), self.window))
+        weights, status_ls, solve_time = self.optimal_weights(log_rets, rebalance_idx)
+        gross, net, turnover = self.portfolio_returns(rets, rebalance_idx, weights)
+
+        dates = df_rets.index
+        first = rebalance_idx[0] + 1
+        return {'weights': pd.DataFrame(weights, index=dates[rebalance_idx], columns=df_rets.columns),
+                'gross_returns': pd.Series(gross[first:], index=dates[first:]),
+                'portfolio_returns': pd.Series(net[first:], index=dates[first:]),
+                'turnover': pd.Series(turnover, index=dates[rebalance_idx]),
+                'status': status_ls,
+                'solve_time': solve_time}
+
+
+if __name__ == '__main__':
+    np.random.seed(1)
+    num_dates, num_assets = 252 * 11, 500
+    dates = pd.bdate_range('2010-01-01', periods=num_dates)
+    market = np.random.randn(num_dates, 1) * 0.01
+    df_prices = pd.DataFrame(100 * np.exp(np.cumsum(market * np.random.uniform(0.5, 1.5, num_assets) +
+                                                    np.random.randn(num_dates, num_assets) * 0.015 + 0.0003, axis=0)),
+                             index=dates)
+
+    backtest = WalkForwardBacktest(optimizer_kwargs={'gamma': 5, 'constraints': ['sum_to_one', 'long_only']},
+                                   num_workers=4)
+    res = backtest(df_prices)
+    print('{} rebalances, solve time {:.1f} s'.format(len(res['weights']), res['solve_time']))
+    print('annualized net return {:.2%}, mean turnover {:.2f}'.format(
+        res['portfolio_returns'].mean() * const.NUM_TRADE_DAYS_PER_YR, res['turnover'].mean()))
@@ -0,0 +1,158 @@
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
+from black_scholes_merton import BSM_pricing_value
+
+MIN_SIGMA = 1e-4  # vol shocks are floored here so the pricer stays defined
+
+
+def option_value(S, K, r, t, sigma, is_call):
+    """
+    European option value from BSM_pricing_value, puts are taken from put-call parity
+
+    Args:
+        S: <np.ndarray> underlying asset price
+        K: <np.ndarray> strike price
+        r: <np.ndarray> annualized risk-free interest rate
+        t: <np.ndarray> years to maturity
+        sigma: <np.ndarray> standard deviation of asset returns
+        is_call: <np.ndarray> of bools, True for calls and False for puts
+
+    Returns:
+        <np.ndarray> of option values, broadcast over the inputs
+    """
+    call = BSM_pricing_value(S, K, r, t, sigma)
+    return np.where(is_call, call, call - S + K * np.exp(-r * t))
+
+
+def revalue_chunk(positions, underlying_idx, num_underlyings, spot_shocks, vol_shocks, rate_shocks):
+    """
+    Scenario P&L of one chunk of positions, aggregated in total and per underlying
+
+    Positions are broadcast against the grid as (positions, spot, vol, rate) so the whole chunk is priced in one call.
+
+    Args:
+        positions: <dict> of equal length <np.ndarray> with keys S, K, r, t, sigma, quantity, is_call
+        underlying_idx: <np.ndarray> of the integer underlying id per position
+        num_underlyings: <int> total number of underlyings in the book
+        spot_shocks: <np.ndarray> relative spot shocks e.g. -0.1 for a 10% drop
+        vol_shocks: <np.ndarray> absolute vol shocks e.g. 0.05 for +5 vol points
+        rate_shocks: <np.ndarray> absolute rate shocks e.g. 0.01 for +100bps
+
+    Returns:
+        <tuple> of <np.ndarray> P&L summed over the chunk of shape (num_scenarios,) and per underlying of shape
+        (num_underlyings, num_scenarios)
+    """
+    S, K, r, t, sigma = (positions[x][:, None, None, None] for x in ['S', 'K', 'r', 't', 'sigma'])
+    is_call = positions['is_call'][:, None, None, None]
+
+    base_value = option_value(S, K, r, t, sigma, is_call)
+
+    shocked_value = option_value(S * (1 + spot_shocks[None, :, None, None]), K,
+                                 r + rate_shocks[None, None, None, :], t,
+                                 np.maximum(sigma + vol_shocks[None, None, :, None], MIN_SIGMA), is_call)
+
+    pnl = (positions['quantity'][:, None] * (shocked_value - base_value).reshape(len(underlying_idx), -1))
+
+    # one-hot position -> underlying map, a sparse product does the group-by sum
+    indicator = sp.csr_matrix((np.ones(len(underlying_idx)), (underlying_idx, np.arange(len(underlying_idx)))),
+                              shape=(num_underlyings, len(underlying_idx)))
+
+    return pnl.sum(axis=0), indicator @ pnl
+
+
+class OptionScenarioGrid:
+    """ Spot x vol x rate shock grid revaluation of a book of European options """
+
+    def __init__(self, spot_shocks, vol_shocks, rate_shocks, max_chunk_elements=2000000, num_workers=None):
+        """
+        Args:
+            spot_shocks: <np.ndarray> relative spot shocks e.g. np.linspace(-0.2, 0.2, 41)
+            vol_shocks: <np.ndarray> absolute vol shocks e.g. np.linspace(-0.1, 0.1, 21)
+            rate_shocks: <np.ndarray> absolute rate shocks e.g. np.linspace(-0.01, 0.01, 5)
+            max_chunk_elements: <int> upper bound on positions x scenarios priced at once, bounds peak memory
+            num_workers: <int> number of processes to dispatch chunks to.  None or 1 runs in the current process.
+        """
+        self.spot_shocks = np.asarray(spot_shocks, dtype=float)
+        self.vol_shocks = np.asarray(vol_shocks, dtype=float)
+        self.rate_shocks = np.asarray(rate_shocks, dtype=float)
+        self.grid_shape = (len(self.spot_shocks), len(self.vol_shocks), len(self.rate_shocks))
+        self.num_scenarios = int(np.prod(self.grid_shape))
+        self.chunk_size = max(1, max_chunk_elements // self.num_scenarios)
+        self.num_workers = num_workers
+
+    def __call__(self, S, K, r, t, sigma, quantity, underlying, option_type='call'):
+        """
+        Revalue the book under every scenario
+
+        Args:
+            S: <np.ndarray> underlying spot per position
+            K: <np.ndarray> strike per position
+            r: <float> or <np.ndarray> annualized risk-free interest rate per position
+            t: <np.ndarray> years to maturity per position
+            sigma: <float> or <np.ndarray> vol per position, e.g. looked up from a VolatilitySurface
+            quantity: <np.ndarray> signed number of contracts per position
+            underlying: <np.ndarray> underlying name per position, used for the per underlying aggregation
+            option_type: <str> 'call' or 'put', or <np.ndarray> of these per position
+
+        Returns:
+            <dict> containing:
+                scenario_pnl: <np.ndarray> book P&L of shape (spot, vol, rate)
+                underlying_pnl: <np.ndarray> P&L per underlying of shape (num_underlyings, spot, vol, rate)
+                underlyings: <np.ndarray> underlying names in the order of underlying_pnl
+        """
+        underlyings, underlying_idx = np.unique(np.asarray(underlying), return_inverse=True)
+        n = len(underlying_idx)
+
+        option_type = np.broadcast_to(np.asarray(option_type), (n,))
+        if not np.isin(option_type, ['call', 'put']).all():
+            raise NotImplementedError('Only call and put option types are supported')
+
+        positions = {'S': S, 'K': K, 'r': r, 't': t, 'sigma': sigma, 'quantity': quantity}
+        positions = {k: np.broadcast_to(np.asarray(v, dtype=float), (n,)) for k, v in positions.items()}
+        positions['is_call'] = option_type == 'call'
+
+        chunk_args = [({k: v[i:i + self.chunk_size] for k, v in positions.items()},
+                       underlying_idx[i:i + self.chunk_size], len(underlyings),
+                       self.spot_shocks, self.vol_shocks, self.rate_shocks) for i in range(0, n, self.chunk_size)]
+
+        scenario_pnl = np.zeros(self.num_scenarios)
+        underlying_pnl = np.zeros((len(underlyings), self.num_scenarios))
+
+        if self.num_workers is None or self.num_workers == 1:
+            chunk_results = (revalue_chunk(*args) for args in chunk_args)
+            self.aggregate(chunk_results, scenario_pnl, underlying_pnl)
+        else:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                chunk_results = executor.map(revalue_chunk, *zip(*chunk_args))
+                self.aggregate(chunk_results, scenario_pnl, underlying_pnl)
+
+        return {'scenario_pnl': scenario_pnl.reshape(self.grid_shape),
+                'underlying_pnl': underlying_pnl.reshape((len(underlyings),) + self.grid_shape),
+                'underlyings': underlyings}
+
+    @staticmethod
+    def aggregate(chunk_results, scenario_pnl, underlying_pnl):
+        """ Accumulate chunk results in place as they arrive, so only one chunk is held at a time """
+        for chunk_total, chunk_by_underlying in chunk_results:
+            scenario_pnl += chunk_total
+            underlying_pnl += chunk_by_underlying
+
+
+if __name__ == '__main__':
+    num_positions = 20000
+    tickers = np.array(['AAPL', 'NKE', 'GOOGL', 'AMZN'])
+    spots = {'AAPL': 150., 'NKE': 110., 'GOOGL': 2500., 'AMZN': 3300.}
+
+    underlying = tickers[np.random.randint(0, len(tickers), num_positions)]
+    S = np.array([spots[x] for x in underlying])
+
+    grid = OptionScenarioGrid(spot_shocks=np.linspace(-0.2, 0.2, 41), vol_shocks=np.linspace(-0.1, 0.1, 21),
+                              rate_shocks=np.linspace(-0.01, 0.01, 5), num_workers=4)
+    res = grid(S=S, K=S * np.random.uniform(0.8, 1.2, num_positions), r=0.02,
+               t=np.random.uniform(0.1, 2, num_positions), sigma=np.random.uniform(0.15, 0.4, num_positions),
+               quantity=np.random.randint(-10, 10, num_positions), underlying=underlying,
+               option_type=np.where(np.random.rand(num_positions) > 0.5, 'call', 'put'))
+
+    print(res['scenario_pnl'][:, 10, 2])
+    print(dict(zip(res['underlyings'], res['underlying_pnl'][:, 0, 10, 2])))
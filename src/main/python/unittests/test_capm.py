@@ -33,3 +33,51 @@ class CAPMFunctionsTest(unittest.TestCase):
 
         # check that all three ways produce the same result!  Yay!
         self.assertTrue(np.allclose(beta_calc, lin_model.coef_, beta_cp))
+
+
+class CAPMBetaEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        import pandas as pd
+
+        num_dates = 300
+        dates = pd.bdate_range('2020-01-01', periods=num_dates)
+        self.df_benchmarks = pd.DataFrame(np.random.randn(num_dates, 2) * 0.01, index=dates, columns=['MKT', 'SECTOR'])
+        self.df_stock_rets = pd.DataFrame(self.df_benchmarks.to_numpy() @ np.random.randn(2, 7) +
+                                          np.random.randn(num_dates, 7) * 0.01 + 0.0005, index=dates)
+
+    def test_calc_betas(self):
+        """ Vectorized full sample and rolling statistics match a regression per stock, benchmark and window """
+        window = 60
+        res = capm.calc_betas(self.df_stock_rets, self.df_benchmarks, windows=[None, window], max_chunk_elements=1000)
+        self.assertEqual(res[None]['beta'].shape, (2, 7))
+        self.assertEqual(res[window]['beta'].shape, (300, 2, 7))
+        self.assertTrue(np.isnan(res[window]['beta'][:window - 1]).all())
+
+        for rows, t in [(slice(None), None), (slice(240 - window + 1, 241), 240), (slice(300 - window, 300), 299)]:
+            stats = res[None] if t is None else {k: v[t] for k, v in res[window].items()}
+            for b, benchmark in enumerate(self.df_benchmarks.columns):
+                x = self.df_benchmarks[benchmark].to_numpy()[rows]
+                y = self.df_stock_rets.to_numpy()[rows]
+                lin_model = LinearRegression().fit(x[:, None], y)
+                residuals = y - lin_model.predict(x[:, None])
+
+                self.assertTrue(np.allclose(stats['beta'][b], lin_model.coef_.ravel()))
+                self.assertTrue(np.allclose(stats['alpha'][b], lin_model.intercept_))
+                self.assertTrue(np.allclose(stats['residual_vol'][b], residuals.std(axis=0, ddof=1)))
+
+        beta = capm.calc_beta(self.df_stock_rets[[0]], self.df_benchmarks[['MKT']])
+        self.assertAlmostEqual(beta, self.df_stock_rets[0].cov(self.df_benchmarks['MKT']) /
+                               self.df_benchmarks['MKT'].var())
+
+        # missing stock returns are skipped, and the benchmark variance uses its full history
+        df_stock = self.df_stock_rets[[0]].iloc[20:].copy()
+        df_stock.iloc[[5, 50, 100]] = np.nan
+        beta = capm.calc_beta(df_stock, self.df_benchmarks[['MKT']])
+        self.assertAlmostEqual(beta, df_stock[0].cov(self.df_benchmarks['MKT']) / self.df_benchmarks['MKT'].var())
+
+        # a benchmark flat on the dates the stock trades gives a beta of 0
+        df_flat = self.df_benchmarks[['MKT']].copy()
+        df_flat.iloc[20:] = 0.001
+        self.assertEqual(capm.calc_beta(df_stock, df_flat), 0)
@@ -29,3 +29,216 @@ class CommonFunctionsUnittests(unittest.TestCase):
                                                                           val_multiplers, t)
 
         self.assertTrue(np.allclose([50.75295741344933, 49.99663883238616], [without_risk, with_risk]))
+
+    def test_historical_VaR(self):
+        """ Single partition VaR/CVaR matches a full sort, per asset, per portfolio and per rolling window """
+        from common.risk_functions import historical_VaR, rolling_historical_VaR, parametric_VaR, gaussian_VaR
+        import common.constants as const
+        import pandas as pd
+
+        np.random.seed(1)
+        df = pd.DataFrame(np.random.standard_t(4, (500, 3)) * 0.01, columns=['a', 'b', 'c'])
+        weights = pd.DataFrame({'port': [0.5, 0.3, 0.2]}, index=['a', 'b', 'c'])
+
+        res = historical_VaR(df, confidence_levels=[0.95, 0.99])
+        sorted_rets = np.sort(df.to_numpy(), axis=0)
+        self.assertTrue(np.allclose(res[const.VAR].loc[0.95], sorted_rets[24]))
+        self.assertTrue(np.allclose(res[const.CVAR].loc[0.99], sorted_rets[:5].mean(axis=0)))
+
+        port_res = historical_VaR(df, confidence_levels=[0.95], weights=weights)
+        sorted_port = np.sort(df.to_numpy() @ weights.to_numpy(), axis=0)
+        self.assertTrue(np.isclose(port_res[const.VAR].loc[0.95, 'port'], sorted_port[24, 0]))
+
+        rolling = rolling_historical_VaR(df, window_days=100, confidence_levels=[0.95], max_chunk_elements=1000)
+        window = np.sort(df.iloc[200:300].to_numpy(), axis=0)
+        self.assertTrue(np.allclose(rolling[const.VAR].iloc[299], window[4]))
+        self.assertTrue(rolling[const.VAR].iloc[:99].isnull().all().all())
+
+        self.assertTrue(np.allclose(parametric_VaR(df, [0.95])[const.VAR].loc[0.95], gaussian_VaR(df)))
+
+    def test_rolling_maximum_drawdowns(self):
+        """ Block based rolling extrema match the pandas rolling max/min, and drawdown analytics find the episode """
+        from common.risk_functions import rolling_maximum_drawdowns, drawdown_analytics, multi_window_maximum_drawdowns
+        import pandas as pd
+
+        np.random.seed(1)
+        df = pd.DataFrame(np.exp(np.cumsum(np.random.randn(600, 3) * 0.01, axis=0)), columns=['a', 'b', 'c'])
+
+        for window in [1, 21, 252, 1000]:
+            max_peaks = df.rolling(window, min_periods=1).max()
+            expected = ((df - max_peaks) / max_peaks).rolling(window, min_periods=1).min()
+            res, worst = rolling_maximum_drawdowns(df, window)
+            self.assertTrue(np.allclose(res, expected))
+            self.assertTrue(np.allclose(worst, expected.min()))
+
+        prices = pd.DataFrame({'x': [1, 2, 3, 2, 1.5, 2.5, 3, 4], 'y': [4, 3, 2, 1, 1, 1, 1, 1]})
+        res = drawdown_analytics(prices)
+        self.assertEqual([res.loc['max_drawdown', 'x'], res.loc['peak_date', 'x'], res.loc['trough_date', 'x'],
+                          res.loc['recovery_date', 'x']], [-0.5, 2, 4, 6])
+        self.assertEqual([res.loc['drawdown_duration', 'x'], res.loc['recovery_duration', 'x']], [2, 2])
+        self.assertEqual([res.loc['max_drawdown', 'y'], res.loc['peak_date', 'y']], [-0.75, 0])
+        self.assertTrue(pd.isnull(res.loc['recovery_date', 'y']))
+
+        # no drawdown at all, and no prices at all
+        res = drawdown_analytics(pd.DataFrame({'up': [1., 2, 3, 4, 5, 6], 'empty': np.nan}))
+        self.assertEqual([res.loc['max_drawdown', 'up'], res.loc['drawdown_duration', 'up']], [0, 0])
+        self.assertTrue(pd.isnull(res.loc['recovery_date', 'up']) and pd.isnull(res.loc['recovery_duration', 'up']))
+        self.assertTrue(res['empty'].isnull().all())
+
+        multi = multi_window_maximum_drawdowns(df, [21, 252])
+        self.assertTrue(np.allclose(multi[21][0], rolling_maximum_drawdowns(df, 21)[0]))
+
+    def test_streaming_statistics(self):
+        """ Streaming, merged and restored accumulators match the full-history pandas calculations """
+        from common.streaming_statistics import RunningMoments, RunningCovariance, EWMAMoments
+        from common.risk_functions import volatility, semi_deviation
+        import pandas as pd
+
+        np.random.seed(1)
+        df = pd.DataFrame(np.random.randn(400, 3) * 0.01, columns=['a', 'b', 'c'])
+
+        acc = RunningMoments(num_assets=3)
+        for row in df.to_numpy()[:250]:
+            acc.update(row)
+        acc = RunningMoments.from_state(acc.get_state())
+        acc.merge(RunningMoments.from_array(df.iloc[250:]))
+
+        self.assertTrue(np.allclose(acc.volatility, volatility(df)))
+        self.assertTrue(np.allclose(acc.semi_deviation, semi_deviation(df)))
+
+        cov = RunningCovariance(num_assets=3)
+        for row in df.to_numpy()[:100]:
+            cov.update(row)
+        cov.merge(RunningCovariance.from_array(df.iloc[100:]))
+        self.assertTrue(np.allclose(cov.covariance, df.cov()))
+
+        ewma = EWMAMoments(num_assets=3, half_life=30)
+        later = EWMAMoments(num_assets=3, half_life=30)
+        for row in df.to_numpy()[:300]:
+            ewma.update(row)
+        for row in df.to_numpy()[300:]:
+            later.update(row)
+        ewma.merge(later)
+        expected = df.ewm(halflife=30).var(bias=True).iloc[-1]
+        self.assertTrue(np.allclose(ewma.variance, expected))
+
+        # a missing tick is skipped rather than poisoning every later estimate
+        df_gaps = df.copy()
+        df_gaps.iloc[[5, 120], 0] = np.nan
+        df_gaps.iloc[[120, 260], 2] = np.nan
+        cov = RunningCovariance(num_assets=3)
+        ewma = EWMAMoments(num_assets=3, half_life=30)
+        for row in df_gaps.to_numpy()[:200]:
+            cov.update(row)
+            ewma.update(row)
+        cov = RunningCovariance.from_state(cov.get_state())
+        cov.merge(RunningCovariance.from_array(df_gaps.iloc[200:]))
+        later = EWMAMoments(num_assets=3, half_life=30)
+        for row in df_gaps.to_numpy()[200:]:
+            later.update(row)
+        ewma.merge(later)
+        self.assertTrue(np.allclose(cov.covariance, df_gaps.cov()))
+        self.assertTrue(np.allclose(cov.mean, df_gaps.mean()))
+        self.assertTrue(np.allclose(ewma.mean, df_gaps.ewm(halflife=30).mean().iloc[-1]))
+        self.assertTrue(np.allclose(ewma.variance, df_gaps.ewm(halflife=30).var(bias=True).iloc[-1]))
+
+        down = np.minimum(df_gaps, 0) ** 2
+        self.assertTrue(np.allclose(ewma.downside_rms, np.sqrt(down.ewm(halflife=30).mean().iloc[-1])))
+
+    def test_rolling_covariance_engine(self):
+        """ Incremental upper triangle covariances/correlations match pandas on every window, in memory and on disk """
+        from common.rolling_covariance import RollingCovarianceEngine, triu_to_matrix
+        import pandas as pd
+        import tempfile
+        import os
+
+        np.random.seed(1)
+        df = pd.DataFrame(np.random.randn(200, 4) * 0.01 + 0.001, index=pd.bdate_range('2020-01-01', periods=200))
+
+        # small blocks and frequent recomputes exercise both update paths
+        engine = RollingCovarianceEngine(window_days=30, max_chunk_elements=70, recompute_every=45)
+        dates, res = engine(df)
+        self.assertEqual(len(dates), len(res))
+        for i in [0, 7, 100, len(res) - 1]:
+            window = df.loc[:dates[i]].iloc[-30:]
+            self.assertTrue(np.allclose(triu_to_matrix(res[i], 4), window.cov()))
+
+        corr_engine = RollingCovarianceEngine(window_days=30, correlation=True, dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'corr.npy')
+            corr_engine(df, output_path=path)
+            on_disk = np.load(path)
+        self.assertEqual(on_disk.dtype, np.float32)
+        self.assertTrue(np.allclose(triu_to_matrix(on_disk[-1], 4), df.iloc[-30:].corr(), atol=1e-6))
+
+    def test_bootstrap_confidence_intervals(self):
+        """ Point estimates match the risk functions, stationary blocks are consecutive and intervals bracket them """
+        from common.bootstrap import bootstrap_indices, bootstrap_confidence_intervals
+        from common.risk_functions import volatility, gaussian_VaR, maximum_drawdown
+        from common.apm_functions import information_ratio
+        import pandas as pd
+
+        np.random.seed(1)
+        df = pd.DataFrame(np.random.randn(250, 3) * 0.01 + 0.0005)
+
+        idx = bootstrap_indices(250, 50, method='stationary', mean_block_length=20, seed=1)
+        self.assertTrue(idx.min() >= 0 and idx.max() < 250)
+        steps = np.diff(idx, axis=1)
+        self.assertGreater(np.mean((steps == 1) | (steps == -249)), 0.9)
+
+        res = bootstrap_confidence_intervals(df, metrics=['volatility', 'gaussian_VaR', 'maximum_drawdown'],
+                                             num_resamples=500, seed=1, max_chunk_elements=300)
+        self.assertTrue(np.allclose(res['volatility'].loc['estimate'], volatility(df)))
+        self.assertTrue(np.allclose(res['gaussian_VaR'].loc['estimate'], gaussian_VaR(df)))
+        self.assertTrue(np.allclose(res['maximum_drawdown'].loc['estimate'], maximum_drawdown((1 + df).cumprod())))
+        for m in res.values():
+            self.assertTrue((m.loc['lower'] <= m.loc['estimate']).all() and (m.loc['estimate'] <= m.loc['upper']).all())
+
+        # information ratio of the beta adjusted residual return
+        df_bench = pd.DataFrame(np.random.randn(250, 1) * 0.01)
+        df = df + df_bench.to_numpy() * [0.5, 1., 1.5]
+        res = bootstrap_confidence_intervals(df, metrics=['beta', 'information_ratio'], df_benchmark=df_bench,
+                                             num_resamples=200, seed=1)
+        for col in df.columns:
+            beta = df[col].cov(df_bench[0]) / df_bench[0].var()
+            residual = df[col] - beta * df_bench[0]
+            self.assertAlmostEqual(res['beta'].loc['estimate', col], beta)
+            self.assertAlmostEqual(res['information_ratio'].loc['estimate', col],
+                                   information_ratio(residual.mean(), residual.std()))
+
+    def test_returns_panel(self):
+        """ Cached returns and moments match pandas, are invalidated on append, and the analytics accept a panel """
+        from common.returns_panel import ReturnsPanel, LOG
+        from common.risk_functions import volatility, historical_VaR, parametric_VaR, maximum_drawdown
+        from common.common_functions import active_return_and_risk
+        from capm import calc_beta, excess_return_daily
+        import pandas as pd
+
+        np.random.seed(1)
+        dates = pd.bdate_range('2020-01-01', periods=300)
+        df_prices = pd.DataFrame(100 * np.exp(np.cumsum(np.random.randn(300, 3) * 0.01, axis=0)), index=dates,
+                                 columns=['A', 'B', 'C'])
+        df_rets = df_prices.pct_change().iloc[1:]
+
+        panel = ReturnsPanel.from_prices(df_prices.iloc[:250])
+        self.assertIs(panel.cov(), panel.cov())
+        self.assertTrue(np.allclose(panel.cov(LOG), np.log1p(df_rets.iloc[:249]).cov()))
+
+        panel.append(df_prices.iloc[250:])
+        self.assertTrue(np.allclose(panel.simple_returns, df_rets))
+        self.assertTrue(np.allclose(volatility(panel), volatility(df_rets)))
+        self.assertTrue(np.allclose(historical_VaR(panel)['VaR'], historical_VaR(df_rets)['VaR']))
+        weights = pd.DataFrame([[0.5], [0.5]], index=['C', 'A'])
+        self.assertTrue(np.allclose(parametric_VaR(panel, weights=weights)['VaR'],
+                                    parametric_VaR(df_rets, weights=weights)['VaR']))
+        self.assertTrue(np.allclose(maximum_drawdown(panel), maximum_drawdown(df_prices)))
+
+        sub = panel.subset(assets=['B'], start_date=dates[100])
+        self.assertTrue(np.allclose(sub.simple_returns, df_rets.loc[dates[101]:, ['B']]))
+        self.assertTrue(np.shares_memory(panel.subset(start_date=dates[100]).values, panel.values))
+
+        # the callers' frames keep their column names
+        df_a, df_b = df_rets[['A']], df_rets[['B']]
+        active_return_and_risk(df_a, df_b)
+        excess_return_daily(df_a, df_b, calc_beta(df_a, panel.subset(assets=['B'])))
+        self.assertEqual(list(df_a.columns) + list(df_b.columns), ['A', 'B'])
@@ -0,0 +1,149 @@
+import unittest
+import numpy as np
+
+
+class VolatilitySurfaceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.strikes = np.tile([80, 90, 100, 110, 120], 3)
+        self.maturities = np.repeat([0.25, 0.5, 1], 5)
+        self.vols = np.array([0.30, 0.26, 0.23, 0.22, 0.23,
+                              0.28, 0.25, 0.22, 0.21, 0.22,
+                              0.26, 0.24, 0.21, 0.20, 0.21])
+
+    def test_quoted_points(self):
+        """ Lookups on the quoted nodes return the quoted vols and a flat surface stays flat everywhere """
+        from volatility_surface import VolatilitySurface
+
+        surface = VolatilitySurface(self.strikes, self.maturities, self.vols)
+        self.assertTrue(np.allclose(surface(self.strikes, self.maturities), self.vols))
+
+        flat = VolatilitySurface(self.strikes, self.maturities, np.full(len(self.strikes), 0.2))
+        K, t = np.random.uniform(50, 150, 1000), np.random.uniform(0.05, 3, 1000)
+        self.assertTrue(np.allclose(flat(K, t), 0.2))
+
+    def test_calendar_arbitrage_and_update(self):
+        """ Total variance never decreases with maturity, and an incremental slice update matches a full rebuild """
+        from volatility_surface import VolatilitySurface
+
+        surface = VolatilitySurface(self.strikes, self.maturities, self.vols)
+        new_vols = np.array([0.12, 0.11, 0.10, 0.10, 0.11])
+        surface.update_slice(0.5, self.strikes[:5], new_vols)
+
+        vols = self.vols.copy()
+        vols[5:10] = new_vols
+        rebuilt = VolatilitySurface(self.strikes, self.maturities, vols)
+
+        self.assertTrue((np.diff(surface.total_var, axis=0) >= 0).all())
+        self.assertTrue(np.allclose(surface.total_var, rebuilt.total_var))
+
+        K, t = np.random.uniform(75, 125, 1000), np.random.uniform(0.1, 1.5, 1000)
+        self.assertTrue(np.allclose(surface(K, t), rebuilt(K, t)))
+
+    def test_update_slice_drops_old_strikes(self):
+        """ Replacing a slice quoted on a strike no other slice quotes matches a rebuild without that strike """
+        from volatility_surface import VolatilitySurface
+
+        strikes = np.concatenate([self.strikes, [95]])
+        maturities = np.concatenate([self.maturities, [0.5]])
+        vols = np.concatenate([self.vols, [0.35]])
+        surface = VolatilitySurface(strikes, maturities, vols)
+        surface.update_slice(0.5, [80, 100, 120], [0.28, 0.22, 0.22])
+
+        keep = (self.maturities != 0.5) | np.isin(self.strikes, [80, 100, 120])
+        rebuilt = VolatilitySurface(self.strikes[keep], self.maturities[keep], self.vols[keep])
+
+        self.assertTrue(np.array_equal(surface.strike_grid, rebuilt.strike_grid))
+        K, t = np.random.uniform(75, 125, 1000), np.random.uniform(0.1, 1.5, 1000)
+        self.assertTrue(np.allclose(surface(K, t), rebuilt(K, t)))
+
+
+class OptionScenarioGridTest(unittest.TestCase):
+
+    def test_matches_loop_revaluation(self):
+        """ Chunked grid revaluation matches pricing every position and scenario one at a time """
+        from scenario_analysis import OptionScenarioGrid, option_value
+
+        np.random.seed(1)
+        n = 25
+        S = np.random.uniform(50, 150, n)
+        K = S * np.random.uniform(0.8, 1.2, n)
+        t = np.random.uniform(0.1, 2, n)
+        sigma = np.random.uniform(0.15, 0.4, n)
+        qty = np.random.randint(-5, 5, n)
+        underlying = np.random.choice(['A', 'B', 'C'], n)
+        option_type = np.random.choice(['call', 'put'], n)
+        spot_shocks, vol_shocks, rate_shocks = np.linspace(-0.2, 0.2, 5), np.linspace(-0.1, 0.1, 3), [-0.01, 0.01]
+
+        # chunk size of 4 positions forces several chunks
+        grid = OptionScenarioGrid(spot_shocks, vol_shocks, rate_shocks, max_chunk_elements=4 * 30)
+        res = grid(S, K, 0.02, t, sigma, qty, underlying, option_type)
+
+        expected = np.zeros((3, 5, 3, 2))
+        for p in range(n):
+            base = option_value(S[p], K[p], 0.02, t[p], sigma[p], option_type[p] == 'call')
+            for i, ds in enumerate(spot_shocks):
+                for j, dv in enumerate(vol_shocks):
+                    for k, dr in enumerate(rate_shocks):
+                        value = option_value(S[p] * (1 + ds), K[p], 0.02 + dr, t[p], sigma[p] + dv,
+                                             option_type[p] == 'call')
+                        expected[list(res['underlyings']).index(underlying[p]), i, j, k] += qty[p] * (value - base)
+
+        self.assertTrue(np.allclose(res['underlying_pnl'], expected))
+        self.assertTrue(np.allclose(res['scenario_pnl'], expected.sum(axis=0)))
+
+
+class LongstaffSchwartzTest(unittest.TestCase):
+
+    def test_american_put(self):
+        """ American put from the Longstaff-Schwartz paper, finite difference reference value of 4.478 """
+        from american_monte_carlo import LongstaffSchwartzPricing
+
+        x = LongstaffSchwartzPricing(S_0=36, strike_price=40, short_rate=0.06, vol=0.2, maturity=1, exercise_dates=50,
+                                     iter_num=100000, option_type='put', chunk_size=30000, seed=1)
+        self.assertTrue(np.isclose(x.compute_pricing(), 4.478, atol=0.05))
+        self.assertTrue(np.isclose(x.price_out_of_sample(100000, seed=2), 4.478, atol=0.1))
+
+    def test_single_exercise_date_is_european(self):
+        """ With one exercise date the Bermudan price reduces to the European BSM price """
+        from american_monte_carlo import LongstaffSchwartzPricing
+        from black_scholes_merton import BSM_pricing_value
+
+        x = LongstaffSchwartzPricing(S_0=100, strike_price=110, short_rate=0.05, vol=0.25, maturity=1,
+                                     exercise_dates=1, iter_num=200000, option_type='call', seed=1)
+        self.assertTrue(np.isclose(x.compute_pricing(), BSM_pricing_value(100, 110, 0.05, 1, 0.25), rtol=0.02))
+
+
+class CorrelatedGBMSimulatorTest(unittest.TestCase):
+
+    def test_single_asset_matches_bsm(self):
+        """ A one asset basket call under the risk-neutral drift reproduces the BSM price """
+        from multi_asset_monte_carlo import CorrelatedGBMSimulator, basket_payoff
+        from black_scholes_merton import BSM_pricing_value
+
+        x = CorrelatedGBMSimulator([100], [0], np.array([[0.25 ** 2]]), horizon=1, seed=1).set_risk_neutral_drift(0.05)
+        res = x.price(basket_payoff(np.ones(1), 110), 400000, discount_factor=np.exp(-0.05))
+        self.assertTrue(np.isclose(res['price'], BSM_pricing_value(100, 110, 0.05, 1, 0.25), atol=3 * res['std_error']))
+
+    def test_factor_form_and_psd_repair(self):
+        """ Factor form and a rank deficient covariance both reproduce the target covariance of log returns """
+        from multi_asset_monte_carlo import CorrelatedGBMSimulator
+        from common.math_functions import covariance_factor
+        import scipy.sparse as sp
+
+        np.random.seed(1)
+        n, k = 20, 3
+        F = np.random.randn(n, k) * 0.1
+        factor_cov = np.diag([0.04, 0.02, 0.01])
+        D = np.random.uniform(0.01, 0.02, n)
+        full_cov = F @ factor_cov @ F.T + np.diag(D)
+
+        x = CorrelatedGBMSimulator(np.ones(n), np.zeros(n), factor_cov, F=F, D=sp.diags(D), factor_covariance=True,
+                                   seed=1, chunk_size=50000)
+        log_rets = np.log(np.vstack([terminal for terminal, _ in x.simulate_chunks(200000)]))
+        self.assertTrue(np.allclose(np.cov(log_rets.T), full_cov, atol=2e-3))
+
+        # rank deficient covariance from fewer observations than assets
+        rank_deficient = np.cov(np.random.randn(n, 10))
+        L = covariance_factor(rank_deficient)
+        self.assertTrue(np.allclose(L @ L.T, rank_deficient))
@@ -76,3 +76,446 @@ class PortfolioOptTest(unittest.TestCase):
                                      0.03234207, 0.07263502, -0.12036399, 0.01905779, 0.08672913,
                                      0.04191737, -0.17216785, -0.04667414, 0.14450931, 0.13509516,
                                      0.14385637, 0.03316754, 0.07468672, 0.10282204, -0.00737077]))
+
+    def test_ewma_covariance(self):
+        """ Daily incremental EWMA updates match a full refit and pandas, and plug into the optimizer as sigma """
+        from portfolio_optimization.ewma_covariance import EWMACovariance
+        import pandas as pd
+
+        df = pd.DataFrame(np.random.randn(300, self.n) * 0.01 + 0.001)
+
+        ewma = EWMACovariance(half_lives=[10, 30], demean=True).fit(df.iloc[:-5])
+        for i in range(5, 0, -1):
+            ewma.update(df.iloc[-i])
+
+        refit = EWMACovariance(half_lives=[10, 30], demean=True).fit(df)
+        self.assertTrue(np.allclose(ewma.cov, refit.cov))
+        self.assertTrue(np.allclose(ewma.covariance(30),
+                                    df.ewm(halflife=30, adjust=False).cov(bias=True).iloc[-self.n:]))
+
+        x = MarkowitzOptimizePortfolio(num_assets=self.n, mu=self.mu, sigma=ewma.covariance(10), gamma=1,
+                                       constraints=['sum_to_one', 'long_only'])
+        self.assertEqual(x()['status'], cp.OPTIMAL)
+
+    def test_risk_contributions(self):
+        """ Contributions add up to the portfolio risk, and the factor form matches the equivalent dense covariance """
+        from portfolio_optimization.risk_decomposition import risk_contributions, VaR_contributions
+        from scipy.stats import norm
+
+        W = np.random.dirichlet(np.ones(self.n), size=5).T
+        res = risk_contributions(W, self.sigma)
+        self.assertTrue(np.allclose(res['volatility'], np.sqrt(np.diag(W.T @ self.sigma @ W))))
+        self.assertTrue(np.allclose(res['component'].sum(axis=0), res['volatility']))
+        self.assertTrue(np.allclose(res['percent'].sum(axis=0), 1))
+
+        var_res = VaR_contributions(W, self.mu, self.sigma, confidence_level=0.95)
+        self.assertTrue(np.allclose(var_res['VaR'], W.T @ self.mu.ravel() + norm.ppf(0.05) * res['volatility']))
+
+        F = np.random.randn(self.n, 3)
+        factor_sigma = np.diag([0.3, 0.2, 0.1])
+        D = sp.diags(np.random.uniform(0.1, 0.2, self.n))
+        factor_res = risk_contributions(W, factor_sigma, factor_covariance=True, F=F, D=D)
+        dense_res = risk_contributions(W, F @ factor_sigma @ F.T + D.toarray())
+        self.assertTrue(np.allclose(factor_res['component'], dense_res['component']))
+
+    def test_adaptive_risk_curve(self):
+        """ An adaptive parallel sweep traces the same frontier as a dense uniform grid with far fewer solves """
+        from portfolio_optimization.plot_risk_curve import RiskCurve, VAR_DATA, RET_DATA, GAMMA_DATA, OPT_STATUS_DATA
+
+        sigma = self.sigma / 100
+        uniform = RiskCurve(num_samples=1000, num_assets=self.n, mu=self.mu, sigma=sigma,
+                            constraints=['sum_to_one', 'long_only'])
+        dense = uniform.compute_risk_curve_values(*uniform.setup_problem())
+
+        adaptive = RiskCurve(num_samples=200, adaptive=True, num_workers=2, num_assets=self.n, mu=self.mu, sigma=sigma,
+                             constraints=['sum_to_one', 'long_only'])
+        res = adaptive.compute_risk_curve_values(*adaptive.setup_problem())
+
+        self.assertLessEqual(len(res[GAMMA_DATA]), 200)
+        self.assertTrue(np.all(np.diff(res[GAMMA_DATA]) > 0))
+        self.assertTrue(all(x == cp.OPTIMAL for x in res[OPT_STATUS_DATA]))
+
+        # returns fall as variance falls with increasing gamma, interpolate the adaptive curve at the dense points
+        interp_ret = np.interp(dense[VAR_DATA], res[VAR_DATA][::-1], res[RET_DATA][::-1])
+        self.assertLess(np.max(np.abs(interp_ret - dense[RET_DATA])), 0.01 * np.ptp(dense[RET_DATA]))
+
+    def test_critical_line(self):
+        """ The critical line frontier matches the solver at any gamma, and the target return/risk queries """
+        from portfolio_optimization.critical_line import CriticalLineAlgorithm
+        from portfolio_optimization.plot_risk_curve import RiskCurve, VAR_DATA, RET_DATA
+
+        sigma = self.sigma / self.n
+        cla = CriticalLineAlgorithm(self.mu, sigma)
+        turning_points = cla()
+        self.assertTrue(np.allclose(cla.weights.sum(axis=1), 1) and (cla.weights >= 0).all())
+        self.assertTrue(np.all(np.diff(turning_points['portfolio_ret']) <= 1e-12))
+
+        gammas = [0.01, 0.3, 1, 5, 100]
+        w_cla = cla.weights_at_gamma(gammas)
+        for gamma, w in zip(gammas, w_cla):
+            res = MarkowitzOptimizePortfolio(num_assets=self.n, mu=self.mu, sigma=sigma, gamma=gamma,
+                                             constraints=['sum_to_one', 'long_only'])()
+            self.assertTrue(np.allclose(res['w'], w, atol=1e-5))
+
+        target_ret = np.linspace(turning_points['portfolio_ret'][-1], turning_points['portfolio_ret'][0], 5)
+        w_ret = cla.weights_at_return(target_ret)
+        self.assertTrue(np.allclose(w_ret @ self.mu.ravel(), target_ret))
+        for target, w in zip(target_ret, w_ret):
+            x = cp.Variable(self.n)
+            problem = cp.Problem(cp.Minimize(cp.quad_form(x, sigma)),
+                                 [cp.sum(x) == 1, x >= 0, self.mu.ravel() @ x >= target])
+            problem.solve()
+            self.assertLessEqual(w @ sigma @ w, problem.value + 1e-8)
+
+        target_vol = np.sqrt(turning_points['portfolio_variance'][[-1, 0]].mean())
+        w_vol = cla.weights_at_volatility(target_vol)[0]
+        self.assertAlmostEqual(np.sqrt(w_vol @ sigma @ w_vol), target_vol)
+
+        curve = RiskCurve(num_samples=50, critical_line=True, num_assets=self.n, mu=self.mu, sigma=sigma,
+                          constraints=['sum_to_one', 'long_only'])
+        exact = curve.compute_risk_curve_values(*curve.setup_problem())
+        ret, variance = cla.frontier(10 ** np.linspace(-2, 2, 50))
+        self.assertTrue(np.allclose(exact[RET_DATA], ret) and np.allclose(exact[VAR_DATA], variance))
+
+    def test_parametrized_markowitz(self):
+        """ Re-solving the compiled problem for new inputs matches building a new MarkowitzOptimizePortfolio """
+        from portfolio_optimization.portfolio_opt import ParametrizedMarkowitzPortfolio
+
+        opt = ParametrizedMarkowitzPortfolio(num_assets=self.n, constraints=['sum_to_one', 'long_only'])
+        for gamma, mu in [(0.5, self.mu), (2, self.mu[::-1]), (10, self.mu * 2)]:
+            res = opt(mu, self.sigma, gamma)
+            expected = MarkowitzOptimizePortfolio(num_assets=self.n, mu=mu, sigma=self.sigma, gamma=gamma,
+                                                  constraints=['sum_to_one', 'long_only'])()
+            self.assertEqual(res['status'], cp.OPTIMAL)
+            self.assertTrue(np.allclose(res['w'], expected['w'], atol=1e-4))
+            self.assertTrue(np.allclose(res['portfolio_variance'], expected['portfolio_variance'], rtol=1e-3))
+        self.assertEqual(opt.num_solves, 3)
+        self.assertGreater(res['compile_time'], 0)
+        self.assertGreater(res['parameter_time'], 0)
+        self.assertGreater(res['solve_time'], 0)
+
+        m = 3
+        F = np.random.randn(self.n, m)
+        D = sp.diags(np.random.uniform(0, 0.9, size=self.n))
+        factor_opt = ParametrizedMarkowitzPortfolio(num_assets=self.n, constraints=['sum_to_one', 'leverage_limit'],
+                                                    factor_covariance=True, num_factors=m)
+        res = factor_opt(self.mu, np.eye(m), 1, lev_limit=2, F=F, D=D)
+        expected = MarkowitzOptimizePortfolio(num_assets=self.n, mu=self.mu, sigma=np.eye(m), gamma=1, lev_limit=2,
+                                              constraints=['sum_to_one', 'leverage_limit'], factor_covariance=True,
+                                              F=F, D=D, num_factors=m)()
+        self.assertTrue(np.allclose(res['portfolio_variance'], expected['portfolio_variance'], rtol=1e-3))
+
+    def test_statistical_factor_model(self):
+        """ Randomized PCA matches the exact one and the model keeps each asset's sample variance """
+        from portfolio_optimization.statistical_factor_model import StatisticalFactorModel
+        import pandas as pd
+
+        loadings = np.random.randn(200, 3)
+        df_rets = pd.DataFrame(np.random.randn(300, 3) @ loadings.T * 0.01 + np.random.randn(300, 200) * 0.005)
+
+        exact = StatisticalFactorModel(num_factors=3, method='exact').fit(df_rets)
+        model = StatisticalFactorModel(num_factors=3, seed=1).fit(df_rets)
+
+        self.assertTrue(np.allclose(np.diag(model.factor_covariance), np.diag(exact.factor_covariance)))
+        self.assertTrue(np.allclose(np.abs(model.F.T @ exact.F), np.eye(3), atol=1e-6))
+        self.assertTrue(np.allclose(np.diag(model.covariance()), df_rets.var()))
+        self.assertGreater(model.explained_variance_ratio.sum(), 0.5)
+
+        x = MarkowitzOptimizePortfolio(num_assets=200, mu=df_rets.mean().to_numpy(), gamma=1,
+                                       constraints=['sum_to_one', 'long_only'], **model.markowitz_kwargs())
+        self.assertEqual(x()['status'], cp.OPTIMAL)
+
+    def test_shrinkage_estimators(self):
+        """ Shrunk covariances are convex combinations of sample and target, better conditioned when N is close to T """
+        from portfolio_optimization.shrinkage_estimators import SHRINKAGE_ESTIMATORS, empirical_covariance
+
+        rets = np.random.randn(60, 50) * 0.01 + np.random.randn(60, 1) * 0.005
+        _, sample = empirical_covariance(rets)
+        self.assertTrue(np.allclose(sample, np.cov(rets.T, ddof=0)))
+
+        for name, estimator in SHRINKAGE_ESTIMATORS.items():
+            cov, shrinkage = estimator(rets)
+            self.assertTrue(0 <= shrinkage <= 1, name)
+            self.assertTrue(np.allclose(cov, cov.T), name)
+            self.assertTrue(np.allclose(np.diag(cov).sum(), np.trace(sample)), name)
+            self.assertLess(np.linalg.cond(cov), np.linalg.cond(sample), name)
+
+        # the constant correlation target keeps each sample variance
+        cov, _ = SHRINKAGE_ESTIMATORS['constant_correlation'](rets)
+        self.assertTrue(np.allclose(np.diag(cov), np.diag(sample)))
+
+    def test_walk_forward_backtest(self):
+        """ Incremental window moments, drifting weights and costs match a direct day by day calculation """
+        from portfolio_optimization.walk_forward import WalkForwardBacktest
+        import pandas as pd
+
+        num_dates, n = 160, 5
+        df_prices = pd.DataFrame(100 * np.exp(np.cumsum(np.random.randn(num_dates, n) * 0.01 + 0.0005, axis=0)),
+                                 index=pd.bdate_range('2020-01-01', periods=num_dates))
+        kwargs = {'gamma': 50, 'constraints': ['sum_to_one', 'long_only']}
+        backtest = WalkForwardBacktest(window_days=60, rebalance_days=20, optimizer_kwargs=kwargs,
+                                       transaction_cost=0.001, recompute_every=70)
+        res = backtest(df_prices)
+
+        log_rets = np.log1p(df_prices.pct_change().iloc[1:])
+        for date, w in res['weights'].iterrows():
+            window = log_rets.loc[:date].iloc[-60:]
+            expected = MarkowitzOptimizePortfolio(num_assets=n, mu=window.mean().to_numpy(),
+                                                  sigma=window.cov().to_numpy(), **kwargs)()
+            self.assertTrue(np.allclose(w, expected['w'], atol=1e-4))
+
+        # day by day drift of the holdings
+        rets = df_prices.pct_change().iloc[1:]
+        current, net = np.zeros(n), []
+        for date, r in rets.loc[res['weights'].index[0]:].iloc[1:].iterrows():
+            prev = rets.index[rets.index.get_loc(date) - 1]
+            cost = 0
+            if prev in res['weights'].index:
+                cost = 0.001 * np.abs(res['weights'].loc[prev].to_numpy() - current).sum()
+                current = res['weights'].loc[prev].to_numpy()
+            port_ret = current @ r.to_numpy()
+            net.append(port_ret - cost)
+            current = current * (1 + r.to_numpy()) / (1 + port_ret)
+        self.assertTrue(np.allclose(res['portfolio_returns'], net))
+
+        parallel = WalkForwardBacktest(window_days=60, rebalance_days=20, optimizer_kwargs=kwargs, num_workers=2,
+                                       recompute_every=70)(df_prices)
+        self.assertTrue(np.allclose(parallel['weights'], res['weights'], atol=1e-6))
+
+        min_risk = WalkForwardBacktest(window_days=60, rebalance_days=20, optimizer='min_risk',
+                                       optimizer_kwargs={'min_ret': 0.0})(df_prices)
+        self.assertTrue(np.allclose(min_risk['weights'].sum(axis=1), 1, atol=1e-4))
+
+        # 60 dates of returns are all used by the first window, nothing is left to hold
+        with self.assertRaisesRegex(Exception, 'no date to hold a portfolio'):
+            backtest(df_prices.iloc[:61])
+
+    def test_worst_case_risk_box(self):
+        """ The closed form matches the SDP when flagged exact, and bounds it from above otherwise """
+        from portfolio_optimization.portfolio_opt import WorstCaseRiskPortfolio, worst_case_risk_box
+
+        n = 5
+        A = np.random.randn(n, n)
+        W = np.column_stack([np.full(n, 1 / n), [0.5, -0.2, 0.3, 0.6, -0.2]])
+
+        for sigma in [A @ A.T + np.eye(n), A @ A.T / 10]:
+            res = worst_case_risk_box(W, sigma, delta_limit=0.2)
+            self.assertTrue(np.allclose(res['actual_std'], np.sqrt(np.diag(W.T @ sigma @ W))))
+
+            for j in range(W.shape[1]):
+                sdp = WorstCaseRiskPortfolio(num_assets=n, sigma=sigma, w=W[:, j]).run_opt()
+                if res['exact'][j]:
+                    self.assertAlmostEqual(res['worst_case_std'][j], sdp['worst_case_std'], places=4)
+                else:
+                    self.assertGreaterEqual(res['worst_case_std'][j], sdp['worst_case_std'] - 1e-6)
+
+        self.assertTrue(worst_case_risk_box(W, A @ A.T + np.eye(n))['exact'].all())
+
+        single = WorstCaseRiskPortfolio(num_assets=n, sigma=A @ A.T + np.eye(n), w=W[:, 0], method='box').run_opt()
+        self.assertEqual(np.ndim(single['worst_case_std']), 0)
+
+    def test_black_litterman(self):
+        """ The Cholesky posterior matches the textbook inverse formulas, batched and unbatched """
+        from portfolio_optimization.black_litterman import BlackLittermanModel
+
+        n, tau, delta = 10, 0.05, 2.5
+        w_mkt = np.full(n, 1 / n)
+        model = BlackLittermanModel(self.sigma, w_mkt, risk_adversion=delta, tau=tau)
+        pi = delta * self.sigma @ w_mkt.reshape(n, 1)
+        self.assertTrue(np.allclose(model.equilibrium_returns, pi))
+
+        P = np.zeros((2, n))
+        P[0, 0], P[0, 1], P[1, 2] = 1, -1, 1
+        Q = np.array([[0.02], [0.05]])
+        omega = np.diag([0.001, 0.002])
+
+        res = model.posterior(P, Q, omega)
+        tau_sigma_inv = np.linalg.inv(tau * self.sigma)
+        post_cov = np.linalg.inv(tau_sigma_inv + P.T @ np.linalg.inv(omega) @ P)
+        mu_bl = post_cov @ (tau_sigma_inv @ pi + P.T @ np.linalg.inv(omega) @ Q)
+        self.assertEqual(res['expected_returns'].shape, (n, 1))
+        self.assertTrue(np.allclose(res['expected_returns'], mu_bl))
+        self.assertTrue(np.allclose(res['covariance_matrix'], self.sigma + post_cov))
+
+        # several view returns in one solve, and a list of view sets, give the same posteriors
+        Q2 = np.array([0.0, 0.01])
+        batch = model.posterior(P, np.column_stack([Q.ravel(), Q2]), omega)
+        listed = model.batch_posterior([(P, Q, omega), (P, Q2, omega)])
+        self.assertTrue(np.allclose(batch['expected_returns'][:, [0]], listed[0]['expected_returns']))
+        self.assertTrue(np.allclose(batch['expected_returns'][:, [1]], listed[1]['expected_returns']))
+
+        # views that agree with the equilibrium leave the mean unchanged
+        self.assertTrue(np.allclose(model.posterior(P, P @ pi)['expected_returns'], pi))
+
+        x = MarkowitzOptimizePortfolio(num_assets=n, mu=res['expected_returns'], sigma=res['covariance_matrix'],
+                                       gamma=delta, constraints=['sum_to_one', 'long_only'])
+        self.assertEqual(x()['status'], cp.OPTIMAL)
+
+    def test_risk_parity(self):
+        """ ERC equalizes (or budgets) the risk contributions, and HRP splits weight within correlated clusters """
+        from portfolio_optimization.risk_parity import hierarchical_risk_parity, equal_risk_contribution
+        from portfolio_optimization.risk_decomposition import risk_contributions
+
+        erc = equal_risk_contribution(self.sigma)
+        self.assertEqual(erc['status'], 'optimal')
+        self.assertTrue(np.allclose(risk_contributions(erc['w'], self.sigma)['percent'], 1 / self.n))
+
+        budget = np.arange(1, self.n + 1)
+        budgeted = equal_risk_contribution(self.sigma, risk_budget=budget)
+        self.assertTrue(np.allclose(risk_contributions(budgeted['w'], self.sigma)['percent'].ravel(),
+                                    budget / budget.sum()))
+
+        # very unequal budgets on a correlated covariance, where full newton steps leave the positive orthant
+        rng = np.random.default_rng(0)
+        loadings = rng.standard_normal((30, 3))
+        sigma = loadings @ loadings.T * 1e-4 + np.diag(rng.uniform(1e-5, 4e-4, 30))
+        budget = rng.dirichlet(np.full(30, 0.5))
+        self.assertLess(budget.min(), 1e-3)
+        budgeted = equal_risk_contribution(sigma, risk_budget=budget)
+        self.assertEqual(budgeted['status'], 'optimal')
+        self.assertTrue((budgeted['w'] > 0).all())
+        self.assertTrue(np.allclose(risk_contributions(budgeted['w'], sigma)['percent'].ravel(), budget))
+
+        # two uncorrelated blocks of two correlated assets
+        block = np.array([[1., 0.9], [0.9, 1.]])
+        sigma = np.block([[block * 0.04, np.zeros((2, 2))], [np.zeros((2, 2)), block * 0.01]])
+        hrp = hierarchical_risk_parity(sigma)
+        self.assertAlmostEqual(hrp['w'].sum(), 1)
+        self.assertEqual({frozenset(hrp['order'][:2]), frozenset(hrp['order'][2:])},
+                         {frozenset([0, 1]), frozenset([2, 3])})
+        # inverse variance split between the blocks, equal split within them
+        self.assertTrue(np.allclose(hrp['w'], [0.1, 0.1, 0.4, 0.4]))
+
+    def test_batch_markowitz(self):
+        """ Batched solves, in process and across workers, match one optimizer per problem, in the order of specs """
+        from portfolio_optimization.batch_opt import BatchMarkowitzOptimizer
+        from portfolio_optimization.portfolio_opt import ParametrizedMarkowitzPortfolio
+
+        structures = [['sum_to_one', 'long_only'], ['leverage_limit', 'sum_to_one'], ['sum_to_one', 'leverage_limit']]
+        specs = [{'constraints': structures[i % 3], 'gamma': 1 + i, 'lev_limit': 1 + i / 4} for i in range(9)]
+
+        for num_workers in [None, 2]:
+            res = BatchMarkowitzOptimizer(self.mu, self.sigma, num_workers=num_workers)(specs)
+            self.assertEqual(res['num_structures'], 2)
+            self.assertEqual(res['w'].shape, (9, self.n))
+
+            for i, spec in enumerate(specs):
+                single = ParametrizedMarkowitzPortfolio(self.n, spec['constraints'])(
+                    self.mu, self.sigma, spec['gamma'], spec['lev_limit'])
+                self.assertEqual(res['status'][i], single['status'])
+                self.assertTrue(np.allclose(res['w'][i], single['w'], atol=1e-3))
+
+        # invalid specs are reported without stopping the rest of the batch
+        bad_specs = [{'constraints': ['long_only', 'leverage_limit'], 'gamma': 1},
+                     {'constraints': ['sum_to_one', 'leverage_limit'], 'gamma': 1, 'lev_limit': 0.5},
+                     {'constraints': ['sum_to_one', 'long_only'], 'gamma': -1},
+                     {'constraints': ['sector_limit'], 'gamma': 1}]
+        res = BatchMarkowitzOptimizer(self.mu, self.sigma)(specs[:3] + bad_specs)
+        self.assertEqual(res['status'][3:], ['invalid_spec'] * 4)
+        self.assertTrue(np.isnan(res['w'][3:]).all())
+        for i in range(3):
+            self.assertEqual(res['status'][i], cp.OPTIMAL)
+
+    def test_simplex_qp(self):
+        """ The native long only solver matches cvxpy, and other constraints fall back to cvxpy """
+        from portfolio_optimization.simplex_qp import SimplexMarkowitzSolver, solve_markowitz, project_simplex, get_solver
+
+        w = project_simplex(np.array([0.5, 1.2, -1., 0.9]))
+        self.assertTrue(np.allclose(w, [0., 0.65, 0., 0.35]))
+
+        # same result as test_long_only
+        res = solve_markowitz(self.n, self.mu, self.sigma, constraints=['sum_to_one', 'long_only'])
+        self.assertEqual(res['status'], cp.OPTIMAL)
+        self.assertTrue(np.allclose(res['portfolio_ret'], [2.3015387]))
+        self.assertTrue(np.allclose(res['portfolio_variance'], 6.571138993238623))
+
+        # same keys and shapes as MarkowitzOptimizePortfolio, and the solver of sigma is reused
+        expected = MarkowitzOptimizePortfolio(num_assets=self.n, mu=self.mu, sigma=self.sigma, gamma=1,
+                                              constraints=['sum_to_one', 'long_only'])()
+        res = solve_markowitz(self.n, self.mu, self.sigma, constraints=['sum_to_one', 'long_only'], gamma=1)
+        self.assertEqual(set(res), set(expected))
+        self.assertEqual(np.shape(res['portfolio_ret']), np.shape(expected['portfolio_ret']))
+        self.assertTrue(np.allclose(res['w'], expected['w'], atol=1e-4))
+        self.assertIs(get_solver(self.sigma), get_solver(self.sigma.copy()))
+
+        solver = SimplexMarkowitzSolver(self.sigma)
+        for gamma in [0.01, 0.1, 1, 10, 100]:
+            res = solver(self.mu, gamma)
+            w = cp.Variable(self.n)
+            problem = cp.Problem(cp.Maximize(self.mu.ravel() @ w - gamma * cp.quad_form(w, self.sigma)),
+                                 [cp.sum(w) == 1, w >= 0])
+            problem.solve(solver=cp.CLARABEL)
+            self.assertEqual(res['status'], cp.OPTIMAL)
+            self.assertTrue(np.allclose(res['w'], w.value, atol=1e-5))
+            self.assertAlmostEqual(res['portfolio_ret'] - gamma * res['portfolio_variance'], problem.value, places=6)
+
+        res = solve_markowitz(self.n, self.mu, self.sigma, constraints=['sum_to_one', 'leverage_limit'], lev_limit=2)
+        self.assertNotIn('iterations', res)
+        self.assertEqual(res['status'], cp.OPTIMAL)
+
+    def test_rolling_factor_exposures(self):
+        """ Incremental rolling and exponentially weighted exposures match a least squares fit per window """
+        from portfolio_optimization.rolling_factor_exposures import RollingFactorExposures
+        import pandas as pd
+
+        num_dates, num_assets, window, halflife = 80, 6, 30, 10
+        dates = pd.bdate_range('2020-01-01', periods=num_dates)
+        df_factors = pd.DataFrame(np.random.randn(num_dates, 3) * 0.01, index=dates, columns=['MKT', 'SMB', 'HML'])
+        df_rets = pd.DataFrame(df_factors.to_numpy() @ np.random.randn(3, num_assets) +
+                               np.random.randn(num_dates, num_assets) * 0.01 + 0.001, index=dates)
+        X = np.column_stack([np.ones(num_dates), df_factors.to_numpy()])
+        Y = df_rets.to_numpy()
+
+        rolling = RollingFactorExposures(window=window)(df_rets, df_factors.iloc[5:])
+        self.assertEqual(rolling['exposures'].shape, (num_dates - 5, num_assets, 3))
+        self.assertTrue(np.isnan(rolling['exposures'][:window - 1]).all())
+        for t in [window - 1, 50, num_dates - 6]:
+            rows = slice(t + 5 - window + 1, t + 6)
+            coefs = np.linalg.lstsq(X[rows], Y[rows], rcond=None)[0]
+            self.assertTrue(np.allclose(rolling['exposures'][t], coefs[1:].T))
+            self.assertTrue(np.allclose(rolling['alpha'][t], coefs[0]))
+
+        full = RollingFactorExposures()(df_rets, df_factors)
+        self.assertTrue(np.allclose(full['exposures'][-1], np.linalg.lstsq(X, Y, rcond=None)[0][1:].T))
+
+        for kwargs in [{'halflife': halflife}, {'halflife': halflife, 'window': window}]:
+            ew = RollingFactorExposures(**kwargs)(df_rets, df_factors)
+            start = num_dates - kwargs.get('window', num_dates)
+            sqrt_weights = np.sqrt(0.5 ** (np.arange(num_dates - 1 - start, -1, -1) / halflife))[:, None]
+            coefs = np.linalg.lstsq(X[start:] * sqrt_weights, Y[start:] * sqrt_weights, rcond=None)[0]
+            self.assertTrue(np.allclose(ew['exposures'][-1], coefs[1:].T))
+
+        # X'X of the first dates is singular with fewer observations than regressors
+        early = RollingFactorExposures(min_periods=2)(df_rets, df_factors)
+        self.assertTrue(np.isnan(early['exposures'][:3]).all())
+        self.assertTrue(np.allclose(early['exposures'][3], np.linalg.lstsq(X[:4], Y[:4], rcond=None)[0][1:].T))
+
+        # and on the dates whose whole window misses a factor
+        df_gap = df_factors.copy()
+        df_gap.iloc[:40, 1] = 0
+        gap = RollingFactorExposures(window=window)(df_rets, df_gap)
+        self.assertTrue(np.isnan(gap['exposures'][:40]).all())
+        self.assertFalse(np.isnan(gap['exposures'][40:]).any())
+
+    def test_critical_line_tied_returns(self):
+        """ Assets tied for the highest return all start on the frontier, and all tied gives the minimum variance """
+        from portfolio_optimization.critical_line import CriticalLineAlgorithm
+
+        def cvxpy_weights(mu, sigma, gamma):
+            w = cp.Variable(len(mu))
+            cp.Problem(cp.Maximize(mu @ w - gamma * cp.quad_form(w, sigma)), [cp.sum(w) == 1, w >= 0]).solve()
+            return w.value
+
+        cla = CriticalLineAlgorithm([0.1, 0.1, 0.05], np.eye(3))
+        self.assertTrue(np.allclose(cla.weights_at_gamma(1), [0.34166667, 0.34166667, 0.31666667]))
+
+        mu = self.mu.ravel().copy()
+        mu[:3] = mu.max()
+        cla = CriticalLineAlgorithm(mu, self.sigma)
+        for gamma in [0.01, 0.1, 1, 10]:
+            self.assertTrue(np.allclose(cla.weights_at_gamma(gamma)[0], cvxpy_weights(mu, self.sigma, gamma),
+                                        atol=1e-5))
+
+        cla = CriticalLineAlgorithm(np.full(self.n, 0.1), self.sigma)
+        self.assertTrue(np.allclose(cla.weights_at_gamma(0.01)[0], cvxpy_weights(np.zeros(self.n), self.sigma, 1),
+                                    atol=1e-5))
@@ -0,0 +1,181 @@
+import numpy as np
+from black_scholes_merton import BSM_pricing_value
+
+
+class VolatilitySurface:
+    """ Implied volatility surface interpolated in total variance over a precomputed (maturity, strike) grid """
+
+    def __init__(self, strikes, maturities, vols):
+        """
+        Builds the surface from quoted (strike, maturity, vol) points.
+
+        Each maturity slice is interpolated in total variance (w = sigma^2 * t) onto a common strike grid.  Total
+        variance is then forced to be non-decreasing in maturity per strike, which removes calendar arbitrage, and the
+        strike slopes and maturity steps of every grid cell are precomputed so lookups are a searchsorted plus a
+        multiply-add.  Only calendar arbitrage is enforced: the quotes are not checked or corrected for butterfly
+        (strike convexity) arbitrage.
+
+        Args:
+            strikes: <np.ndarray> of quoted strike prices
+            maturities: <np.ndarray> of quoted years to maturity, same length as strikes
+            vols: <np.ndarray> of quoted implied volatilities, same length as strikes
+        """
+        strikes, maturities, vols = (np.asarray(x, dtype=float).ravel() for x in (strikes, maturities, vols))
+        assert len(strikes) == len(maturities) == len(vols)
+        assert (maturities > 0).all() and (vols > 0).all()
+
+        # quotes are kept per maturity slice so a single slice can be replaced without touching the others
+        self.slices = {t: (strikes[maturities == t], vols[maturities == t]) for t in np.unique(maturities)}
+        self.build()
+
+    def build(self):
+        """ Full rebuild of the strike/maturity grid and interpolation coefficients from self.slices """
+        self.maturity_grid = np.array(sorted(self.slices))
+        self.strike_grid = np.unique(np.concatenate([k for k, _ in self.slices.values()]))
+
+        self.raw_total_var = np.vstack([self.slice_total_variance(t) for t in self.maturity_grid])
+        self.total_var = np.empty_like(self.raw_total_var)
+        self.enforce_calendar_arbitrage(0)
+
+    def slice_total_variance(self, maturity):
+        """
+        Total variance of one maturity slice on the common strike grid, flat extrapolated beyond the quoted strikes
+
+        Args:
+            maturity: <float> maturity of the slice
+
+        Returns:
+            <np.ndarray> of total variance per strike in self.strike_grid
+        """
+        k, v = self.slices[maturity]
+        order = np.argsort(k)
+        return np.interp(self.strike_grid, k[order], v[order] ** 2 * maturity)
+
+    def enforce_calendar_arbitrage(self, start_idx):
+        """
+        Make total variance non-decreasing in maturity from start_idx onwards and refresh the precomputed slopes
+
+        Args:
+            start_idx: <int> first maturity row that changed, rows before it are left untouched
+        """
+        if start_idx == 0:
+            self.total_var[0] = self.raw_total_var[0]
+            start_idx = 1
+
+        if start_idx < len(self.maturity_grid):
+            # running max down the maturity axis, seeded with the last unchanged row
+            self.total_var[start_idx - 1:] = np.maximum.accumulate(
+                np.vstack([self.total_var[start_idx - 1], self.raw_total_var[start_idx:]]), axis=0)
+
+        # slopes per grid cell, padded with a zero slope for flat extrapolation past the last node
+        self.strike_slope = np.zeros_like(self.total_var)
+        self.strike_slope[:, :-1] = np.diff(self.total_var, axis=1) / np.diff(self.strike_grid)
+        self.inv_maturity_step = np.zeros(len(self.maturity_grid))
+        self.inv_maturity_step[:-1] = 1 / np.diff(self.maturity_grid)
+
+    def update_slice(self, maturity, strikes, vols):
+        """
+        Replace (or add) the quotes of a single maturity slice.  The previous quotes of the slice are discarded
+        entirely, so the result is the same as rebuilding the surface from all the current quotes.
+
+        If the strike grid is unchanged (the new strikes are on the grid, and every strike the old slice quoted is
+        still quoted by some slice) only this slice and the maturities after it are recomputed, otherwise the whole
+        grid is rebuilt.
+
+        Args:
+            maturity: <float> years to maturity of the slice
+            strikes: <np.ndarray> of quoted strike prices
+            vols: <np.ndarray> of quoted implied volatilities
+        """
+        strikes, vols = np.asarray(strikes, dtype=float).ravel(), np.asarray(vols, dtype=float).ravel()
+        assert len(strikes) == len(vols) and maturity > 0 and (vols > 0).all()
+
+        is_new_maturity = maturity not in self.slices
+        self.slices[maturity] = (strikes, vols)
+
+        # a strike quoted only by the old slice would otherwise stay on the grid as a stale node
+        strike_grid = np.unique(np.concatenate([k for k, _ in self.slices.values()]))
+        if is_new_maturity or not np.array_equal(strike_grid, self.strike_grid):
+            self.build()
+            return
+
+        idx = np.searchsorted(self.maturity_grid, maturity)
+        self.raw_total_var[idx] = self.slice_total_variance(maturity)
+        self.enforce_calendar_arbitrage(idx)
+
+    def total_variance(self, K, t):
+        """
+        Vectorized total variance lookup
+
+        Args:
+            K: <np.ndarray> or <float> strike prices
+            t: <np.ndarray> or <float> years to maturity, broadcastable against K
+
+        Returns:
+            <np.ndarray> of total variance per (K, t) pair
+        """
+        K, t = np.broadcast_arrays(np.asarray(K, dtype=float), np.asarray(t, dtype=float))
+
+        # strike cell and distance into the cell, flat outside of the grid
+        K_clip = np.clip(K, self.strike_grid[0], self.strike_grid[-1])
+        k_idx = np.clip(np.searchsorted(self.strike_grid, K_clip, side='right') - 1, 0, len(self.strike_grid) - 1)
+        dK = K_clip - self.strike_grid[k_idx]
+
+        # maturity cell, linear in total variance between slices and constant vol outside of the quoted maturities
+        t_clip = np.clip(t, self.maturity_grid[0], self.maturity_grid[-1])
+        t_idx = np.clip(np.searchsorted(self.maturity_grid, t_clip, side='right') - 1, 0, len(self.maturity_grid) - 1)
+        dt = t_clip - self.maturity_grid[t_idx]
+
+        w_lower = self.total_var[t_idx, k_idx] + self.strike_slope[t_idx, k_idx] * dK
+        t_next = np.minimum(t_idx + 1, len(self.maturity_grid) - 1)
+        w_upper = self.total_var[t_next, k_idx] + self.strike_slope[t_next, k_idx] * dK
+        w = w_lower + (w_upper - w_lower) * self.inv_maturity_step[t_idx] * dt
+
+        return w * t / t_clip
+
+    def __call__(self, K, t):
+        """
+        Vectorized implied volatility lookup
+
+        Args:
+            K: <np.ndarray> or <float> strike prices
+            t: <np.ndarray> or <float> years to maturity, broadcastable against K
+
+        Returns:
+            <np.ndarray> of implied volatilities per (K, t) pair
+        """
+        t = np.asarray(t, dtype=float)
+        return np.sqrt(self.total_variance(K, t) / t)
+
+    def price_calls(self, S, K, r, t):
+        """
+        Price a batch of European calls with per-contract volatilities pulled from the surface
+
+        Args:
+            S: <float> or <np.ndarray> underlying asset price
+            K: <np.ndarray> strike prices
+            r: <float> or <np.ndarray> annualized risk-free interest rate
+            t: <np.ndarray> years to maturity
+
+        Returns:
+            <np.ndarray> of call option prices
+        """
+        return BSM_pricing_value(S, K, r, t, self(K, t))
+
+
+if __name__ == '__main__':
+    strikes = np.tile([80, 90, 100, 110, 120], 3)
+    maturities = np.repeat([0.25, 0.5, 1], 5)
+    vols = np.array([0.30, 0.26, 0.23, 0.22, 0.23,
+                     0.28, 0.25, 0.22, 0.21, 0.22,
+                     0.26, 0.24, 0.21, 0.20, 0.21])
+
+    surface = VolatilitySurface(strikes, maturities, vols)
+
+    K = np.random.uniform(75, 125, 10000)
+    t = np.random.uniform(0.1, 1.5, 10000)
+    print(surface(K, t)[:5])
+    print(surface.price_calls(100, K, 0.05, t)[:5])
+
+    surface.update_slice(0.5, [80, 90, 100, 110, 120], [0.29, 0.26, 0.24, 0.22, 0.23])
+    print(surface(100, 0.5))